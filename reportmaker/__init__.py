@@ -1,9 +1,9 @@
 import os
 import pathlib
-from pkg_resources import resource_string
 
 
 def copy_config():
+    from pkg_resources import resource_string
     files = {
         'data/config.json': 'config.json',
         'data/test/chinook.sqlite': 'test/chinook.sqlite',
@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 
+import os
 import sys
-import json
 import importlib
 from formats import ReportError
 
@@ -10,62 +10,143 @@ from formats import ReportError
 ########################################################################################################################
 
 
+def document_class(document_format: str) -> type:
+    """
+    Document class of format
+
+    :param document_format: document format
+    :type document_format: str
+    :return: document class
+    :rtype: type
+    """
+    from reportmaker.config import translate as _
+
+    # Get module for selected format
+    try:
+        module = importlib.import_module(f'formats.{document_format}')
+    except ModuleNotFoundError:
+        raise ReportError(f"{_('module')} {_('for')} {document_format} {_('not implemented')}")
+
+    # Get class for selected format
+    format_class = f'{document_format[0].upper()}{document_format[1:]}Document'
+    if not hasattr(module, format_class):
+        raise ReportError(
+            f"{_('class')} {format_class} {_('for')} {document_format} format {_('not implemented')}")
+    return getattr(module, format_class)
+
+
+def generate_report() -> str or list:
+    """
+    Generate document by descriptor of command line parameters (input, parameters, output, database).
+    Document format is command line 'formats' or descriptor['document']['format'] (format, list of formats or
+    comma separated formats). Documents of several formats are generated one by one from shared data (every sql
+    data block is fetched once), elements which format can not create are skipped in it.
+    Errors are raised, not handled
+
+    :return: document file name (list of file names for several formats)
+    :rtype: str or list
+    """
+    from reportmaker.utils.stats import run_stats
+    from reportmaker.utils.cache import plan_cache
+    from reportmaker.utils.plan import DescriptorPlan
+    from reportmaker.utils.helpers import parse_parameters
+    from reportmaker.config import translate as _, logger, cmd_args
+    run_stats.reset()
+    logger.info(_(f"loading report descriptor '{cmd_args.input}'"))
+
+    # Load descriptor (compiled descriptor is cached, only parameters are bound)
+    plan = plan_cache.load(cmd_args.input, DescriptorPlan)
+    descriptor = plan.bind(parse_parameters(cmd_args.parameters))
+    if not descriptor.get('document', None):
+        raise ReportError(f"{_('attribute')} descriptor['document'] {_('expected')}")
+
+    # Get document formats
+    document_formats = getattr(cmd_args, 'formats', None) or descriptor['document'].get('format', None)
+    if isinstance(document_formats, str):
+        document_formats = [x.strip() for x in document_formats.split(',') if x.strip()]
+    if not document_formats:
+        raise ReportError(f"{_('attribute')} descriptor['document']['format'] {_('expected')}")
+    if len(document_formats) == 1:
+        return _generate_document(document_class(document_formats[0]), descriptor, plan)
+
+    # Several formats: descriptor is bound for every document (layout is changed by document), data is shared
+    classes = [document_class(document_format) for document_format in document_formats]
+    fetched, file_names = {}, []
+    for i, (document_format, format_class) in enumerate(zip(document_formats, classes)):
+        if i:
+            run_stats.reset()
+            descriptor = plan.bind(parse_parameters(cmd_args.parameters))
+        document = descriptor['document']
+        document['format'] = document_format
+        if document.get('file_name', None):
+            document['file_name'] = f"{os.path.splitext(document['file_name'])[0]}.{document_format}"
+        layout = document.get('layout', None) or []
+        builders = [f"create_{str(element['type']).lower()}" if isinstance(element, dict) and element.get('type')
+                    else None for element in layout]
+        skipped = {builder for builder in builders if builder and not hasattr(format_class, builder)}
+        if skipped:
+            logger.warning(f"{_('elements')} {', '.join(sorted(skipped))} {_('skipped')} {_('for')} {document_format}")
+            document['layout'] = [element for element, builder in zip(layout, builders) if builder not in skipped]
+            if hasattr(descriptor, 'plan'):
+                descriptor.plan = None
+        file_names.append(_generate_document(format_class, descriptor, plan, fetched))
+    return file_names
+
+
+def _generate_document(format_class: type, descriptor: dict, plan: object, fetched: dict = None) -> str:
+    """
+    Generate document of format
+
+    :param format_class: document class
+    :type format_class: type
+    :param descriptor: document descriptor
+    :type descriptor: dict
+    :param plan: compiled descriptor
+    :type plan: DescriptorPlan
+    :param fetched: results of sql data blocks, shared by documents of several formats
+    :type fetched: dict
+    :return: document file name
+    :rtype: str
+    """
+    from reportmaker.config import translate as _, logger, cmd_args
+    document_format = descriptor['document']['format']
+    if getattr(descriptor, 'plan', None):
+        for builder in plan.builders:
+            if builder and not hasattr(format_class, builder):
+                raise ReportError(f"{_('method')} '{builder}' {_('not implemented')} {_('for class')} "
+                                  f"{format_class.__name__}")
+    document = format_class(descriptor, fetched)
+
+    # Generate and save document
+    try:
+        document.generate_document()
+        logger.info(f"{_('document')} {_('with')} {_('descriptor')} {cmd_args.input} {_('created')} "
+                    f"{_('and')} {_('saved to')} {_('file')} {_(cmd_args.output)}")
+    except AttributeError as e:
+        raise ReportError(f"{_('in')} {_('class')} {format_class.__name__} {_('for')} {document_format} "
+                          f"format some method {_('not implemented')} ({str(e)})")
+    return document._file_name
+
+
 def main():
     sys.path.append('../')
     sys.path.append('/app')
-    from reportmaker.utils.helpers import error_handler
+    from reportmaker.utils.helpers import error_handler, send_callback
+    from reportmaker.utils.pool import connection_pool
+    from reportmaker.utils.cache import query_cache, chart_cache
     from reportmaker.config import translate as _, logger, cmd_args
-    logger.info(_(f"loading report descriptor '{cmd_args.input}'"))
     try:
-        with open(cmd_args.input) as descriptor_file:
-
-            # Load descriptor
-            descriptor_string = descriptor_file.read()
-            for parm in cmd_args.parameters:
-                key = parm.split('=')[0]
-                value = parm.split('=')[1][:-1]
-                descriptor_string = descriptor_string.replace('{{' + key + '}}', value)
-            descriptor = json.loads(descriptor_string)
-            if not descriptor.get('document', None):
-                raise ReportError(f"{_('attribute')} descriptor['document'] {_('expected')}")
-
-            # Get document format
-            document_format = descriptor['document'].get('format', None)
-            if not document_format:
-                raise ReportError(f"{_('attribute')} descriptor['document']['format'] {_('expected')}")
-
-            # Get module for selected format
-            try:
-                module = importlib.import_module(f'formats.{document_format}')
-            except ModuleNotFoundError:
-                error_handler(
-                    logger, ReportError(
-                        f"{_('module')} {_('for')} {document_format} {_('not implemented')}"
-                    ), '', cmd_args, sys_exit=True, debug_info=True)
-
-            # Get class for selected format
-            try:
-                format_class = f'{document_format[0].upper()}{document_format[1:]}Document'
-                document = getattr(module, format_class)(descriptor)
-            except AttributeError:
-                error_handler(
-                    logger, ReportError(
-                        f"{_('class')} {format_class} {_('for')} {document_format} format {_('not implemented')}"
-                    ), '', cmd_args, sys_exit=True, debug_info=True)
-
-            # Generate and save document
-            try:
-                document.generate_document()
-                logger.info(f"{_('document')} {_('with')} {_('descriptor')} {cmd_args.input} {_('created')} "
-                            f"{_('and')} {_('saved to')} {_('file')} {_(cmd_args.output)}")
-            except AttributeError as e:
-                error_handler(
-                    logger, ReportError(
-                        f"{_('in')} {_('class')} {format_class} {_('for')} {document_format} "
-                        f"format some method {_('not implemented')} ({str(e)})"
-                    ), '', cmd_args, sys_exit=True, debug_info=True)
+        file_name = generate_report()
+        if cmd_args.token:
+            send_callback(logger, cmd_args.callback_url, cmd_args.token, {'status': 'ok', 'file': file_name})
     except Exception as e:
         error_handler(logger, e, '', cmd_args, sys_exit=True, debug_info=True)
+    finally:
+        connection_pool.close()
+        if query_cache.hits or query_cache.misses:
+            logger.info(f"{_('query cache')}: {query_cache.hits} {_('hits')}, {query_cache.misses} {_('misses')}")
+        if chart_cache.hits or chart_cache.misses:
+            logger.info(f"{_('chart cache')}: {chart_cache.hits} {_('hits')}, {chart_cache.misses} {_('misses')}")
 
 ########################################################################################################################
 #                                                  Entry point                                                         #
@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+
+import sys
+import json
+import time
+import argparse
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+########################################################################################################################
+#                                                   Batch mode                                                         #
+########################################################################################################################
+
+# Manifest: {"workers": 4, "per_database": 2, "defaults": {...}, "jobs": [job, ...]} or list of jobs.
+# Job: {"id": ..., "input": descriptor, "parameters": {...} or ["key=value,", ...], "output": ..., "database": ...,
+# "formats": [...], "full": ..., "token": ..., "callback_url": ..., "frequency": ..., "progress": ...}, omitted keys
+# are taken from "defaults" and then from command line
+JOB_KEYS = ('input', 'parameters', 'output', 'database', 'formats', 'full', 'token', 'callback_url', 'frequency',
+            'progress')
+
+parser = argparse.ArgumentParser(prog='report-batch',
+                                 description='other options are passed to report (see report -h)')
+parser.add_argument('-m', '--manifest', help='manifest file (json)', required=True)
+parser.add_argument('-w', '--workers', type=int, help='worker processes, 0 - run jobs in this process')
+parser.add_argument('--per-database', dest='per_database', type=int,
+                    help='maximum running jobs per database, 0 - no limit')
+parser.add_argument('-s', '--status', help='jobs status file (json), default: stdout')
+
+
+def load_manifest(file_name: str) -> dict:
+    """
+    Load manifest, job keys are completed by manifest defaults
+
+    :param file_name: manifest file name
+    :type file_name: str
+    :return: manifest ({"workers": ..., "per_database": ..., "jobs": [...]})
+    :rtype: dict
+    """
+    with open(file_name) as manifest_file:
+        manifest = json.load(manifest_file)
+    if isinstance(manifest, list):
+        manifest = {'jobs': manifest}
+    defaults = manifest.get('defaults', {})
+    manifest['jobs'] = [{**defaults, **job} for job in manifest.get('jobs', [])]
+    for i, job in enumerate(manifest['jobs']):
+        if 'input' not in job:
+            raise ValueError(f'job {i}: input expected')
+        job.setdefault('id', i)
+    return manifest
+
+
+def run_job(job: dict, output_roots: list = None) -> dict:
+    """
+    Generate document of job. Job keys replace command line parameters while job runs, errors (including exit of
+    error handler) are reported in job status. If job has token, status is sent to callback url (unless error
+    handler has sent it on exit)
+
+    :param job: job
+    :type job: dict
+    :param output_roots: directories, which output file must be inside (report server jobs), None - any
+    :type output_roots: list
+    :return: job status ({"id": ..., "input": ..., "status": "ok" or "error", "file": ..., "error": ...,
+             "duration": ...})
+    :rtype: dict
+    """
+    from reportmaker.__main__ import generate_report
+    from reportmaker.utils.helpers import error_handler, send_callback
+    from reportmaker.config import translate as _, logger, cmd_args
+    saved = vars(cmd_args).copy()
+    status = {'id': job['id'], 'input': job['input'], 'status': 'error', 'file': None, 'error': None}
+    start = time.perf_counter()
+    try:
+        for key in JOB_KEYS:
+            if key in job:
+                setattr(cmd_args, key, job[key])
+        cmd_args.output_roots = output_roots
+        status['file'] = generate_report()
+        status['status'] = 'ok'
+    except SystemExit as e:
+        status['error'] = f"{_('error termination')} ({e.code})"
+    except Exception as e:
+        error_handler(logger, e, f"{_('job')} {job['id']} ", cmd_args, debug_info=True)
+        status['error'] = str(e)
+    status['duration'] = round(time.perf_counter() - start, 6)
+    if cmd_args.token:
+        send_callback(logger, cmd_args.callback_url, cmd_args.token,
+                      {key: value for key, value in status.items() if key != 'input'})
+    vars(cmd_args).update(saved)
+    return status
+
+
+def _init_worker(argv: list, preload: list = ()):
+    """
+    Configure worker process
+
+    :param argv: command line arguments of report
+    :type argv: list
+    :param preload: formats, which modules are imported in advance
+    :type preload: list
+    """
+    from reportmaker.config import configure
+    configure(argv)
+    from reportmaker.config import logger
+    for document_format in preload:
+        try:
+            importlib.import_module(f'formats.{document_format}')
+        except ImportError as e:
+            logger.warning(f'format {document_format} is not preloaded: {e}')
+
+
+def _database(job: dict) -> str:
+    """
+    Database of job (named connection is resolved by configuration)
+
+    :param job: job
+    :type job: dict
+    :return: connection string
+    :rtype: str
+    """
+    from reportmaker.config import config_args, cmd_args
+    database = job.get('database', cmd_args.database)
+    return config_args.get('connections', {}).get(database, database)
+
+
+def run_batch(jobs: list, workers: int, per_database: int, argv: list) -> list:
+    """
+    Run jobs in this process (workers < 1) or by pool of worker processes. Worker processes live during batch, so
+    connections pool and caches are warm for next jobs. Jobs of one database (job 'database', otherwise command
+    line connection) run not more than per_database at once
+
+    :param jobs: jobs
+    :type jobs: list
+    :param workers: worker processes
+    :type workers: int
+    :param per_database: maximum running jobs per database, 0 - no limit
+    :type per_database: int
+    :param argv: command line arguments of report (for worker processes)
+    :type argv: list
+    :return: jobs statuses (in jobs order)
+    :rtype: list
+    """
+    if workers < 1:
+        return [run_job(job) for job in jobs]
+    statuses, pending, running, busy = [None] * len(jobs), list(enumerate(jobs)), {}, {}
+    context = multiprocessing.get_context(
+        'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(argv,)) as executor:
+        while pending or running:
+            for item in list(pending):
+                if len(running) >= workers:
+                    break
+                key = _database(item[1])
+                if per_database and busy.get(key, 0) >= per_database:
+                    continue
+                pending.remove(item)
+                busy[key] = busy.get(key, 0) + 1
+                running[executor.submit(run_job, item[1])] = item[0], key
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, key = running.pop(future)
+                busy[key] -= 1
+                try:
+                    statuses[index] = future.result()
+                except Exception as e:
+                    statuses[index] = {'id': jobs[index]['id'], 'input': jobs[index]['input'], 'status': 'error',
+                                       'file': None, 'error': str(e), 'duration': None}
+    return statuses
+
+
+def main():
+    sys.path.append('../')
+    sys.path.append('/app')
+    batch_args, argv = parser.parse_known_args()
+    argv += ['-i', batch_args.manifest]
+    from reportmaker.utils.pool import connection_pool
+    from reportmaker.utils.cache import query_cache
+    from reportmaker.config import configure, translate as _
+    configure(argv)
+    from reportmaker.config import logger, cmd_args
+    try:
+        manifest = load_manifest(batch_args.manifest)
+    except (OSError, ValueError) as e:
+        logger.error(f"{_('manifest')} {batch_args.manifest}: {e}")
+        sys.exit(1)
+    if not batch_args.status:
+        # Statuses are written to stdout, so progress lines go to stderr
+        if cmd_args.progress == 'stdout':
+            argv += ['--progress', 'stderr']
+            cmd_args.progress = 'stderr'
+        for job in manifest['jobs']:
+            if job.get('progress') == 'stdout':
+                job['progress'] = 'stderr'
+    workers = batch_args.workers if batch_args.workers is not None else manifest.get('workers', 0)
+    per_database = batch_args.per_database if batch_args.per_database is not None else \
+        manifest.get('per_database', 0)
+    try:
+        statuses = run_batch(manifest['jobs'], workers, per_database, argv)
+    finally:
+        connection_pool.close()
+    failed = sum(status['status'] != 'ok' for status in statuses)
+    logger.info(f"{_('batch')} {batch_args.manifest}: {len(statuses) - failed} {_('jobs')} {_('done')}, "
+                f"{failed} {_('failed')}")
+    if query_cache.hits or query_cache.misses:
+        logger.info(f"{_('query cache')}: {query_cache.hits} {_('hits')}, {query_cache.misses} {_('misses')}")
+    if batch_args.status:
+        with open(batch_args.status, 'w') as status_file:
+            json.dump(statuses, status_file, ensure_ascii=False, indent=4)
+    else:
+        print(json.dumps(statuses, ensure_ascii=False, indent=4))
+    sys.exit(1 if failed else 0)
+
+########################################################################################################################
+#                                                  Entry point                                                         #
+########################################################################################################################
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,10 @@
 import os
+import sys
 import logging
 import argparse
 import builtins
+from reportmaker.utils.cache import query_cache, chart_cache
+from reportmaker.utils.pool import connection_pool
 from reportmaker.utils.helpers import set_config, activate_virtual_environment, set_localization, get_logger
 
 ########################################################################################################################
@@ -16,51 +19,110 @@ parser.add_argument('-o', '--output', help='output directory', default='/tmp')
 # parser.add_argument('-r', '--reports', help='reports directory', default='~/.report/reports/')
 parser.add_argument('-p', '--parameters', nargs='*', help='report parameters list', default=[])
 # parser.add_argument('-n', '--name', help='report name', required=True)
+parser.add_argument('-t', '--formats', nargs='+', help='document formats (instead of descriptor format), data is '
+                                                     'fetched once for all formats')
 parser.add_argument('-k', '--token', help='unique token for frontend', default='')
 parser.add_argument('-b', '--callback_url', help='callback url', default='http://localhost:8080')
 parser.add_argument('-d', '--database', help='database connection string')
 # parser.add_argument('-q', '--sql', help='sql statement')
 # parser.add_argument('-e', '--headings', help='headings', nargs='*', default=[])
-# parser.add_argument('-f', '--frequency', help='callback frequency', default=10)
+parser.add_argument('-f', '--frequency', type=float, help='progress frequency (seconds), 0 - no progress', default=10)
+parser.add_argument('--progress', help='progress sink: callback, stdout, stderr or status file name (default: '
+                                       'callback, if token is set)')
+parser.add_argument('--no-cache', dest='no_cache', action='store_true', help='do not use query results cache')
+parser.add_argument('--refresh', action='store_true', help='run queries and refresh query results cache')
+parser.add_argument('--full', action='store_true', help='rebuild incremental export (ignore its watermark)')
+parser.add_argument('--run-report', dest='run_report', action='store_true',
+                    help='write execution statistics to <document>.run.json')
 parser.add_argument('-l', '--log_level', help='logging level: CRITICAL, ERROR, WARNING, INFO, DEBUG or NOTSET',
                     default='INFO')
 
-cmd_args = parser.parse_args()
-# cmd_args.reports = cmd_args.reports.replace('~', home)
-# cmd_args.output = cmd_args.output.replace('~', home)
-config_args = set_config(cmd_args.config.replace('~', home))
+# Settings (cmd_args, config_args, logger and arguments, which they are configured by) are set by configure():
+# explicitly or on first access
+_translation = None
 
-########################################################################################################################
-#                                                  Localization                                                        #
-########################################################################################################################
 
-set_localization(**config_args)
-translate = _ = builtins.__dict__.get('_', lambda x: x)
+def __getattr__(name: str):
+    """
+    Configure on first access of settings, so import of module does not parse commandline and read config
 
+    :param name: attribute name
+    :type name: str
+    :return: attribute value
+    """
+    if name in ('cmd_args', 'config_args', 'logger', 'arguments'):
+        configure()
+        return globals()[name]
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
-########################################################################################################################
-#                                                    Logging                                                           #
-########################################################################################################################
 
-try:
-    log_level, level_error = logging._nameToLevel[cmd_args.log_level], False
-except KeyError:
-    level_error = True
-    log_level = logging._nameToLevel['INFO']
-logger = get_logger('report', config_args.get("log_format", "%(levelname)-10s|%(asctime)s|"
-                                                            "%(process)d|%(thread)d| %(name)s --- "
-                                                            "%(message)s (%(filename)s:%(lineno)d)"),
-                    config_args.get('log_file', '~/.report/report.log').replace('~', home), log_level)
-if level_error:
-    logger.warning('%s \'%s\', %s \'INFO\' %s' % (_('incorrect logging level'), cmd_args.log_level, _('used'),
-                                                  _('by default')))
-    cmd_args.log_level = 'INFO'
+def configure(argv: list = None) -> argparse.Namespace:
+    """
+    Parse commandline, read config, create logger, set up connection pool and caches
+
+    :param argv: commandline arguments (default: sys.argv[1:])
+    :type argv: list
+    :return: commandline parameters
+    :rtype: argparse.Namespace
+    """
+    global cmd_args, config_args, logger, arguments
+    arguments = list(sys.argv[1:] if argv is None else argv)
+    cmd_args = parser.parse_args(arguments)
+    config_args = set_config(cmd_args.config.replace('~', home))
+
+    # Logging
+    try:
+        log_level, level_error = logging._nameToLevel[cmd_args.log_level], False
+    except KeyError:
+        level_error = True
+        log_level = logging._nameToLevel['INFO']
+    logger = get_logger('report', config_args.get("log_format", "%(levelname)-10s|%(asctime)s|"
+                                                                "%(process)d|%(thread)d| %(name)s --- "
+                                                                "%(message)s (%(filename)s:%(lineno)d)"),
+                        config_args.get('log_file', '~/.report/report.log').replace('~', home), log_level)
+    if level_error:
+        logger.warning('%s \'%s\', %s \'INFO\' %s' % (_('incorrect logging level'), cmd_args.log_level, _('used'),
+                                                      _('by default')))
+        cmd_args.log_level = 'INFO'
+
+    # Virtual environment
+    if config_args.get('environment') != "":
+        activate_virtual_environment(**config_args)
+        logger.info('%s \'%s\'' % (_('activated virtual environment'), config_args.get('environment')))
+
+    # Connection pool
+    connection_pool.size = config_args.get('pool_size', connection_pool.size)
+
+    # Query results cache
+    query_cache.directory = config_args.get('cache', {}).get('directory', query_cache.directory).replace('~', home)
+    query_cache.max_size = config_args.get('cache', {}).get('max_size', query_cache.max_size)
+
+    # Charts cache
+    chart_cache.directory = config_args.get('chart_cache', {}).get('directory', chart_cache.directory).replace(
+        '~', home)
+    chart_cache.max_size = config_args.get('chart_cache', {}).get('max_size', chart_cache.max_size)
+    return cmd_args
 
 
 ########################################################################################################################
-#                                               Virtual environment                                                    #
+#                                                  Localization                                                        #
 ########################################################################################################################
 
-if config_args.get('environment') != "":
-    activate_virtual_environment(**config_args)
-    logger.info('%s \'%s\'' % (_('activated virtual environment'), config_args.get('environment')))
+
+def translate(message: str) -> str:
+    """
+    Translate message, localization is installed on first call
+
+    :param message: message
+    :type message: str
+    :return: translated message
+    :rtype: str
+    """
+    global _translation
+    if _translation is None:
+        set_localization(**(globals().get('config_args') or __getattr__('config_args')))
+        _translation = builtins.__dict__.get('_', lambda x: x)
+    return _translation(message)
+
+
+_ = translate
@@ -1,16 +1,34 @@
 import os
 import json
+import logging
+from datetime import date, datetime
 from typing import Any
+from concurrent.futures import Future
 from abc import ABC, abstractmethod
-from reportmaker.utils.helpers import error_handler
+from reportmaker.utils.helpers import error_handler, stream_database_data, get_database_data, DataStream, \
+    parse_parameters, inside_roots, ReportError
+from reportmaker.utils.dataset import Dataset
+from reportmaker.utils.pool import RequestLimit
+from reportmaker.utils.plan import PAYLOAD_KEYS
+from reportmaker.utils.styles import style_registry
+from reportmaker.utils.watermark import Watermark
+from reportmaker.utils.stats import run_stats
+from reportmaker.utils.progress import progress
 from reportmaker.config import translate as _, logger, cmd_args, config_args
 
 
-class ReportError(Exception):
-    """
-    Custom exception
-    """
-    pass
+# Keys of dataset reference which select a part of shared dataset
+VIEW_KEYS = ('columns', 'rows', 'transpose')
+
+# Converters of declared parameters (document 'parameters') from command line strings
+PARAMETER_TYPES = {
+    'str': str,
+    'int': int,
+    'float': float,
+    'date': date.fromisoformat,
+    'datetime': datetime.fromisoformat,
+    'bool': lambda x: x.lower() in ('1', 'true', 'yes', 'on')
+}
 
 
 class Document(ABC):
@@ -18,28 +36,349 @@ class Document(ABC):
     Abstract document
     """
 
-    def __init__(self, descriptor: dict):
+    # If True, sql data blocks are consumed as DataStream, otherwise as list of rows
+    _streaming = False
+
+    # Incremental export (document 'incremental'): 'append' - new rows are appended to output, 'part' - new rows are
+    # written to new part of output (<document file>.part<n>.<ext>), None - not supported
+    _incremental = None
+
+    def __init__(self, descriptor: dict, fetched: dict = None):
         """
         Constructor
 
         :param descriptor: document descriptor
         :type descriptor: dict
+        :param fetched: results of sql data blocks, shared by documents of one descriptor in several formats
+                        (block key -> Future of Dataset), None - document fetches its own data
+        :type fetched: dict
         """
         self._descriptor = descriptor
-        self._file_name = os.path.join(cmd_args.output, os.path.basename(cmd_args.input).split('.')[0] + '.' +
-                                       descriptor.get('document', {}).get('format', 'tab'))
+        self._fetched = fetched
+        document = descriptor.get('document', {})
+        self._file_name = self._output_file_name(os.path.join(cmd_args.output, document.get('file_name', None) or (
+            os.path.basename(cmd_args.input).split('.')[0] + '.' + document.get('format', 'tab'))))
+        if getattr(cmd_args, 'output_roots', None) and not inside_roots(self._file_name, cmd_args.output_roots):
+            raise ReportError(f"{_('output file')} {self._file_name} {_('is out of allowed directories')}")
         self._styles = {}
         self._layout = []
+        self._prefetched = {}
+        self._limits = {}
+        self._datasets = {}
+        self._single_use = set()
+        self._shared = set()
+        self._watermark = self._load_watermark()
+        self._appending = bool(self._watermark and self._watermark.append and self._incremental == 'append')
+        self._parameters = self._bound_parameters()
 
     def generate_document(self):
         """
         This method generates and save document
         """
         logger.info(_('descriptor is loaded'))
-        if self.__class__.__name__ in ['PdfDocument', 'XlsxDocument']:
-            self._create_styles()
-        self._create_layout()
-        self._create_document()
+        run_stats.info.update(descriptor=cmd_args.input, format=self._descriptor['document'].get('format'),
+                              file=self._file_name, status='error')
+        progress.start(len(self._descriptor['document'].get('layout', None) or []),
+                       getattr(cmd_args, 'frequency', 0) or 0,
+                       getattr(cmd_args, 'progress', None) or ('callback' if cmd_args.token else None), logger,
+                       cmd_args.callback_url, cmd_args.token)
+        appended_size = os.path.getsize(self._file_name) if self._appending and os.path.exists(self._file_name) \
+            else None
+        try:
+            if self.__class__.__name__ in ['PdfDocument', 'XlsxDocument']:
+                progress.set_phase('styles')
+                with run_stats.stage('styles'):
+                    self._create_styles()
+            progress.set_phase('data')
+            self._prefetch_data(self._plan_data())
+            try:
+                progress.set_phase('layout')
+                with run_stats.stage('layout'):
+                    self._create_layout()
+                progress.set_phase('document')
+                with run_stats.stage('document'):
+                    self._create_document()
+            finally:
+                self._release_prefetched()
+            if self._watermark:
+                if self._watermark.append and self._incremental == 'part' and not self._watermark.changed:
+                    logger.info(f"{_('no new rows')}, {_('part')} {self._file_name} {_('removed')}")
+                    os.remove(self._file_name)
+                    self._watermark.parts -= 1
+                    self._file_name = self._watermark.file
+                self._watermark.save(None if self._watermark.append and self._incremental == 'part' else
+                                     self._file_name)
+                run_stats.info.update(watermark=self._watermark.last)
+            run_stats.info.update(status='ok', file_size=os.path.getsize(self._file_name))
+        except BaseException:
+            if appended_size is not None:
+                self._close_output()
+                if os.path.getsize(self._file_name) > appended_size:
+                    os.truncate(self._file_name, appended_size)
+            raise
+        finally:
+            progress.finish(run_stats.info['status'])
+            self._report_stats()
+
+    def _output_file_name(self, file_name: str) -> str:
+        """
+        Final name of output file (format may add extension). It is resolved before incremental export state is loaded
+
+        :param file_name: file name of descriptor (or default one)
+        :type file_name: str
+        :return: output file name
+        :rtype: str
+        """
+        return file_name
+
+    def _load_watermark(self) -> Watermark or None:
+        """
+        Watermark of incremental export (document 'incremental': {"column": ..., "parameter": ...}). Watermark is
+        bound to declared parameter ('watermark' by default), sql must select rows after it. Output is appended
+        (or new part is written) if previous export exists, command line option --full rebuilds it
+
+        :return: watermark or None, if export is not incremental
+        :rtype: Watermark or None
+        """
+        options = self._descriptor['document'].get('incremental', None)
+        if not options:
+            return None
+        if not self._incremental:
+            raise ReportError(f"{_('incremental')} {_('export')} {_('not implemented')} {_('for class')} "
+                              f"{self.__class__.__name__}")
+        if not isinstance(options, dict) or not options.get('column', None):
+            raise ReportError(f"{_('attribute')} descriptor['document']['incremental']['column'] {_('expected')}")
+        parameter = options.get('parameter', 'watermark')
+        if parameter not in self._descriptor['document'].get('parameters', {}):
+            raise ReportError(f"{_('parameter')} '{parameter}' {_('of')} {_('incremental')} {_('export')} "
+                              f"{_('must be declared')} {_('in')} descriptor['document']['parameters']")
+        declaration = self._descriptor['document']['parameters'][parameter]
+        watermark = Watermark.load(self._file_name, options['column'], parameter, getattr(cmd_args, 'full', False),
+                                   PARAMETER_TYPES.get(declaration.get('type', 'str') if isinstance(declaration, dict)
+                                                       else declaration))
+        if watermark.append:
+            if self._incremental == 'part':
+                watermark.parts += 1
+                stem, extension = os.path.splitext(self._file_name)
+                self._file_name = f'{stem}.part{watermark.parts}{extension}'
+            logger.info(f"{_('incremental')} {_('export')}: {watermark.column} > {watermark.value}")
+        return watermark
+
+    def _watched(self, data: DataStream or Dataset) -> DataStream or Dataset:
+        """
+        Pass fetched rows to watermark of incremental export
+
+        :param data: sql result
+        :type data: DataStream or Dataset
+        :return: the same sql result
+        :rtype: DataStream or Dataset
+        """
+        if self._watermark:
+            if isinstance(data, DataStream):
+                data.watch(self._watermark.observe)
+            elif isinstance(data, Dataset) and self._watermark.column in data.columns:
+                self._watermark.observe(data.columns, data.rows())
+        return data
+
+    def _close_output(self):
+        """
+        Close output of failed document, which is written before document creation (appended rows are truncated
+        after it)
+        """
+        pass
+
+    def _report_stats(self):
+        """
+        Write execution statistics to log and, with command line option --run-report, to json file next to
+        the document (<document file>.run.json)
+        """
+        run_stats.log(logger)
+        if getattr(cmd_args, 'run_report', False):
+            try:
+                run_stats.save(f'{self._file_name}.run.json')
+            except OSError as e:
+                logger.warning(f"{_('run report')} {_('not saved')}: {e}")
+
+    def _plan_data(self) -> list:
+        """
+        Collect sql data blocks of layout and definitions of referenced datasets (document 'datasets').
+        Dataset which is referenced once without columns/rows/transpose can be streamed, others are fetched once
+        and shared. Blocks of compiled descriptor are taken from its plan
+
+        :return: sql data blocks
+        :rtype: list
+        """
+        datasets = self._descriptor['document'].get('datasets', {})
+        blocks, references = [], {}
+        plan = getattr(self._descriptor, 'plan', None)
+        for block in plan.data_blocks(self._descriptor) if plan else \
+                self._collect_data_blocks(self._descriptor['document'].get('layout', None) or []):
+            if 'dataset' in block:
+                self._dataset_definition(block['dataset'])
+                references.setdefault(block['dataset'], []).append(block)
+            else:
+                blocks.append(block)
+        self._single_use = {
+            name for name, blocks_list in references.items()
+            if len(blocks_list) == 1 and not any(key in blocks_list[0] for key in VIEW_KEYS)
+        }
+        self._shared = {id(datasets[name]) for name in references if name not in self._single_use}
+        return blocks + [datasets[name] for name in references]
+
+    def _prefetch_data(self, blocks: list):
+        """
+        Run all sql data blocks concurrently before layout construction. Number of threads is limited by
+        'prefetch_workers', number of concurrent requests per database by 'prefetch_per_database' (configuration,
+        streamed request holds its slot until stream is closed, see RequestLimit). Results are taken by
+        _get_data/_stream_data.
+
+        :param blocks: sql data blocks
+        :type blocks: list
+        """
+        workers = config_args.get('prefetch_workers', 8)
+        if self._fetched is not None:
+            self._share_data(blocks, workers)
+            return
+        if len(blocks) < 2 or workers < 2:
+            return
+        from concurrent.futures import ThreadPoolExecutor
+        for block in blocks:
+            self._limits.setdefault(self._connection_string(block),
+                                    RequestLimit(config_args.get('prefetch_per_database', 4)))
+        executor = ThreadPoolExecutor(max_workers=min(workers, len(blocks)), thread_name_prefix='prefetch')
+        for block in blocks:
+            fetch = self._open_stream if self._streamed(block) else self._query
+            self._prefetched[id(block)] = executor.submit(self._fetch_limited, fetch, block,
+                                                          self._limits[self._connection_string(block)])
+        executor.shutdown(wait=False)
+        logger.info(f"{len(blocks)} {_('sql requests')} {_('started')}")
+
+    def _share_data(self, blocks: list, workers: int):
+        """
+        Take sql data blocks from results shared by documents of several formats: block, which is not fetched by
+        previous document, is fetched (as Dataset, not stream, because it is read by every document)
+
+        :param blocks: sql data blocks
+        :type blocks: list
+        :param workers: maximum threads
+        :type workers: int
+        """
+        keys = [json.dumps({**block, 'connection': self._connection_string(block), 'parameters': self._parameters},
+                           sort_keys=True, default=str) for block in blocks]
+        missing = {key: block for key, block in zip(keys, blocks) if key not in self._fetched}
+        if missing:
+            from concurrent.futures import ThreadPoolExecutor
+            for block in missing.values():
+                self._limits.setdefault(self._connection_string(block),
+                                        RequestLimit(config_args.get('prefetch_per_database', 4)))
+            executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing))),
+                                          thread_name_prefix='prefetch')
+            for key, block in missing.items():
+                self._fetched[key] = executor.submit(self._fetch_limited, self._query, block,
+                                                     self._limits[self._connection_string(block)])
+            executor.shutdown(wait=False)
+            logger.info(f"{len(missing)} {_('sql requests')} {_('started')}")
+        for key, block in zip(keys, blocks):
+            self._prefetched[id(block)] = self._fetched[key]
+
+    def _streamed(self, data: dict) -> bool:
+        """
+        Data block is consumed as DataStream (prefetched block is opened as stream, not fetched)
+
+        :param data: data descriptor
+        :type data: dict
+        :return: True, if data block is streamed
+        :rtype: bool
+        """
+        return self._streaming and id(data) not in self._shared
+
+    @staticmethod
+    def _fetch_limited(fetch, data: dict, limit: RequestLimit) -> Any:
+        """
+        Fetch data block holding per-database slot (slot of stream is released when stream is closed)
+
+        :param fetch: fetch method
+        :type fetch: Callable
+        :param data: data descriptor
+        :type data: dict
+        :param limit: per-database limit
+        :type limit: RequestLimit
+        :return: fetch result
+        :rtype: Any
+        """
+        held = limit.acquire(id(data))
+        try:
+            result = fetch(data)
+        except BaseException:
+            if held:
+                limit.release()
+            raise
+        if held:
+            if isinstance(result, DataStream):
+                result.on_close(limit.release)
+            else:
+                limit.release()
+        return result
+
+    def _prefetched_result(self, future: Future, data: dict, fetch) -> Any:
+        """
+        Result of prefetched request, which document waits for: request, which is not started, is run by caller,
+        request, which waits for per-database slot, is urged
+
+        :param future: prefetched request
+        :type future: Future
+        :param data: data descriptor
+        :type data: dict
+        :param fetch: fetch method
+        :type fetch: Callable
+        :return: fetch result
+        :rtype: Any
+        """
+        if self._fetched is None and future.cancel():
+            return fetch(data)
+        for limit in self._limits.values():
+            limit.urge(id(data))
+        return future.result()
+
+    def _release_prefetched(self):
+        """
+        Wait for prefetched requests which were not consumed and close their streams
+        """
+        prefetched, self._prefetched = self._prefetched, {}
+        for key, future in prefetched.items():
+            if self._fetched is None and future.cancel():
+                continue
+            for limit in self._limits.values():
+                limit.urge(key)
+            try:
+                result = future.result()
+            except BaseException:
+                continue
+            if isinstance(result, DataStream):
+                result.close()
+
+    @classmethod
+    def _collect_data_blocks(cls, node: Any) -> list:
+        """
+        Collect sql data blocks ({"data": {"sql": [...]}}) and dataset references ({"data": {"dataset": ...}})
+        of descriptor part
+
+        :param node: descriptor part
+        :type node: Any
+        :return: data blocks in layout order
+        :rtype: list
+        """
+        blocks = []
+        if isinstance(node, list):
+            for element in node:
+                blocks.extend(cls._collect_data_blocks(element))
+        elif isinstance(node, dict):
+            for key, value in node.items():
+                if key == 'data' and isinstance(value, dict) and ('sql' in value or 'dataset' in value):
+                    blocks.append(value)
+                elif isinstance(value, (dict, list)):
+                    blocks.extend(cls._collect_data_blocks(value))
+        return blocks
 
     def _create_layout(self):
         """
@@ -49,12 +388,27 @@ class Document(ABC):
         if not layout:
             raise ReportError(f"{_('omitted')} {_('attribute')} 'layout' {_('in')} report descriptor")
         for element in layout:
-            logger.debug("%s '%s'" % (_('creating element '), json.dumps(element, ensure_ascii=False, indent=4)))
-            self._layout.append(self._create_object(element))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("%s '%s'" % (_('creating element '), json.dumps(element, ensure_ascii=False, indent=4,
+                                                                             default=str)))
+            self._layout.append(self._create_element(element))
+            progress.element()
+
+    def _create_element(self, element: dict) -> Any:
+        """
+        Create layout element
+
+        :param element: element descriptor
+        :type element: dict
+        :return: created object
+        :rtype: Any
+        """
+        return self._create_object(element)
 
     def _create_object(self, *args, method_postfix: str = '') -> Any:
         """
-        Create object via descriptor
+        Create object via descriptor. Lists of descriptor are resolved element by element, inline data payloads
+        (see PAYLOAD_KEYS) are not (see _resolve_payload)
 
         :param args: method parameters, descriptor first
         :param method_postfix: method name postfix
@@ -64,20 +418,15 @@ class Document(ABC):
         """
         if len(args) < 1:
             raise ReportError(f"{_('object')} {_('must must have parameters')}")
-        all_keys = args[0].keys() if isinstance(args[0], dict) else []
-        for element in [key for key in all_keys if isinstance(args[0].get(key, None), list)] + ['']:
-            data = args[0].get(element, None) if isinstance(args[0], dict) else args[0]
-            if type(args[0]) not in (dict, list):
-                return data
-            if isinstance(data, list):
-                data = [self._create_object(element) for i, element in enumerate(data)]
-                if isinstance(args[0], dict):
-                    args[0][element] = data
-                else:
-                    return data
+        if isinstance(args[0], list):
+            return [self._create_object(element) for element in args[0]]
         if not isinstance(args[0], dict):
-            raise ReportError(f"{_('object')} {_('must be on some type')}: {_('check parameters')}")
-        object_type = dict(args[0]).get('type', None)
+            return args[0]
+        for key, value in args[0].items():
+            if isinstance(value, list):
+                args[0][key] = self._resolve_payload(value) if key in PAYLOAD_KEYS else \
+                    [self._create_object(element) for element in value]
+        object_type = args[0].get('type', None)
         if not object_type:
             return dict(args[0])
         current_method = f'create_{object_type.lower()}{method_postfix}'
@@ -89,9 +438,26 @@ class Document(ABC):
                                     f"{self.__class__.__name__}"), '', cmd_args, sys_exit=True, debug_info=True
             )
 
+    def _resolve_payload(self, payload: list) -> list:
+        """
+        Resolve inline data payload in place: rows and cells are kept as they are, only objects ({"type": ...}) in
+        place of row or cell are created, so payload is not walked cell by cell through _create_object
+
+        :param payload: inline data (rows of cells or values)
+        :type payload: list
+        :return: payload
+        :rtype: list
+        """
+        for i, row in enumerate(payload):
+            if type(row) is dict:
+                payload[i] = self._create_object(row)
+            elif type(row) is list and dict in map(type, row):
+                payload[i] = [self._create_object(cell) if type(cell) is dict else cell for cell in row]
+        return payload
+
     def _create_styles(self):
         """
-        This method create document's styles
+        This method create document's styles (styles set is compiled once per process, see style_registry)
         """
         styles = self._descriptor['document'].get('styles', None)
         if not styles:
@@ -99,8 +465,202 @@ class Document(ABC):
             if not styles:
                 raise ReportError(f"{_('omitted')} {_('attribute')} 'styles' {_('in')} "
                                   f"report descriptor and 'default_styles' in configuration file")
+        self._styles.update(style_registry.get(self.__class__.__name__, styles, self._compile_styles))
+
+    def _compile_styles(self, styles: dict) -> dict:
+        """
+        Compile styles set
+
+        :param styles: styles descriptors (name -> style)
+        :type styles: dict
+        :return: name -> style object
+        :rtype: dict
+        """
         for name, style in styles.items():
             self._styles[name] = self._create_object(style, name, method_postfix='_style')
+        return dict(self._styles)
+
+    @staticmethod
+    def _connection_string(data: dict) -> str:
+        """
+        Connection string for data block: named connection from configuration ('connections'),
+        otherwise command line connection (which can also be a name)
+
+        :param data: data descriptor ({"sql": [...], "connection": ...})
+        :type data: dict
+        :return: connection string
+        :rtype: str
+        """
+        connections = config_args.get('connections', {})
+        name = data.get('connection', None)
+        if name is None:
+            return connections.get(cmd_args.database, cmd_args.database)
+        if name not in connections:
+            raise ReportError(f"{_('connection')} '{name}' {_('not found in configuration')}")
+        return connections[name]
+
+    def _get_data(self, data: dict) -> Dataset:
+        """
+        Get sql data block result (prefetched, if it is) or part of shared dataset
+
+        :param data: data descriptor ({"sql": [...], "connection": ..., "batch_size": ...} or
+                     {"dataset": name, "columns": [...], "rows": [start, stop], "transpose": true}) or fetched data
+        :type data: dict or Dataset
+        :return: sql result
+        :rtype: Dataset
+        """
+        if isinstance(data, Dataset):
+            return data
+        if 'dataset' in data:
+            return self._view(self._dataset(data['dataset']), data)
+        future = self._prefetched.pop(id(data), None)
+        return self._watched(self._prefetched_result(future, data, self._query) if future else self._query(data))
+
+    def _stream_data(self, data: dict) -> DataStream or Dataset:
+        """
+        Get batched stream for sql data block (prefetched, if it is). Dataset which is used once is streamed too,
+        shared dataset is returned as Dataset (the same interface)
+
+        :param data: data descriptor ({"sql": [...], "connection": ..., "batch_size": ...} or dataset reference)
+        :type data: dict
+        :return: data stream
+        :rtype: DataStream or Dataset
+        """
+        if 'dataset' in data:
+            if data['dataset'] in self._single_use:
+                return self._stream_data(self._dataset_definition(data['dataset']))
+            return self._get_data(data)
+        future = self._prefetched.pop(id(data), None)
+        fetch = self._open_stream if self._streamed(data) else self._query
+        return self._watched(self._prefetched_result(future, data, fetch) if future else self._open_stream(data))
+
+    def _dataset(self, name: str) -> Dataset:
+        """
+        Shared dataset, fetched once per document
+
+        :param name: dataset name
+        :type name: str
+        :return: dataset
+        :rtype: Dataset
+        """
+        if name not in self._datasets:
+            self._datasets[name] = self._get_data(self._dataset_definition(name))
+            logger.debug(f"{_('dataset')} '{name}': {self._datasets[name].rows_count} {_('rows')}")
+        return self._datasets[name]
+
+    def _dataset_definition(self, name: str) -> dict:
+        """
+        Dataset definition from document 'datasets'
+
+        :param name: dataset name
+        :type name: str
+        :return: sql data block
+        :rtype: dict
+        """
+        definition = self._descriptor['document'].get('datasets', {}).get(name, None)
+        if not isinstance(definition, dict) or 'sql' not in definition:
+            raise ReportError(f"{_('dataset')} '{name}' {_('not defined')} {_('in')} "
+                              f"descriptor['document']['datasets']")
+        return definition
+
+    @staticmethod
+    def _view(dataset: Dataset, data: dict) -> Dataset:
+        """
+        Part of dataset: columns subset, rows slice, transposition (in that order)
+
+        :param dataset: dataset
+        :type dataset: Dataset
+        :param data: dataset reference ({"dataset": name, "columns": [...], "rows": [start, stop], "transpose": true})
+        :type data: dict
+        :return: dataset
+        :rtype: Dataset
+        """
+        if 'columns' in data:
+            dataset = dataset.select(data['columns'])
+        if 'rows' in data:
+            dataset = dataset.slice(*data['rows'])
+        if data.get('transpose', False):
+            dataset = dataset.transpose()
+        return dataset
+
+    def _bound_parameters(self) -> dict:
+        """
+        Typed values of declared parameters (document 'parameters': name -> type or {"type": ..., "default": ...}),
+        they are bound to sql placeholders {{name}} instead of text substitution
+
+        :return: name -> typed value
+        :rtype: dict
+        """
+        values, parameters = {}, parse_parameters(cmd_args.parameters)
+        if self._watermark and self._watermark.append:
+            parameters.setdefault(self._watermark.parameter, self._watermark.value)
+        for name, declaration in self._descriptor['document'].get('parameters', {}).items():
+            declaration = declaration if isinstance(declaration, dict) else {'type': declaration}
+            type_name = declaration.get('type', 'str')
+            if type_name not in PARAMETER_TYPES:
+                raise ReportError(f"{_('parameter')} '{name}': {_('unknown type')} '{type_name}'")
+            if name in parameters:
+                value = parameters[name]
+            elif 'default' in declaration:
+                value = declaration['default']
+            else:
+                raise ReportError(f"{_('parameter')} '{name}' {_('expected')}")
+            try:
+                values[name] = PARAMETER_TYPES[type_name](value) if isinstance(value, str) else value
+            except ValueError:
+                raise ReportError(f"{_('parameter')} '{name}': {_('wrong value')} '{value}'")
+        return values
+
+    def _cache_ttl(self, data: dict) -> int:
+        """
+        Query cache time to live: per data block ('cache_ttl'), otherwise per descriptor (document 'cache_ttl')
+
+        :param data: data descriptor
+        :type data: dict
+        :return: time to live, seconds (0 - don't use cache)
+        :rtype: int
+        """
+        return data.get('cache_ttl', self._descriptor['document'].get('cache_ttl', 0))
+
+    def _types(self, data: dict) -> dict:
+        """
+        Type coercion options: configuration 'types', updated by document 'types' and data block 'types'
+
+        :param data: data descriptor
+        :type data: dict
+        :return: type coercion options
+        :rtype: dict
+        """
+        return {**config_args.get('types', {}), **self._descriptor['document'].get('types', {}),
+                **data.get('types', {})}
+
+    def _query(self, data: dict) -> Dataset:
+        """
+        Run sql data block
+
+        :param data: data descriptor
+        :type data: dict
+        :return: sql result
+        :rtype: Dataset
+        """
+        return get_database_data(self._connection_string(data), ''.join(data.get('sql', '')), logger, cmd_args,
+                                 batch_size=data.get('batch_size', config_args.get('batch_size', 10000)),
+                                 cache_ttl=self._cache_ttl(data), types=self._types(data),
+                                 sql_parameters=self._parameters)
+
+    def _open_stream(self, data: dict) -> DataStream:
+        """
+        Open batched stream for sql data block
+
+        :param data: data descriptor
+        :type data: dict
+        :return: data stream
+        :rtype: DataStream
+        """
+        return stream_database_data(self._connection_string(data), ''.join(data.get('sql', '')), logger, cmd_args,
+                                    batch_size=data.get('batch_size', config_args.get('batch_size', 10000)),
+                                    cache_ttl=self._cache_ttl(data), types=self._types(data),
+                                    sql_parameters=self._parameters)
 
     def set_attributes(self, attributes: dict, result: object, key_map: dict, value_map: dict) -> Any:
         """
@@ -1,21 +1,71 @@
-import pandas as pd
+import io
+import os
+import csv
+import gzip
+import lzma
 from typing import Any
-from reportmaker.formats import Document
-from reportmaker.config import cmd_args, logger
-from reportmaker.formats.xlsx import XlsxDocument
-from reportmaker.utils.helpers import get_database_data
+from reportmaker.formats import Document, ReportError
+from reportmaker.utils.dataset import Dataset
+from reportmaker.utils.helpers import DataStream
+from reportmaker.utils.progress import progress
+from reportmaker.config import translate as _
+
+# Compression by file name extension
+COMPRESSIONS = {'.gz': 'gzip', '.xz': 'xz', '.zst': 'zstd'}
+
+# Quoting options
+QUOTING = {'minimal': csv.QUOTE_MINIMAL, 'all': csv.QUOTE_ALL, 'nonnumeric': csv.QUOTE_NONNUMERIC,
+           'none': csv.QUOTE_NONE}
 
 
 class CsvDocument(Document):
-    def __init__(self, descriptor: dict):
+    """
+    CSV document
+
+    Rows are written to file as they are fetched. Document options: 'delimiter' (','), 'quoting' ('minimal', 'all',
+    'nonnumeric' or 'none'), 'encoding' ('utf-8'), 'compression' ('gzip', 'xz' or 'zstd', by default is chosen by
+    'file_name' extension: .gz, .xz, .zst) and 'pad' (if true, rows of all tables are padded to the same length,
+    document is written after layout creation). Incremental export appends rows of sql tables without header
+    (compressed output gets new compressed stream), inline tables are written by full export only
+    """
+    _streaming = True
+    _incremental = 'append'
+
+    def __init__(self, descriptor: dict, fetched: dict = None):
         """
         Constructor
 
         :param descriptor: document descriptor
         :type descriptor: dict
+        :param fetched: results of sql data blocks, shared by documents of several formats
+        :type fetched: dict
         """
-        super().__init__(descriptor)
+        super().__init__(descriptor, fetched)
+        document = descriptor.get('document', {})
+        self._encoding = document.get('encoding', 'utf-8')
+        self._dialect = {'delimiter': document.get('delimiter', ','), 'lineterminator': '\n',
+                         'quoting': QUOTING.get(document.get('quoting', 'minimal'), csv.QUOTE_MINIMAL)}
+        if self._dialect['quoting'] == csv.QUOTE_NONE:
+            self._dialect['escapechar'] = '\\'
+        self._pad_rows = document.get('pad', False)
         self._data = []
+        self._output, self._writer = None, None
+
+    def _output_file_name(self, file_name: str) -> str:
+        """
+        Output file name with extension of compression (compression is chosen here)
+
+        :param file_name: file name of descriptor (or default one)
+        :type file_name: str
+        :return: output file name
+        :rtype: str
+        """
+        self._compression = self._descriptor.get('document', {}).get('compression',
+                                                                     COMPRESSIONS.get(os.path.splitext(file_name)[1]))
+        if self._compression not in (None, *COMPRESSIONS.values()):
+            raise ReportError(f"{_('compression')} '{self._compression}' {_('not implemented')}")
+        extension = {value: key for key, value in COMPRESSIONS.items()}.get(self._compression, '')
+        return file_name if file_name.endswith(extension) else file_name + extension
 
     def create_table(self, table: dict) -> Any:
         """
@@ -25,22 +75,107 @@ class CsvDocument(Document):
         :type table: dict
         """
         data = table.get('data', [])
-        if isinstance(data, dict):
-            data = get_database_data(cmd_args.database, ''.join(table.get('data').get('sql', '')), logger, cmd_args)
-            table['data'] = data
-        for string in data:
-            self._data.append(string)
+        data = self._stream_data(data) if isinstance(data, dict) else data
+        if self._appending and not isinstance(data, (DataStream, Dataset)):
+            return
+        if self._pad_rows:
+            self._data.append(data)
+            return
+        writer = self._get_writer()
+        if isinstance(data, (DataStream, Dataset)):
+            with data:
+                if not self._appending:
+                    writer.writerow(data.columns)
+                for batch in data.batches():
+                    writer.writerows(batch)
+                    progress.rows_written(len(batch))
+        else:
+            writer.writerows(data)
 
     def _create_document(self):
         """
         Create and save document
         """
+        try:
+            if self._pad_rows:
+                self._write_padded()
+            else:
+                self._get_writer()
+        finally:
+            if self._output is not None:
+                self._output.close()
+
+    def _close_output(self):
+        """
+        Close output of failed document
+        """
+        if self._output is not None:
+            output, self._output, self._writer = self._output, None, None
+            output.close()
+
+    def _get_writer(self):
+        """
+        Get csv writer, open output file if it is not opened
+
+        :return: csv writer
+        """
+        if self._writer is None:
+            self._output = self._open_output()
+            self._writer = csv.writer(self._output, **self._dialect)
+        return self._writer
+
+    def _open_output(self) -> io.TextIOBase:
+        """
+        Open output file (compressed, if compression is set), incremental export is appended
+
+        :return: text file
+        :rtype: io.TextIOBase
+        """
+        mode = 'a' if self._appending else 'w'
+        if self._compression == 'gzip':
+            return gzip.open(self._file_name, f'{mode}t', encoding=self._encoding, newline='')
+        if self._compression == 'xz':
+            return lzma.open(self._file_name, f'{mode}t', encoding=self._encoding, newline='')
+        if self._compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ReportError(f"{_('compression')} 'zstd' {_('requires')} zstandard {_('package')}")
+            return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(self._file_name, f'{mode}b')),
+                                    encoding=self._encoding, newline='')
+        return open(self._file_name, mode, encoding=self._encoding, newline='')
+
+    def _write_padded(self):
+        """
+        Write all tables, rows are padded to the longest row
+        """
         max_str_len = 0
-        for string in self._data:
-            if len(string) > max_str_len:
-                max_str_len = len(string)
-        for i, string in enumerate(self._data):
-            while len(string) < max_str_len:
-                string.append('')
-            self._data[i] = string
-        pd.DataFrame(XlsxDocument.data_to_frame(self._data)).to_csv(self._file_name, index=False)
+        for part in self._data:
+            for string in [part.columns] if isinstance(part, (DataStream, Dataset)) else part:
+                if len(string) > max_str_len:
+                    max_str_len = len(string)
+        writer = self._get_writer()
+        for part in self._data:
+            if isinstance(part, (DataStream, Dataset)):
+                with part:
+                    if not self._appending:
+                        writer.writerow(self._pad(part.columns, max_str_len))
+                    for batch in part.batches():
+                        writer.writerows(self._pad(string, max_str_len) for string in batch)
+                        progress.rows_written(len(batch))
+            else:
+                writer.writerows(self._pad(string, max_str_len) for string in part)
+
+    @staticmethod
+    def _pad(string: list, length: int) -> list:
+        """
+        Pad row with empty values
+
+        :param string: row
+        :type string: list or tuple
+        :param length: required row length
+        :type length: int
+        :return: padded row
+        :rtype: list or tuple
+        """
+        return list(string) + [''] * (length - len(string)) if len(string) < length else string
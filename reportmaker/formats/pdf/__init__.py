@@ -1,23 +1,110 @@
-import uuid
+import os
+import json
+import multiprocessing
+import multiprocessing.util
+from types import GeneratorType
+from typing import Any, Iterable
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
 from reportmaker.formats import Document
+from reportmaker.utils.dataset import Dataset
+from reportmaker.formats.pdf.flowables import LazyFlowables
+from reportmaker.utils.cache import chart_cache
+from reportmaker.utils.styles import style_registry
+from reportmaker.utils.progress import progress
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.graphics import renderPDF, renderPM
-from reportmaker.utils.helpers import get_database_data
+from reportlab.graphics.shapes import Group, UserNode
 from reportlab.graphics.charts.lineplots import LinePlot
 from reportlab.graphics.renderPDF import GraphicsFlowable
 from reportlab.graphics.widgets.markers import makeMarker
 from reportlab.graphics.charts.piecharts import Pie, Drawing
-from reportmaker.config import translate as _, logger, cmd_args
+from reportmaker.config import translate as _, logger, config_args, cmd_args
 from reportlab.graphics.charts.barcharts import VerticalBarChart
 from reportlab.graphics.charts.linecharts import HorizontalLineChart
-from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.styles import ParagraphStyle
 from reportlab.platypus import Paragraph, SimpleDocTemplate, TableStyle, Table, Image, Spacer
 from reportmaker.formats.pdf.maps import ParagraphStyleMap, TableStyleMap, TableMap, SliceMap,\
-    HorizontalLineChartMap, LineMap, LabelMap, CategoryAxisMap, ValueAxisMap, CircleMap
+    HorizontalLineChartMap, LineMap, LabelMap, CategoryAxisMap, ValueAxisMap, CircleMap, setter_table
 
-# Register fonts
-pdfmetrics.registerFont(TTFont('DejaVuSerif', 'DejaVuSerif.ttf', 'UTF-8'))
+# Layout elements, which are rendered by chart workers
+CHART_TYPES = ('pie', 'vertical_bar_chart', 'horizontal_line_chart', 'line_plot')
+
+# Minimum charts of document, which are rendered by chart workers (configuration 'chart_pool_threshold'), fewer
+# charts are rendered in process
+CHART_POOL_THRESHOLD = 8
+
+# Pool of chart workers (created by the first document with enough charts, lives as long as the process)
+_chart_pool = None
+
+# Document of chart worker process: settings and document descriptor key, document
+_worker_document = None, None
+
+
+def register_fonts():
+    """
+    Register fonts (once, on first document creation)
+    """
+    if 'DejaVuSerif' not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont('DejaVuSerif', 'DejaVuSerif.ttf', 'UTF-8'))
+
+
+def chart_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Pool of chart workers, created once per process. Workers are configured by command line arguments of this
+    process (not by their own ones, which batch and server workers don't have) before this module is imported there
+
+    :param workers: worker processes
+    :type workers: int
+    :return: pool
+    :rtype: ProcessPoolExecutor
+    """
+    global _chart_pool
+    if _chart_pool is None:
+        from reportmaker.config import configure, arguments
+        context = multiprocessing.get_context(
+            'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+        _chart_pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=configure,
+                                          initargs=(arguments,))
+        # Worker of batch or server joins its children on exit, so pool is stopped before it (and before feeder
+        # threads of pool queues are closed)
+        multiprocessing.util.Finalize(None, close_chart_pool, exitpriority=100)
+    return _chart_pool
+
+
+def close_chart_pool():
+    """
+    Stop chart workers (next document creates new pool)
+    """
+    global _chart_pool
+    if _chart_pool is not None:
+        _chart_pool.shutdown(cancel_futures=True)
+        _chart_pool = None
+
+
+def render_chart(settings: dict, document: dict, chart: dict) -> tuple:
+    """
+    Render chart in worker process. Worker document is created again, if job settings or document are changed
+
+    :param settings: command line parameters of job (cmd_args)
+    :type settings: dict
+    :param document: document descriptor without layout
+    :type document: dict
+    :param chart: chart descriptor, sql data is fetched
+    :type chart: dict
+    :return: drawing with shapes only (or PNG file name), chart cache hits and misses
+    :rtype: tuple
+    """
+    global _worker_document
+    vars(cmd_args).update(settings)
+    key = json.dumps([settings, document], sort_keys=True, ensure_ascii=False, default=str)
+    if _worker_document[0] != key:
+        _worker_document = key, PdfDocument({'document': document})
+    hits, misses = chart_cache.hits, chart_cache.misses
+    result = _worker_document[1]._create_object(chart)
+    return (result.drawing if isinstance(result, GraphicsFlowable) else result,
+            chart_cache.hits - hits, chart_cache.misses - misses)
 
 
 class PdfDocument(Document):
@@ -25,16 +112,128 @@ class PdfDocument(Document):
     PDF document
 
     See: https://www.reportlab.com/docs/reportlab-userguide.pdf
+
+    Table with 'chunkRows' and sql data is streamed: rows are split to tables of chunkRows rows with repeated header
+    as they are fetched, and chunks are laid out one by one while document is built.
+
+    Charts of document with at least 'chart_pool_threshold' charts are rendered by pool of 'chart_workers' processes
+    (configuration, 0 - number of CPUs), which is shared by documents of process, sql data of charts is fetched by
+    main process.
     """
 
+    def __init__(self, descriptor: dict, fetched: dict = None):
+        """
+        Constructor
+
+        :param descriptor: document descriptor
+        :type descriptor: dict
+        :param fetched: results of sql data blocks, shared by documents of several formats
+        :type fetched: dict
+        """
+        super().__init__(descriptor, fetched)
+        register_fonts()
+        self._executor = None
+        self._chunked = {
+            id(element['data']) for element in descriptor.get('document', {}).get('layout', None) or []
+            if isinstance(element, dict) and element.get('chunkRows', 0) and isinstance(element.get('data'), dict)
+        }
+
+    def _create_layout(self):
+        """
+        Create document layout, charts are rendered by process pool and placed back in layout order
+        """
+        charts = [
+            element for element in self._descriptor['document'].get('layout', None) or []
+            if isinstance(element, dict) and str(element.get('type', '')).lower() in CHART_TYPES
+        ]
+        workers = config_args.get('chart_workers', 0) or os.cpu_count() or 1
+        if workers < 2 or len(charts) < max(config_args.get('chart_pool_threshold', CHART_POOL_THRESHOLD), 2):
+            return super()._create_layout()
+        self._executor = chart_pool(workers)
+        try:
+            super()._create_layout()
+            for i, element in enumerate(self._layout):
+                if isinstance(element, Future):
+                    result, hits, misses = element.result()
+                    chart_cache.hits, chart_cache.misses = chart_cache.hits + hits, chart_cache.misses + misses
+                    self._layout[i] = renderPDF.GraphicsFlowable(result) if isinstance(result, Drawing) else result
+        except BrokenProcessPool:
+            close_chart_pool()
+            raise
+        finally:
+            self._executor = None
+            for element in self._layout:
+                if isinstance(element, Future):
+                    element.cancel()
+        logger.info(f"{len(charts)} {_('charts')} {_('rendered by')} {min(workers, len(charts))} {_('processes')}")
+
+    def _create_element(self, element: dict) -> Any:
+        """
+        Create layout element, chart is sent to chart workers (result is Future)
+
+        :param element: element descriptor
+        :type element: dict
+        :return: created object
+        :rtype: Any
+        """
+        if self._executor is None or not isinstance(element, dict) or \
+                str(element.get('type', '')).lower() not in CHART_TYPES:
+            return super()._create_element(element)
+        chart = dict(element)
+        if isinstance(chart.get('data', []), dict):
+            chart['data'] = self._get_data(chart['data'])
+        document = {key: value for key, value in self._descriptor['document'].items() if key != 'layout'}
+        return self._executor.submit(render_chart, vars(cmd_args), document, chart)
+
     def _create_document(self):
         """
         Create and save document
         """
-        SimpleDocTemplate(self._file_name).build(self._layout)
+        SimpleDocTemplate(self._file_name).build(LazyFlowables(self._flowables()))
+
+    def _flowables(self) -> Iterable:
+        """
+        Layout flowables, chunks of streamed tables are created on demand
+
+        :return: flowables generator
+        :rtype: Iterable
+        """
+        for flowable in self._layout:
+            if isinstance(flowable, GeneratorType):
+                yield from flowable
+            else:
+                yield flowable
+
+    def _streamed(self, data: dict) -> bool:
+        """
+        Data block is consumed as DataStream (data of table with 'chunkRows')
+
+        :param data: data descriptor
+        :type data: dict
+        :return: True, if data block is streamed
+        :rtype: bool
+        """
+        return id(data) in self._chunked and id(data) not in self._shared
 
     # public
 
+    def set_attributes(self, attributes: dict, result: object, key_map: dict = None, value_map: dict = None) -> Any:
+        """
+        Set object attributes by setter table of object class (see maps.setter_table)
+
+        :param attributes: name -> value pairs from descriptor
+        :type attributes: dict
+        :param result: source object
+        :type result: object
+        :param key_map: mapping for attributes names
+        :type key_map: dict
+        :param value_map: mapping for attributes values
+        :type value_map: dict
+        :return: objects with set attributes
+        :rtype: object
+        """
+        return setter_table(type(result), key_map, value_map).apply(attributes, result, self)
+
     def create_paragraph(self, paragraph: dict) -> Paragraph:
         """
         Create paragraph
@@ -60,7 +259,7 @@ class PdfDocument(Document):
         """
         parent = None
         if style.get('parent_stylesheet', None) == 'sample':
-            parent = getSampleStyleSheet()[style['parent_name'] if 'parent_name' in style else 'Normal']
+            parent = style_registry.sample_stylesheet()[style['parent_name'] if 'parent_name' in style else 'Normal']
         elif 'parent_name' in style:
             if style['parent_name'] in self._styles:
                 parent = self._styles[style['parent_name']]
@@ -70,12 +269,33 @@ class PdfDocument(Document):
         return self.set_attributes(style, ParagraphStyle(name, parent=parent) if parent else ParagraphStyle(name),
                                    ParagraphStyleMap.key_map, ParagraphStyleMap.value_map)
 
-    def create_table(self, table: dict) -> Table:
+    def create_table(self, table: dict) -> Table or Iterable:
         """
         Create paragraph
 
         :param table: table descriptor
         :type table: dict
+        :return: table object (generator of tables for table with 'chunkRows' and sql data)
+        :rtype: Table or Iterable
+        """
+        if isinstance(table.get('data', []), dict):
+            if table.get('chunkRows', 0):
+                return self._table_chunks(table, self._stream_data(table['data']))
+            table['data'] = self._get_data(table['data']).to_rows()
+        return self._make_table(table, table.get('data', []))
+
+    def _make_table(self, table: dict, data: list, start: int = 0, last: bool = True) -> Table:
+        """
+        Create table object
+
+        :param table: table descriptor
+        :type table: dict
+        :param data: rows
+        :type data: list
+        :param start: number of the first row in whole table, without header (table chunk)
+        :type start: int
+        :param last: if False, table is not the last chunk of whole table
+        :type last: bool
         :return: table object
         :rtype: Table
         """
@@ -83,15 +303,17 @@ class PdfDocument(Document):
         row_heights = table.get('rowHeights', None)
         col_widths = table.get('colWidths', None)
         row_split_range = table.get('rowSplitRange', None)
-        space_before = table.get('spaceBefore', None)
-        space_after = table.get('spaceAfter', None)
-        if isinstance(table.get('data', []), dict):
-            data = get_database_data(cmd_args.database, ''.join(table.get('data').get('sql', '')), logger, cmd_args)
-            table['data'] = data
+        space_before = table.get('spaceBefore', None) if not start else None
+        space_after = table.get('spaceAfter', None) if last else None
+        if start or not last:
+            table = {key: value for key, value in table.items() if key not in ('data', 'spaceBefore', 'spaceAfter')}
+            if isinstance(row_heights, list):
+                row_heights = row_heights[:1] + (row_heights[1 + start:len(data) + start] + [None] * len(data))[
+                    :len(data) - 1]
         return self.set_attributes(
             table,
             Table(
-                table.get('data', []),
+                data,
                 style=self._styles.get(style) if isinstance(style, str) else style,
                 rowHeights=row_heights if row_heights else None,
                 colWidths=col_widths if col_widths else None,
@@ -106,6 +328,52 @@ class PdfDocument(Document):
             TableMap.value_map
         )
 
+    def _table_chunks(self, table: dict, data) -> Iterable:
+        """
+        Tables of 'chunkRows' rows with header, created as rows are fetched
+
+        :param table: table descriptor
+        :type table: dict
+        :param data: data stream
+        :type data: DataStream or Dataset
+        :return: tables generator
+        :rtype: Iterable
+        """
+        table = {**table, 'repeatRows': table.get('repeatRows', 0) or 1}
+        with data:
+            header, start = [list(data.columns)], 0
+            chunks = self._row_chunks(data, table['chunkRows'])
+            chunk = next(chunks, [])
+            while True:
+                following = next(chunks, None)
+                yield self._make_table(table, header + [list(x) for x in chunk], start, following is None)
+                progress.rows_written(len(chunk))
+                if following is None:
+                    return
+                start, chunk = start + len(chunk), following
+
+    @staticmethod
+    def _row_chunks(data, size: int) -> Iterable:
+        """
+        Rows of data stream by chunks of size rows
+
+        :param data: data stream
+        :type data: DataStream or Dataset
+        :param size: rows per chunk
+        :type size: int
+        :return: chunks generator
+        :rtype: Iterable
+        """
+        rows = []
+        for batch in data.batches():
+            rows.extend(batch)
+            full = len(rows) - len(rows) % size
+            for i in range(0, full, size):
+                yield rows[i:i + size]
+            rows = rows[full:]
+        if rows:
+            yield rows
+
     def create_table_style(self, style: dict, name: str) -> TableStyle:
         """
         Create table style
@@ -147,10 +415,10 @@ class PdfDocument(Document):
         attrs_dict = {'drawing': {}, 'slices': [], 'style': {}}
         attrs_list = ['drawing', 'slices', 'style']
         self._set_attrs(pie, pie_obj, attrs_dict, attrs_list)
-        if isinstance(pie.get('data', []), dict):
-            data = get_database_data(cmd_args.database, ''.join(pie.get('data').get('sql', '')), logger, cmd_args)
-            pie['labels'] = data[0]
-            pie['data'] = data[1]
+        if isinstance(pie.get('data', []), (dict, Dataset)):
+            data = self._get_data(pie['data'])
+            pie['labels'] = data.columns
+            pie['data'] = data.row(0)
         for attr in attrs_list:
             if attr == 'style':
                 for part in self.create_slice(attrs_dict[attr]):
@@ -160,10 +428,8 @@ class PdfDocument(Document):
                         setattr(pie_obj, part, attrs_dict[attr][part])
             if attr == 'slices':
                 for i, part in enumerate(attrs_dict[attr]):
-                    index = part['number'] if 'number' in part else i
-                    for slice_attr, slice_attr_value in part.items():
-                        if hasattr(pie_obj.slices[index], slice_attr):
-                            setattr(pie_obj.slices[index], slice_attr, slice_attr_value)
+                    sl = pie_obj.slices[part['number'] if 'number' in part else i]
+                    setter_table(type(sl), coerce=False).apply(part, sl)
         return self._get_result(attrs_dict['drawing'], pie_obj, pie, render_to_file)
 
     def create_image(self, image: dict) -> Image:
@@ -175,7 +441,7 @@ class PdfDocument(Document):
         :return: image object
         :rtype: Image
         """
-        return self.set_attributes(image, Image(image.get('data', '')), {}, {})
+        return self.set_attributes(image, Image(image.get('data', '')))
 
     @staticmethod
     def create_spacer(spacer: dict) -> Spacer:
@@ -242,9 +508,7 @@ class PdfDocument(Document):
                 for i, line in enumerate(chart_obj.lines):
                     if i >= len(attrs_dict[attr]):
                         break
-                    for key, value in attrs_dict[attr][i].items():
-                        if hasattr(chart_obj.lines[i], key):
-                            setattr(chart_obj.lines[i], key, value)
+                    setter_table(type(line), coerce=False).apply(attrs_dict[attr][i], line)
             if attr == 'lineLabels':
                 self._set_labels(attr, attrs_dict, chart_obj)
             self._set_axis(attr, attrs_dict, chart_obj)
@@ -264,21 +528,18 @@ class PdfDocument(Document):
         plot_obj = LinePlot()
         attrs_dict = {'drawing': {}, 'xValueAxis': {}, 'yValueAxis': {}, 'lines': [], 'lineLabels': []}
         attrs_list = ['drawing', 'xValueAxis', 'yValueAxis', 'strokeColor', 'lines', 'lineLabels']
-        if isinstance(line_plot.get('data', []), dict):
-            data = get_database_data(cmd_args.database, ''.join(line_plot.get('data').get('sql', '')), logger, cmd_args)
-            line_plot['data'] = data[1:]
+        if isinstance(line_plot.get('data', []), (dict, Dataset)):
+            line_plot['data'] = self._get_data(line_plot['data']).to_rows(header=False)
         self._set_attrs(line_plot, plot_obj, attrs_dict, attrs_list)
         for attr in attrs_list:
             if attr == 'lines':
                 for i, line in enumerate(plot_obj.lines):
                     if i >= len(attrs_dict[attr]):
                         break
-                    for key, value in attrs_dict[attr][i].items():
-                        if key == 'symbol':
-                            setattr(plot_obj.lines[i], key, makeMarker(value))
-                            continue
-                        if hasattr(plot_obj.lines[i], key):
-                            setattr(plot_obj.lines[i], key, value)
+                    if 'symbol' in attrs_dict[attr][i]:
+                        line.symbol = makeMarker(attrs_dict[attr][i]['symbol'])
+                    setter_table(type(line), coerce=False).apply(
+                        {key: value for key, value in attrs_dict[attr][i].items() if key != 'symbol'}, line)
             if attr == 'lineLabels':
                 self._set_labels(attr, attrs_dict, plot_obj)
             self._set_axis(attr, attrs_dict, plot_obj)
@@ -308,13 +569,11 @@ class PdfDocument(Document):
 
     # protected
 
-    @staticmethod
-    def _set_sql_data(descr: dict) -> dict:
-        if isinstance(descr.get('data', []), dict):
-            data = get_database_data(cmd_args.database, ''.join(descr.get('data').get('sql', '')),
-                                     logger, cmd_args)
-            descr['categoryAxis']['categoryNames'] = data[0]
-            descr['data'] = data[1:]
+    def _set_sql_data(self, descr: dict) -> dict:
+        if isinstance(descr.get('data', []), (dict, Dataset)):
+            data = self._get_data(descr['data'])
+            descr['categoryAxis']['categoryNames'] = data.columns
+            descr['data'] = data.to_rows(header=False)
         return descr
 
     @staticmethod
@@ -340,7 +599,8 @@ class PdfDocument(Document):
 
     def _get_result(self, attrs: dict, chart_obj, chart: dict, render_to_file: bool = False) -> GraphicsFlowable or str:
         """
-        Get rendered result
+        Get rendered result. Rendering is cached by chart cache: unchanged chart is not laid out (flowable)
+        or rasterized (PNG) again
 
         :param attrs: drawing attributes
         :type attrs: dict
@@ -353,17 +613,33 @@ class PdfDocument(Document):
         :return: rendered result
         :rtype: GraphicsFlowable or str
         """
-        drawing = self.set_attributes(attrs, Drawing(), {}, {})
-        drawing.add(self.set_attributes(chart, chart_obj, {}, HorizontalLineChartMap.value_map))
+        drawing = self.set_attributes(attrs, Drawing())
+        drawing.add(self.set_attributes(chart, chart_obj, value_map=HorizontalLineChartMap.value_map))
+        key = chart_cache.key(drawing)
         if not render_to_file:
-            return renderPDF.GraphicsFlowable(drawing)
+            return renderPDF.GraphicsFlowable(chart_cache.drawing(key, lambda: self._expand_drawing(drawing)))
         else:
-            file_name = f'/tmp/{str(uuid.uuid4())}.png'
-            renderPM.drawToFile(drawing, file_name, 'PNG')
-            return file_name
+            return chart_cache.image(key, lambda file_name: renderPM.drawToFile(drawing, file_name, 'PNG'))
 
     # static
 
+    @classmethod
+    def _expand_drawing(cls, node: Drawing) -> Drawing:
+        """
+        Replace user nodes (charts and labels, which are provided by charts) with shapes they provide, recursively.
+        Drawing is changed in place
+
+        :param node: drawing (or its node)
+        :type node: Drawing
+        :return: drawing with shapes only
+        :rtype: Drawing
+        """
+        while isinstance(node, UserNode):
+            node = node.provideNode()
+        if isinstance(node, Group):
+            node.contents = [cls._expand_drawing(child) for child in node.contents]
+        return node
+
     @staticmethod
     def _set_labels(attr: str, attrs: dict, chart_obj: HorizontalLineChart or VerticalBarChart or LinePlot):
         """
@@ -376,12 +652,11 @@ class PdfDocument(Document):
         :param chart_obj: chart object
         :type chart_obj: HorizontalLineChart or VerticalBarChart or LinePlot
         """
+        labels = getattr(chart_obj, attr)
         for i, line in enumerate(attrs[attr]):
-            for j, label in enumerate(attrs[attr][i]):
-                for key, value in label.items():
-                    if key in LabelMap.value_map:
-                        value = LabelMap.value_map[key][value]
-                    setattr(getattr(chart_obj, attr)[(i, j)], key, value)
+            for j, label in enumerate(line):
+                label_obj = labels[(i, j)]
+                setter_table(type(label_obj), value_map=LabelMap.value_map, coerce=False).apply(label, label_obj)
 
     @staticmethod
     def _set_axis(attr: str, attrs: dict, chart_obj: HorizontalLineChart or VerticalBarChart or LinePlot):
@@ -397,24 +672,13 @@ class PdfDocument(Document):
         """
         if attr == 'categoryAxisLabels':
             for i, label in enumerate(attrs[attr]):
-                for key, value in label.items():
-                    if key in LabelMap.value_map:
-                        value = LabelMap.value_map[key][value]
-                    setattr(chart_obj.categoryAxis.labels[i], key, value)
+                label_obj = chart_obj.categoryAxis.labels[i]
+                setter_table(type(label_obj), value_map=LabelMap.value_map, coerce=False).apply(label, label_obj)
         if attr == 'categoryAxis':
-            for key, value in attrs.get(attr).items():
-                if hasattr(chart_obj.categoryAxis, key):
-                    if key in CategoryAxisMap.value_map:
-                        value = CategoryAxisMap.value_map[key][value]
-                    setattr(chart_obj.categoryAxis, key, value)
-        if attr in ['valueAxis', 'xValueAxis', 'yValueAxis']:
-            for key, value in attrs.get(attr).items():
-                if hasattr(chart_obj, attr):
-                    axis = getattr(chart_obj, attr)
-                    if key == 'valueSteps':
-                        setattr(axis, key, value)
-                        continue
-                    if hasattr(axis, key):
-                        if key in ValueAxisMap.value_map:
-                            value = ValueAxisMap.value_map[key][value]
-                        setattr(axis, key, value)
+            axis = chart_obj.categoryAxis
+            setter_table(type(axis), value_map=CategoryAxisMap.value_map, coerce=False).apply(attrs.get(attr), axis)
+        if attr in ['valueAxis', 'xValueAxis', 'yValueAxis'] and hasattr(chart_obj, attr):
+            axis = getattr(chart_obj, attr)
+            if 'valueSteps' in attrs.get(attr):
+                axis.valueSteps = attrs[attr]['valueSteps']
+            setter_table(type(axis), value_map=ValueAxisMap.value_map, coerce=False).apply(attrs.get(attr), axis)
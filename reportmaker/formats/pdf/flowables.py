@@ -0,0 +1,81 @@
+import sys
+from typing import Iterable
+
+########################################################################################################################
+#                                                 Lazy story                                                           #
+########################################################################################################################
+
+
+class LazyFlowables:
+    """
+    Story for DocTemplate.build, which takes flowables from iterator only when build looks at them, so only
+    a few flowables of the story exist at a time. Supports list operations which are used by build: len, indexing,
+    slices, deletion, insertion and slice assignment (split flowables are put back to the front)
+    """
+
+    def __init__(self, flowables: Iterable, lookahead: int = 16):
+        """
+        Constructor
+
+        :param flowables: flowables
+        :type flowables: Iterable
+        :param lookahead: flowables, taken ahead by len (build groups keepWithNext flowables in this range)
+        :type lookahead: int
+        """
+        self._source = iter(flowables)
+        self._buffer = []
+        self._lookahead = lookahead
+
+    def __len__(self) -> int:
+        self._fill(self._lookahead)
+        return len(self._buffer)
+
+    def __getitem__(self, index: int or slice):
+        self._fill(self._required(index))
+        return self._buffer[index]
+
+    def __setitem__(self, index: int or slice, value):
+        self._fill(self._required(index))
+        self._buffer[index] = value
+
+    def __delitem__(self, index: int or slice):
+        self._fill(self._required(index))
+        del self._buffer[index]
+
+    def insert(self, index: int, value):
+        """
+        Insert flowable
+
+        :param index: position
+        :type index: int
+        :param value: flowable
+        """
+        self._fill(index)
+        self._buffer.insert(index, value)
+
+    @staticmethod
+    def _required(index: int or slice) -> int:
+        """
+        Buffer size, required for index (negative index requires all flowables)
+
+        :param index: index or slice
+        :type index: int or slice
+        :return: buffer size
+        :rtype: int
+        """
+        if isinstance(index, slice):
+            return sys.maxsize if index.stop is None or index.stop < 0 else index.stop
+        return sys.maxsize if index < 0 else index + 1
+
+    def _fill(self, size: int):
+        """
+        Take flowables from iterator until buffer has size flowables
+
+        :param size: buffer size
+        :type size: int
+        """
+        while len(self._buffer) < size and self._source is not None:
+            try:
+                self._buffer.append(next(self._source))
+            except StopIteration:
+                self._source = None
@@ -157,3 +157,114 @@ class CircleMap:
     value_map = {
         'fillColor': colors,
     }
+
+
+########################################################################################################################
+#                                             Compiled setters                                                         #
+########################################################################################################################
+
+# Map without entries
+NO_MAP = {}
+
+
+class SetterTable:
+    """
+    Attribute setters of class, compiled from key map and value map: descriptor key -> (attribute name, method for
+    list values, mapping for other values). Key is resolved once per class (attribute, which class has not, is
+    skipped), so attributes of element are set in one pass without attribute lookups and nested map lookups
+    """
+
+    def __init__(self, cls: type, key_map: dict, value_map: dict, coerce: bool):
+        """
+        Constructor
+
+        :param cls: class of objects
+        :type cls: type
+        :param key_map: mapping for attributes names
+        :type key_map: dict
+        :param value_map: mapping for attributes values (mapping or method for list values)
+        :type value_map: dict
+        :param coerce: if True, not mapped value is converted to type of current attribute value
+        :type coerce: bool
+        """
+        self.cls, self.key_map, self.value_map, self.coerce = cls, key_map, value_map, coerce
+        self._setters = {}
+
+    def _compile(self, key: str, obj: object) -> tuple or None:
+        """
+        Compile setter of key
+
+        :param key: descriptor key
+        :type key: str
+        :param obj: object of class
+        :type obj: object
+        :return: (attribute name, method, mapping) or None, if class has not attribute
+        :rtype: tuple or None
+        """
+        name = self.key_map.get(key, key if hasattr(obj, key) else None)
+        if name is None:
+            setter = None
+        else:
+            value_map = self.value_map.get(key)
+            setter = (name, getattr(value_map, '__func__', None), value_map if isinstance(value_map, dict) else None)
+        self._setters[key] = setter
+        return setter
+
+    def apply(self, attributes: dict, obj: object, document: object = None) -> object:
+        """
+        Set object attributes
+
+        :param attributes: name -> value pairs from descriptor
+        :type attributes: dict
+        :param obj: object of class
+        :type obj: object
+        :param document: document (first argument of methods for list values)
+        :type document: object
+        :return: object with set attributes
+        :rtype: object
+        """
+        setters = self._setters
+        for key, value in attributes.items():
+            setter = setters[key] if key in setters else self._compile(key, obj)
+            if setter is None:
+                continue
+            name, method, mapping = setter
+            if type(value) is list:
+                mapped_value = method(document, value) if method else value
+            else:
+                mapped_value = mapping.get(value) if mapping else None
+            if mapped_value is not None:
+                value = mapped_value
+            elif self.coerce:
+                attr = getattr(obj, name)
+                if attr is not None:
+                    value = type(attr)(value)
+            setattr(obj, name, value)
+        return obj
+
+
+# Compiled setter tables: (class, key map id, value map id, coerce) -> setter table
+_setter_tables = {}
+
+
+def setter_table(cls: type, key_map: dict = None, value_map: dict = None, coerce: bool = True) -> SetterTable:
+    """
+    Setter table of class (compiled once per class and maps)
+
+    :param cls: class of objects
+    :type cls: type
+    :param key_map: mapping for attributes names
+    :type key_map: dict
+    :param value_map: mapping for attributes values
+    :type value_map: dict
+    :param coerce: if True, not mapped value is converted to type of current attribute value
+    :type coerce: bool
+    :return: setter table
+    :rtype: SetterTable
+    """
+    key_map, value_map = NO_MAP if key_map is None else key_map, NO_MAP if value_map is None else value_map
+    key = (cls, id(key_map), id(value_map), coerce)
+    table = _setter_tables.get(key)
+    if table is None or table.key_map is not key_map or table.value_map is not value_map:
+        table = _setter_tables[key] = SetterTable(cls, key_map, value_map, coerce)
+    return table
@@ -1,19 +1,52 @@
+import os
 import json
-from reportmaker.formats import Document
-from reportmaker.config import cmd_args, logger
-from reportmaker.utils.helpers import get_database_data
+from typing import Iterable
+from reportmaker.formats import Document, ReportError
+from reportmaker.utils.dataset import Dataset
+from reportmaker.utils.helpers import DataStream
+from reportmaker.utils.progress import progress
+from reportmaker.config import translate as _
+
+# Output modes: legacy ({"data": [[str, ...], ...]} with indent), compact (columns schema and typed rows,
+# row per line), ndjson (object per line)
+MODES = ('legacy', 'compact', 'ndjson')
+
+# Schema types of values
+SCHEMA_TYPES = {bool: 'bool', int: 'int', float: 'float', str: 'str'}
 
 
 class TabDocument(Document):
-    def __init__(self, descriptor: dict):
+    """
+    Tab document (json for frontend)
+
+    Document options: 'mode' (see MODES), 'index' (if true, index file <document file>.idx with byte offsets of
+    rows pages is written) and 'page_size' (rows per index page, 1000). Incremental export is supported in ndjson
+    mode: rows are appended, index is continued
+    """
+    _streaming = True
+    _incremental = 'append'
+
+    def __init__(self, descriptor: dict, fetched: dict = None):
         """
         Constructor
 
         :param descriptor: document descriptor
         :type descriptor: dict
+        :param fetched: results of sql data blocks, shared by documents of several formats
+        :type fetched: dict
         """
-        super().__init__(descriptor)
+        super().__init__(descriptor, fetched)
+        document = descriptor.get('document', {})
+        self._mode = document.get('mode', 'legacy')
+        if self._mode not in MODES:
+            raise ReportError(f"{_('mode')} '{self._mode}' {_('not implemented')}")
+        if self._watermark and self._mode != 'ndjson':
+            raise ReportError(f"{_('incremental')} {_('export')} {_('not implemented')} {_('for')} {_('mode')} "
+                              f"'{self._mode}'")
+        self._index = document.get('index', False)
+        self._page_size = document.get('page_size', 1000)
         self._data = None
+        self._rows = 0
 
     def create_table(self, table: dict):
         """
@@ -22,18 +55,165 @@ class TabDocument(Document):
         :param table: table descriptor
         :type table: dict
         """
+        if isinstance(self._data, DataStream):
+            self._data.close()
         data = table.get('data', [])
         if isinstance(data, dict):
-            data = get_database_data(cmd_args.database, ''.join(table.get('data').get('sql', '')), logger, cmd_args)
-            table['data'] = data
-        self._data = data[1:]
+            self._data = self._stream_data(data)
+        elif isinstance(data, Dataset) or self._mode == 'legacy':
+            self._data = data if isinstance(data, Dataset) else data[1:]
+        else:
+            self._data = Dataset.from_rows(data)
 
     def _create_document(self):
         """
-        Create and save document
+        Create and save document (rows are written as they are fetched). Incremental export continues rows of
+        existing document (the last line feed is overwritten by rows separator) and its index
+        """
+        offsets = []
+        if self._appending:
+            self._continue_index(offsets)
+        with open(self._file_name, 'r+b' if self._appending else 'wb') as output:
+            if self._appending and output.seek(0, os.SEEK_END):
+                output.seek(-1, os.SEEK_END)
+                if output.read(1) == b'\n':
+                    output.seek(-1, os.SEEK_END)
+            getattr(self, f'_write_{self._mode}')(output, offsets)
+        if self._index:
+            with open(f'{self._file_name}.idx', 'w') as index:
+                json.dump({'mode': self._mode, 'page_size': self._page_size, 'offsets': offsets, 'rows': self._rows},
+                          index)
+
+    def _continue_index(self, offsets: list):
+        """
+        Take pages offsets and rows count of existing document from its index. If index is not found (or has other
+        page size), they are rebuilt by scanning rows of document (row per line)
+
+        :param offsets: pages offsets
+        :type offsets: list
+        """
+        try:
+            with open(f'{self._file_name}.idx') as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            index = {}
+        if index.get('page_size') == self._page_size and 'rows' in index:
+            offsets.extend(index['offsets'])
+            self._rows = index['rows']
+        elif not self._index:
+            self._rows = 1 if os.path.getsize(self._file_name) else 0
+        else:
+            position = 0
+            with open(self._file_name, 'rb') as document:
+                for line in document:
+                    if line.strip():
+                        if not self._rows % self._page_size:
+                            offsets.append(position)
+                        self._rows += 1
+                    position += len(line)
+
+    def _batches(self) -> Iterable:
+        """
+        Batches of rows of the last table
+
+        :return: batches
+        :rtype: Iterable
+        """
+        if isinstance(self._data, (DataStream, Dataset)):
+            return self._data.batches()
+        return [self._data] if self._data else []
+
+    def _write_rows(self, output, offsets: list, batches: Iterable, row_format, separator: bytes):
+        """
+        Write rows, byte offset of each page of rows is added to offsets
+
+        :param output: binary file
+        :param offsets: pages offsets
+        :type offsets: list
+        :param batches: batches of rows
+        :type batches: Iterable
+        :param row_format: row -> str
+        :type row_format: Callable
+        :param separator: rows separator
+        :type separator: bytes
+        """
+        count = self._rows
+        for batch in batches:
+            for string in batch:
+                if count:
+                    output.write(separator)
+                if not count % self._page_size:
+                    offsets.append(output.tell())
+                output.write(row_format(string).encode('utf8'))
+                count += 1
+            progress.rows_written(len(batch))
+        self._rows = count
+
+    def _write_legacy(self, output, offsets: list):
+        """
+        Write document, layout is the same as json.dump with indent (values are strings)
+
+        :param output: binary file
+        :param offsets: pages offsets
+        :type offsets: list
+        """
+        output.write(b'{\n    "data": [\n')
+        position = output.tell()
+        self._write_rows(output, offsets, self._batches(), lambda string: '\n'.join(
+            f'        {line}' for line in json.dumps([str(x) for x in string], ensure_ascii=False,
+                                                  indent=4).split('\n')), b',\n')
+        if output.tell() == position:
+            output.seek(position - 1)
+            output.truncate()
+            output.write(b']\n}')
+        else:
+            output.write(b'\n    ]\n}')
+
+    def _write_compact(self, output, offsets: list):
+        """
+        Write document: {"columns": [{"name": ..., "type": ...}, ...], "rows": [[...], ...]}, row per line
+
+        :param output: binary file
+        :param offsets: pages offsets
+        :type offsets: list
+        """
+        batches, columns = self._schema_batches()
+        output.write(('{"columns": ' + json.dumps(columns, ensure_ascii=False) + ',\n"rows": [\n').encode('utf8'))
+        self._write_rows(output, offsets, batches,
+                         lambda string: json.dumps(string, ensure_ascii=False, default=str), b',\n')
+        output.write(b'\n]}\n')
+
+    def _write_ndjson(self, output, offsets: list):
         """
-        tab = {"data": []}
-        for string in self._data:
-            tab['data'].append([str(x) for x in string])
-        with open(self._file_name, 'w') as output:
-            json.dump(tab, output, ensure_ascii=False, indent=4)
+        Write document: row per line as object, keys are columns names
+
+        :param output: binary file
+        :param offsets: pages offsets
+        :type offsets: list
+        """
+        names = self._data.columns if isinstance(self._data, (DataStream, Dataset)) else []
+        self._write_rows(output, offsets, self._batches(),
+                         lambda string: json.dumps(dict(zip(names, string)), ensure_ascii=False, default=str), b'\n')
+        if self._rows:
+            output.write(b'\n')
+
+    def _schema_batches(self) -> (Iterable, list):
+        """
+        Columns schema by the first batch of rows
+
+        :return: batches (the first one included) and columns schema
+        :rtype: (Iterable, list)
+        """
+        names = self._data.columns if isinstance(self._data, (DataStream, Dataset)) else []
+        batches = iter(self._batches())
+        first = next(batches, [])
+        columns = []
+        for i, name in enumerate(names):
+            value = next((string[i] for string in first if string[i] is not None), None)
+            columns.append({'name': name, 'type': SCHEMA_TYPES.get(type(value), 'null' if value is None else 'str')})
+
+        def chain():
+            yield first
+            yield from batches
+
+        return chain(), columns
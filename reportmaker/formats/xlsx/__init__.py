@@ -1,8 +1,13 @@
-import os
-import pandas as pd
+import json
+import xlsxwriter
 from reportmaker.formats import Document
-from reportmaker.utils.helpers import get_database_data
-from reportmaker.config import translate as _, logger, cmd_args
+from reportmaker.utils.dataset import Dataset
+from reportmaker.utils.helpers import DataStream
+from reportmaker.utils.progress import progress
+from reportmaker.config import translate as _, logger
+
+# Excel sheet rows limit
+MAX_ROWS = 1048576
 
 
 class XlsxDocument(Document):
@@ -12,27 +17,36 @@ class XlsxDocument(Document):
     See: https://xlsxwriter.readthedocs.io/
          https://xlsxwriter.readthedocs.io/chart.html
 
+    With document 'constant_memory' rows are flushed to file as they are written (memory doesn't depend on
+    table size), so 'cells' and 'rows_formats' can't change rows which are already written.
+    Table longer than sheet rows limit continues on new sheet with the same header and formats.
+    Incremental export writes new rows to new workbook (<document file>.part<n>.xlsx).
+
     """
-    def __init__(self, descriptor: dict):
+    _streaming = True
+    _incremental = 'part'
+
+    def __init__(self, descriptor: dict, fetched: dict = None):
         """
         Constructor
 
         :param descriptor: document descriptor
         :type descriptor: dict
+        :param fetched: results of sql data blocks, shared by documents of several formats
+        :type fetched: dict
         """
-        super().__init__(descriptor)
-        file_name = os.path.join(cmd_args.output, os.path.basename(cmd_args.input).split('.')[0] + '.xlsx')
-        self._writer = pd.ExcelWriter(file_name, engine='xlsxwriter')
-        self._workbook = self._writer.book
+        super().__init__(descriptor, fetched)
+        self._workbook = xlsxwriter.Workbook(self._file_name, {
+            'constant_memory': descriptor.get('document', {}).get('constant_memory', False)
+        })
         self._sheets = descriptor.get('document', {}).get('sheets', ['Sheet1'])
         self._max_row, self._max_col = 0, 0
         self._current_sheet = -1
-        self._current_frame = None
-        self._frame = {}
         self._start_row = 0
         self._start_column = 0
         self._delta_row = 1
         self._styles = {}
+        self._formats = {}
         self._table_last_row = 0
         self._table_last_column = 0
 
@@ -40,16 +54,20 @@ class XlsxDocument(Document):
         """
         Create and save document
         """
-        self._writer.close()
+        self._workbook.close()
 
     def create_style(self, style: dict):
         """
-        Create style
+        Create style (format of workbook is shared by styles with equal parameters)
 
         :param style: style descriptor
         :type style: dict
         """
-        self._styles[style.get('name', 'default')] = self._workbook.add_format(style.get('parameters', {}))
+        parameters = style.get('parameters', {})
+        key = json.dumps(parameters, sort_keys=True, default=str)
+        if key not in self._formats:
+            self._formats[key] = self._workbook.add_format(parameters)
+        self._styles[style.get('name', 'default')] = self._formats[key]
 
     def create_paragraph_style(self, style: dict, name: str):
         """
@@ -86,37 +104,68 @@ class XlsxDocument(Document):
         self._start_row = table.get('start_row', self._start_row)
         self._start_column = table.get('start_column', self._start_column)
 
-        # Get database data if sql
-
-        if isinstance(table.get('data', []), dict):
-            data = get_database_data(cmd_args.database, ''.join(table.get('data').get('sql', '')), logger, cmd_args)
-            self._table_last_row = self._start_row + len(data) - 1
-            self._table_last_column = self._start_column + len(data[0]) - 1
-            table['data'] = data
-        else:
-            self._table_last_row = self._start_row + len(table.get('data', [])) - 1
-            self._table_last_column = self._start_column + len(table.get('data', [])[0]) - 1
-
-        # Frame to Excel
-
-        frame = self.data_to_frame(table.get('data', []))
-        self._current_frame = pd.DataFrame(frame)
-        self._max_row, self._max_col = self._current_frame.shape
-        self._current_frame.to_excel(self._writer, sheet_name=self._sheets[self._current_sheet], index=False,
-                                     startrow=self._start_row + 1, startcol=self._start_column, header=False)
-
-        # Current sheet object
-
-        sheet_obj = self._workbook.sheetnames[self._sheets[self._current_sheet]]
-
-        # Set headers
-
-        for col_number, value in enumerate(table.get('data', [])[:1][0]):
-            sheet_obj.write(self._start_row, col_number + self._start_column, value, self._styles.get(
+        # Header and rows are written to sheet in order as they are fetched
+
+        data = table.get('data', [])
+        if isinstance(data, dict):
+            data = self._stream_data(data)
+        elif not isinstance(data, (DataStream, Dataset)):
+            data = Dataset.from_rows(data)
+        with data:
+            header = data.columns
+            sheet_obj, first_row = self._get_sheet(), self._start_row
+            self._write_header(sheet_obj, first_row, header, table)
+            row, parts = first_row + 1, []
+            for batch in data.batches():
+                for string in batch:
+                    if row >= MAX_ROWS:
+                        parts.append((sheet_obj, first_row, row - 1))
+                        sheet_obj, first_row = self._next_sheet(parts[0][0].name), 0
+                        self._write_header(sheet_obj, first_row, header, table)
+                        row = 1
+                    sheet_obj.write_row(row, self._start_column, string)
+                    row += 1
+                progress.rows_written(len(batch))
+            parts.append((sheet_obj, first_row, row - 1))
+            self._max_row, self._max_col = row - 1 - first_row, len(header)
+        self._table_last_column = self._start_column + len(header) - 1
+
+        # Formats are set for every sheet of table, cells are written to the first one
+
+        for number, (sheet_obj, first_row, last_row) in enumerate(parts):
+            self._start_row, self._table_last_row = first_row, last_row
+            if not number:
+                self._write_cells(sheet_obj, table)
+            self._set_formats(sheet_obj, table)
+
+        self._start_row += self._max_row + self._delta_row + 1
+
+    def _write_header(self, sheet_obj, row: int, header: list, table: dict):
+        """
+        Write table header
+
+        :param sheet_obj: sheet object
+        :type sheet_obj: Worksheet
+        :param row: header row
+        :type row: int
+        :param header: columns names
+        :type header: list
+        :param table: table descriptor
+        :type table: dict
+        """
+        for col_number, value in enumerate(header):
+            sheet_obj.write(row, col_number + self._start_column, value, self._styles.get(
                 table.get('header_format', 'default'), 'default'))
 
-        # Cells write to sheet
+    def _write_cells(self, sheet_obj, table: dict):
+        """
+        Write table cells
 
+        :param sheet_obj: sheet object
+        :type sheet_obj: Worksheet
+        :param table: table descriptor
+        :type table: dict
+        """
         for cell in table.get('cells', []):
             if len(cell) != 4 or not isinstance(cell[0], int) or not isinstance(cell[1], int) or \
                     not isinstance(cell[3], str):
@@ -124,14 +173,24 @@ class XlsxDocument(Document):
                 continue
             sheet_obj.write(cell[0], cell[1], cell[2], self._styles.get(cell[3], 'default'))
 
+    def _set_formats(self, sheet_obj, table: dict):
+        """
+        Set columns, rows and cells formats of table
+
+        :param sheet_obj: sheet object
+        :type sheet_obj: Worksheet
+        :param table: table descriptor
+        :type table: dict
+        """
+
         # Columns formats
 
         for cf in table.get('columns_formats', []):
             if len(cf) != 4 or not isinstance(cf[2], int) or not isinstance(cf[3], str):
                 logger.warning(f"{_('column format')} '{str(cf)}' {_('is invalid')}")
                 continue
-            cf[0], cf[1] = self._normalize_column(cf[0]), self._normalize_column(cf[1])
-            sheet_obj.set_column(cf[0], cf[1], cf[2], self._styles.get(cf[3], 'default'))
+            sheet_obj.set_column(self._normalize_column(cf[0]), self._normalize_column(cf[1]), cf[2],
+                                 self._styles.get(cf[3], 'default'))
 
         # Rows formats
 
@@ -139,10 +198,7 @@ class XlsxDocument(Document):
             if len(rf) != 3 or not isinstance(rf[1], int) or not isinstance(rf[2], str):
                 logger.warning(f"{_('row format')} '{str(rf)}' {_('is invalid')}")
                 continue
-            rf[0] = self._normalize_row(rf[0])
-            if not rf[1]:
-                rf[1] = None
-            sheet_obj.set_row(rf[0], rf[1], self._styles.get(rf[2], 'default'))
+            sheet_obj.set_row(self._normalize_row(rf[0]), rf[1] if rf[1] else None, self._styles.get(rf[2], 'default'))
 
         # Cells formats
 
@@ -150,15 +206,32 @@ class XlsxDocument(Document):
             if len(cf) != 5 or not isinstance(cf[4], str):
                 logger.warning(f"{_('cell format')} '{str(cf)}' {_('is invalid')}")
                 continue
-            cf[0], cf[1], cf[2], cf[3] = self._normalize_row(cf[0]), self._normalize_column(cf[1]), \
-                self._normalize_row(cf[2]), self._normalize_column(cf[3])
-            sheet_obj.conditional_format(cf[0], cf[1], cf[2], cf[3],
+            sheet_obj.conditional_format(self._normalize_row(cf[0]), self._normalize_column(cf[1]),
+                                         self._normalize_row(cf[2]), self._normalize_column(cf[3]),
                                          {
                                              'type': 'no_errors',
                                              'format': self._styles.get(cf[4], 'default')
                                          })
 
-        self._start_row += len(frame[list(frame.keys())[0]]) + self._delta_row + 1
+    def _next_sheet(self, name: str):
+        """
+        Continue table on new sheet (sheet rows limit is reached)
+
+        :param name: name of the first sheet of table
+        :type name: str
+        :return: sheet object
+        :rtype: Worksheet
+        """
+        part = 2
+        while f'{name[:25]} ({part})' in self._sheets:
+            part += 1
+        if self._current_sheet < 0:
+            self._current_sheet += len(self._sheets)
+        self._current_sheet += 1
+        self._sheets.insert(self._current_sheet, f'{name[:25]} ({part})')
+        logger.info(f"{_('sheet')} '{name}' {_('is full')}, {_('table continues on sheet')} "
+                    f"'{self._sheets[self._current_sheet]}'")
+        return self._get_sheet()
 
     def create_image(self, image: dict):
         """
@@ -173,7 +246,7 @@ class XlsxDocument(Document):
             if len(coordinates) != 2:
                 logger.warning(f"{_('coordinates format')} '{str(coordinates)}' {_('is invalid')}")
             row, col = self._normalize_row(coordinates[0]), self._normalize_column(coordinates[1])
-            self._writer.sheets[self._sheets[self._current_sheet]].insert_image(row, col, source, options)
+            self._get_sheet().insert_image(row, col, source, options)
 
     def create_chart(self, common_chart: dict):
         """
@@ -186,27 +259,19 @@ class XlsxDocument(Document):
                                           'subtype': common_chart.get('subtype', 'stacked')})
         for seria in common_chart.get('series', []):
             chart.add_series(seria)
-        self._writer.sheets[self._sheets[self._current_sheet]].insert_chart(
+        self._get_sheet().insert_chart(
             common_chart.get('row', 1), common_chart.get('column', 10), chart, common_chart.get('options', None))
 
-    @staticmethod
-    def data_to_frame(data: list) -> dict:
+    def _get_sheet(self):
         """
-        Convert data to frame
+        Get current sheet object, create it if not exists
 
-        :param data: data (list of rows)
-        :type data: list
-        :return: data frame
-        :rtype: dict
+        :return: sheet object
+        :rtype: Worksheet
         """
-        frame = {}
-        for i in range(len(data)):
-            for j in range(len(data[i])):
-                if not i:
-                    frame[data[i][j]] = []
-                else:
-                    frame[data[0][j]].append(data[i][j])
-        return frame
+        name = self._sheets[self._current_sheet]
+        sheet_obj = self._workbook.get_worksheet_by_name(name)
+        return sheet_obj if sheet_obj is not None else self._workbook.add_worksheet(name)
 
     def _normalize_column(self, column: int) -> int:
         """
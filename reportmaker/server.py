@@ -0,0 +1,356 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import hmac
+import json
+import uuid
+import argparse
+import threading
+import socketserver
+import multiprocessing
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from concurrent.futures import ProcessPoolExecutor, Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+########################################################################################################################
+#                                                  Report server                                                       #
+########################################################################################################################
+
+# API (json):
+#   POST /jobs        job (see batch: input, parameters, output, database, token, callback_url) -> {"id": ...}
+#   GET  /jobs/<id>   job status ("queued", "ok" or "error", file, error, duration)
+#   GET  /health      workers and jobs counters
+# Job status is sent to callback url of job with its token when job is finished
+#
+# Requests must have header "Authorization: Bearer <server/token of configuration>" (token is required for TCP,
+# unix socket is accessible by server user only). Job input must be inside 'input_roots' (default: current
+# directory), output inside 'output_roots' (default: output directory of command line), callback url must start
+# with one of 'callbacks' (callback url of command line is allowed), database must be named connection
+# ('connections' of configuration)
+
+# Finished jobs statuses, which are kept for GET /jobs/<id>
+MAX_STATUSES = 10000
+
+# Time to wait for start of worker processes, seconds
+START_TIMEOUT = 120
+
+# Barrier of workers start (worker process)
+_started = None
+
+parser = argparse.ArgumentParser(prog='report-server',
+                                 description='other options are passed to report (see report -h)')
+parser.add_argument('--host', help='host of HTTP API', default='127.0.0.1')
+parser.add_argument('--port', type=int, help='port of HTTP API', default=8090)
+parser.add_argument('-u', '--socket', help='unix socket of HTTP API (instead of host and port)')
+parser.add_argument('-w', '--workers', type=int, help='worker processes (default: server/workers of configuration, '
+                                                      '0 - number of CPUs)')
+
+
+def _init_server_worker(argv: list, preload: list, started):
+    """
+    Configure worker process of report server
+
+    :param argv: command line arguments of report
+    :type argv: list
+    :param preload: formats, which modules are imported in advance
+    :type preload: list
+    :param started: barrier of workers start
+    :type started: multiprocessing.Barrier
+    """
+    global _started
+    from reportmaker.batch import _init_worker
+    _init_worker(argv, preload)
+    _started = started
+
+
+def _wait_started() -> int:
+    """
+    Wait until all workers are started (task of worker keeps it busy, so every worker gets one task)
+
+    :return: worker process id
+    :rtype: int
+    """
+    _started.wait(START_TIMEOUT)
+    return os.getpid()
+
+
+class ReportServer:
+    """
+    Jobs of report server are run by pool of worker processes. Workers are started with server and live as long as
+    it, so imported format modules, connections pool and caches are warm for next jobs
+    """
+
+    def __init__(self, workers: int, argv: list, settings: dict = None):
+        """
+        Constructor
+
+        :param workers: worker processes
+        :type workers: int
+        :param argv: command line arguments of report (for worker processes)
+        :type argv: list
+        :param settings: server settings: 'preload' (formats, which modules are imported by workers in advance),
+                         'token', 'input_roots', 'output_roots', 'callbacks', 'connections' (see API)
+        :type settings: dict
+        """
+        settings = settings or {}
+        context = multiprocessing.get_context(
+            'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+        self.workers = workers
+        self.token = settings.get('token') or None
+        self._input_roots = settings.get('input_roots', [os.getcwd()])
+        self._output_roots = settings.get('output_roots', [])
+        self._callbacks = [urlsplit(url) for url in settings.get('callbacks', [])]
+        self._connections = set(settings.get('connections', ()))
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                             initializer=_init_server_worker,
+                                             initargs=(argv, list(settings.get('preload', [])),
+                                                       context.Barrier(workers)))
+        self._statuses = OrderedDict()
+        self._lock = threading.Lock()
+        for future in [self._executor.submit(_wait_started) for _ in range(workers)]:
+            future.result()
+
+    def submit(self, job: dict) -> dict:
+        """
+        Queue job
+
+        :param job: job
+        :type job: dict
+        :return: job status
+        :rtype: dict
+        """
+        from reportmaker.batch import run_job
+        self._check(job)
+        job = {**job, 'id': str(job.get('id', uuid.uuid4().hex))}
+        status = {'id': job['id'], 'input': job['input'], 'status': 'queued'}
+        with self._lock:
+            self._statuses[job['id']] = status
+            while len(self._statuses) > MAX_STATUSES:
+                self._statuses.popitem(last=False)
+        self._executor.submit(run_job, job, self._output_roots).add_done_callback(
+            lambda future: self._finish(job, future))
+        return status
+
+    def _check(self, job: dict):
+        """
+        Check, that job reads and writes allowed files and calls allowed urls only
+
+        :param job: job
+        :type job: dict
+        :raises ValueError: job is not allowed
+        """
+        from reportmaker.utils.helpers import inside_roots
+        if not isinstance(job.get('input'), str):
+            raise ValueError('input expected')
+        if not inside_roots(job['input'], self._input_roots):
+            raise ValueError('input is out of allowed directories')
+        if 'output' in job and not (isinstance(job['output'], str) and inside_roots(job['output'],
+                                                                                    self._output_roots)):
+            raise ValueError('output is out of allowed directories')
+        progress = job.get('progress')
+        if progress not in (None, 'callback', 'stdout') and not (
+                isinstance(progress, str) and inside_roots(progress, self._output_roots)):
+            raise ValueError('progress file is out of allowed directories')
+        if 'callback_url' in job and not (isinstance(job['callback_url'], str) and self._allowed_callback(
+                job['callback_url'])):
+            raise ValueError('callback url is not allowed')
+        if 'database' in job and job['database'] not in self._connections:
+            raise ValueError('database must be named connection of configuration')
+
+    def _allowed_callback(self, url: str) -> bool:
+        """
+        Callback url starts with one of allowed urls (the same scheme and host, path is inside allowed path)
+
+        :param url: callback url
+        :type url: str
+        :return: True, if url is allowed
+        :rtype: bool
+        """
+        parsed = urlsplit(url)
+        return any(parsed.scheme == allowed.scheme and parsed.netloc == allowed.netloc and (
+            parsed.path == allowed.path or parsed.path.startswith(allowed.path.rstrip('/') + '/'))
+            for allowed in self._callbacks)
+
+    def _finish(self, job: dict, future: Future):
+        """
+        Save status of finished job
+
+        :param job: job
+        :type job: dict
+        :param future: job result
+        :type future: Future
+        """
+        try:
+            status = future.result()
+        except Exception as e:
+            status = {'id': job['id'], 'input': job['input'], 'status': 'error', 'file': None, 'error': str(e),
+                      'duration': None}
+        with self._lock:
+            self._statuses[job['id']] = status
+
+    def status(self, job_id: str) -> dict or None:
+        """
+        Job status
+
+        :param job_id: job id
+        :type job_id: str
+        :return: job status or None if job is unknown
+        :rtype: dict or None
+        """
+        with self._lock:
+            return self._statuses.get(job_id)
+
+    def health(self) -> dict:
+        """
+        Server counters
+
+        :return: workers and jobs counters
+        :rtype: dict
+        """
+        with self._lock:
+            statuses = [status['status'] for status in self._statuses.values()]
+        return {'workers': self.workers, 'jobs': {key: statuses.count(key) for key in ('queued', 'ok', 'error')}}
+
+    def close(self):
+        """
+        Wait for queued jobs and stop workers
+        """
+        self._executor.shutdown(wait=True)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of report server
+    """
+    server_version = 'report-server'
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        report_server = self.server.report_server
+        if self.path == '/health':
+            self._reply(200, report_server.health())
+        elif self.path.startswith('/jobs/'):
+            status = report_server.status(self.path[len('/jobs/'):])
+            if status:
+                self._reply(200, status)
+            else:
+                self._reply(404, {'error': 'job not found'})
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if self.path != '/jobs':
+            self._reply(404, {'error': 'not found'})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(job, dict):
+                raise ValueError('job must be object')
+            self._reply(202, self.server.report_server.submit(job))
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+
+    def _authorized(self) -> bool:
+        """
+        Check token of request (reply 401, if it is wrong)
+
+        :return: True, if request is authorized
+        :rtype: bool
+        """
+        token = self.server.report_server.token
+        if token is None or hmac.compare_digest(self.headers.get('Authorization', '').encode('utf8'),
+                                                f'Bearer {token}'.encode('utf8')):
+            return True
+        self._reply(401, {'error': 'unauthorized'})
+        return False
+
+    def _reply(self, code: int, data: dict):
+        """
+        Send json response
+
+        :param code: HTTP status code
+        :type code: int
+        :param data: response data
+        :type data: dict
+        """
+        body = json.dumps(data, ensure_ascii=False, default=str).encode('utf8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        from reportmaker.config import logger
+        logger.debug('%s %s' % (self.address_string(), format % args))
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    HTTP server on unix socket (client address is ('unix', 0) for request handler)
+    """
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+def main():
+    sys.path.append('../')
+    sys.path.append('/app')
+    server_args, argv = parser.parse_known_args()
+    argv += ['-i', '-']
+    from reportmaker.utils.pool import connection_pool
+    from reportmaker.config import configure, translate as _
+    configure(argv)
+    from reportmaker.config import logger, config_args, cmd_args
+    settings = {'output_roots': [cmd_args.output], **config_args.get('server', {})}
+    settings['callbacks'] = [cmd_args.callback_url, *settings.get('callbacks', [])]
+    settings['connections'] = list(config_args.get('connections', {}))
+    settings['token'] = settings.get('token') or os.environ.get('REPORT_SERVER_TOKEN')
+    if not server_args.socket and not settings['token']:
+        logger.error(f"{_('report server')}: {_('token')} ({_('server/token of configuration')}) "
+                     f"{_('is required for TCP')}")
+        sys.exit(1)
+    workers = server_args.workers if server_args.workers is not None else settings.get('workers', 0)
+    report_server = ReportServer(workers or os.cpu_count(), argv, settings)
+    if server_args.socket:
+        if os.path.exists(server_args.socket):
+            os.remove(server_args.socket)
+        umask = os.umask(0o177)
+        try:
+            http_server = UnixHTTPServer(server_args.socket, RequestHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(server_args.socket, 0o600)
+        address = server_args.socket
+    else:
+        http_server = ThreadingHTTPServer((server_args.host, server_args.port), RequestHandler)
+        address = f'{server_args.host}:{server_args.port}'
+    http_server.report_server = report_server
+    logger.info(f"{_('report server')} {_('started')} {_('on')} {address}, {report_server.workers} {_('workers')}")
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        report_server.close()
+        connection_pool.close()
+        if server_args.socket and os.path.exists(server_args.socket):
+            os.remove(server_args.socket)
+        logger.info(f"{_('report server')} {_('stopped')}")
+
+########################################################################################################################
+#                                                  Entry point                                                         #
+########################################################################################################################
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,680 @@
+import os
+import re
+import json
+import zlib
+import time
+import uuid
+import stat
+import base64
+import struct
+import hashlib
+import weakref
+import importlib
+import threading
+from typing import Callable
+from collections import OrderedDict
+from decimal import Decimal
+from datetime import datetime, date, time as day_time, timedelta
+
+########################################################################################################################
+#                                                 On-disk cache                                                        #
+########################################################################################################################
+
+
+class FileCache:
+    """
+    Size bounded on-disk cache. Entry recency is its file modification time, least recently used entries are evicted
+    """
+
+    def __init__(self, directory: str, max_size: int, suffix: str or tuple):
+        """
+        Constructor
+
+        :param directory: cache directory
+        :type directory: str
+        :param max_size: maximum cache size, bytes
+        :type max_size: int
+        :param suffix: entries files suffix (or suffixes of entries kinds, the first one is default)
+        :type suffix: str or tuple
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self._suffixes = suffix if isinstance(suffix, tuple) else (suffix,)
+        self._lock = threading.Lock()
+
+    def check_directory(self, create: bool = False):
+        """
+        Check, that cache directory is private: it is owned by current user and is not writable by others (entries of
+        shared directory could be planted or read by other users). Directory is created with mode 0o700, permissions
+        of own directory, which is not writable by others, are restricted to 0o700
+
+        :param create: create directory, if it does not exist
+        :type create: bool
+        :raises PermissionError: directory is not private
+        """
+        if create:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        status = os.lstat(self.directory)
+        if not stat.S_ISDIR(status.st_mode) or (hasattr(os, 'getuid') and status.st_uid != os.getuid()) or \
+                status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise PermissionError(f'cache directory is not private: {self.directory}')
+        if status.st_mode & 0o077:
+            os.chmod(self.directory, 0o700)
+
+    def path(self, key: str, suffix: str = None) -> str:
+        """
+        Entry file name
+
+        :param key: entry key
+        :type key: str
+        :param suffix: entry kind suffix
+        :type suffix: str
+        :return: file name
+        :rtype: str
+        """
+        return os.path.join(self.directory, f'{key}{suffix or self._suffixes[0]}')
+
+    def touch(self, key: str, suffix: str = None):
+        """
+        Mark entry as recently used
+
+        :param key: entry key
+        :type key: str
+        :param suffix: entry kind suffix
+        :type suffix: str
+        """
+        try:
+            os.utime(self.path(key, suffix))
+        except OSError:
+            pass
+
+    def temporary_path(self) -> str:
+        """
+        Temporary file name in cache directory, used to write entry before commit
+
+        :return: file name
+        :rtype: str
+        """
+        self.check_directory(create=True)
+        return os.path.join(self.directory, f'.{uuid.uuid4().hex}.tmp')
+
+    def commit(self, temporary_path: str, key: str, suffix: str = None):
+        """
+        Move written entry into cache and evict old entries
+
+        :param temporary_path: temporary file name
+        :type temporary_path: str
+        :param key: entry key
+        :type key: str
+        :param suffix: entry kind suffix
+        :type suffix: str
+        """
+        os.replace(temporary_path, self.path(key, suffix))
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries while cache size exceeds maximum
+        """
+        with self._lock:
+            entries, total = [], 0
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith(self._suffixes):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            for mtime, size, path in sorted(entries):
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+########################################################################################################################
+#                                                 Query cache                                                          #
+########################################################################################################################
+
+# Key of tagged value in cache frames (values, which are not json types)
+VALUE_TAG = '__rmc__'
+
+# Sql part, which is kept by key normalization (group 1: string literal, quoted identifier, comment), or whitespace
+SQL_TEXT = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*\n?|/\*.*?\*/)|\s+""", re.S)
+
+
+def encode_value(value: object) -> dict:
+    """
+    Tagged value of cache frame (json default hook): decimal, date and time, interval and binary values are kept as
+    tagged strings, so frames are plain data and reading them doesn't execute anything
+
+    :param value: value, which is not json type
+    :type value: object
+    :return: tagged value
+    :rtype: dict
+    :raises TypeError: value type is not supported (result is not cached)
+    """
+    if isinstance(value, Decimal):
+        return {VALUE_TAG: 'decimal', 'value': str(value)}
+    if isinstance(value, datetime):
+        return {VALUE_TAG: 'datetime', 'value': value.isoformat()}
+    if isinstance(value, date):
+        return {VALUE_TAG: 'date', 'value': value.isoformat()}
+    if isinstance(value, day_time):
+        return {VALUE_TAG: 'time', 'value': value.isoformat()}
+    if isinstance(value, timedelta):
+        return {VALUE_TAG: 'timedelta', 'value': [value.days, value.seconds, value.microseconds]}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {VALUE_TAG: 'bytes', 'value': base64.b64encode(value).decode('ascii')}
+    raise TypeError(f'{type(value).__name__} value is not cached')
+
+
+# Decoders of tagged values
+DECODERS = {
+    'decimal': Decimal,
+    'datetime': datetime.fromisoformat,
+    'date': date.fromisoformat,
+    'time': day_time.fromisoformat,
+    'timedelta': lambda value: timedelta(*value),
+    'bytes': base64.b64decode,
+}
+
+
+def decode_value(value: dict) -> object:
+    """
+    Value of cache frame (json object hook)
+
+    :param value: json object
+    :type value: dict
+    :return: decoded value
+    :rtype: object
+    """
+    tag = value.get(VALUE_TAG)
+    return DECODERS[tag](value['value']) if tag in DECODERS else value
+
+
+class QueryCache(FileCache):
+    """
+    Cache of sql results. Entry is a sequence of frames (4 bytes length + zlib compressed json): header with
+    creation time and columns names, then batches of rows. Cache directory must be private (see check_directory)
+    """
+
+    def __init__(self, directory: str = os.path.expanduser('~/.report/cache'), max_size: int = 512 * 1024 * 1024):
+        """
+        Constructor
+
+        :param directory: cache directory
+        :type directory: str
+        :param max_size: maximum cache size, bytes
+        :type max_size: int
+        """
+        super().__init__(directory, max_size, '.rmj')
+        self.hits, self.misses = 0, 0
+
+    @staticmethod
+    def key(sql: str, connection: str, parameters: tuple = (), options: dict = None) -> str:
+        """
+        Cache key: normalized sql (whitespace out of literals, identifiers and comments is collapsed), connection
+        identity, parameters and result conversion options
+
+        :param sql: sql request
+        :type sql: str
+        :param connection: normalized connection string
+        :type connection: str
+        :param parameters: bound parameters
+        :type parameters: tuple
+        :param options: result conversion options
+        :type options: dict
+        :return: key
+        :rtype: str
+        """
+        sql = SQL_TEXT.sub(lambda match: match.group(1) or ' ', sql).strip().rstrip(';').rstrip()
+        options = sorted((options or {}).items())
+        return hashlib.sha256(repr((sql, connection, tuple(parameters), options)).encode('utf8')).hexdigest()
+
+    def open(self, key: str, ttl: int) -> 'CacheReader' or None:
+        """
+        Open entry, if it exists and is not older than ttl
+
+        :param key: entry key
+        :type key: str
+        :param ttl: time to live, seconds
+        :type ttl: int
+        :return: entry reader or None
+        :rtype: CacheReader or None
+        """
+        try:
+            self.check_directory()
+            reader = CacheReader(self.path(key))
+        except (OSError, EOFError, zlib.error, ValueError, KeyError, TypeError):
+            return None
+        if time.time() - reader.created > ttl:
+            reader.close()
+            return None
+        self.touch(key)
+        self.hits += 1
+        return reader
+
+    def writer(self, key: str, columns: list) -> 'CacheWriter':
+        """
+        Create entry writer
+
+        :param key: entry key
+        :type key: str
+        :param columns: columns names
+        :type columns: list
+        :return: entry writer
+        :rtype: CacheWriter
+        """
+        self.misses += 1
+        return CacheWriter(self, key, columns)
+
+
+class CacheReader:
+    """
+    Reader of cached sql result
+    """
+
+    def __init__(self, path: str):
+        """
+        Constructor
+
+        :param path: entry file name
+        :type path: str
+        """
+        self._file = open(path, 'rb')
+        try:
+            header = self.read()
+        except Exception:
+            self._file.close()
+            raise
+        if header is None:
+            self._file.close()
+            raise EOFError(path)
+        self.created, self.columns = header['created'], header['columns']
+
+    def read(self) -> object:
+        """
+        Read next frame
+
+        :return: frame object or None at the end
+        :rtype: object
+        """
+        length = self._file.read(4)
+        if len(length) < 4:
+            return None
+        return json.loads(zlib.decompress(self._file.read(struct.unpack('<I', length)[0])).decode('utf8'),
+                          object_hook=decode_value)
+
+    def batches(self):
+        """
+        Batches of rows
+
+        :return: batches generator
+        :rtype: Generator
+        """
+        try:
+            batch = self.read()
+            while batch is not None:
+                yield [tuple(row) for row in batch]
+                batch = self.read()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Close entry file
+        """
+        self._file.close()
+
+
+class CacheWriter:
+    """
+    Writer of sql result to cache. Entry becomes visible after commit, entry with values, which are not supported by
+    frames encoding, is discarded
+    """
+
+    def __init__(self, cache: QueryCache, key: str, columns: list):
+        """
+        Constructor
+
+        :param cache: query cache
+        :type cache: QueryCache
+        :param key: entry key
+        :type key: str
+        :param columns: columns names
+        :type columns: list
+        """
+        self._cache, self._key = cache, key
+        self._path = cache.temporary_path()
+        self._file = open(self._path, 'wb')
+        self.failed = False
+        self.write({'created': time.time(), 'columns': columns})
+
+    def write(self, frame: object):
+        """
+        Write frame
+
+        :param frame: frame object (header or batch of rows)
+        :type frame: object
+        """
+        if self.failed:
+            return
+        try:
+            data = zlib.compress(json.dumps(frame, ensure_ascii=False, default=encode_value).encode('utf8'))
+        except (TypeError, ValueError):
+            self.failed = True
+            self.discard()
+            return
+        self._file.write(struct.pack('<I', len(data)))
+        self._file.write(data)
+
+    def commit(self):
+        """
+        Close entry and put it into cache
+        """
+        if self.failed:
+            return
+        self._file.close()
+        self._cache.commit(self._path, self._key)
+
+    def discard(self):
+        """
+        Close and remove incomplete entry
+        """
+        self._file.close()
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+
+########################################################################################################################
+#                                                 Chart cache                                                          #
+########################################################################################################################
+
+# Expanded drawings, which are kept by chart cache in memory
+MAX_DRAWINGS = 256
+
+# Key of tagged object in drawing entries (shape, color or tuple)
+SHAPE_TAG = '__rmd__'
+
+# Modules, which classes of drawing entries belong to
+SHAPE_MODULES = ('reportlab.graphics.shapes', 'reportlab.lib.colors')
+
+
+def encode_shape(node: object) -> object:
+    """
+    Json form of expanded drawing: shapes and colors are tagged class names with attributes (instance validators map
+    _attrMap is skipped), tuples are tagged lists
+
+    :param node: drawing or its part
+    :type node: object
+    :return: json form
+    :rtype: object
+    :raises TypeError: object, which is not shape, color or plain value (drawing is kept in memory only)
+    """
+    if node is None or isinstance(node, (bool, int, float, str)):
+        return node
+    if isinstance(node, list):
+        return [encode_shape(x) for x in node]
+    if isinstance(node, tuple):
+        return {SHAPE_TAG: 'tuple', 'items': [encode_shape(x) for x in node]}
+    if type(node) is dict and SHAPE_TAG not in node and all(isinstance(key, str) for key in node):
+        return {key: encode_shape(value) for key, value in node.items()}
+    if type(node).__module__ in SHAPE_MODULES and isinstance(getattr(node, '__dict__', None), dict):
+        return {SHAPE_TAG: f'{type(node).__module__}:{type(node).__qualname__}',
+                'attributes': {key: encode_shape(value) for key, value in vars(node).items() if key != '_attrMap'}}
+    raise TypeError(f'{type(node).__name__} is not stored in chart cache')
+
+
+def decode_shape(value: object) -> object:
+    """
+    Drawing of json form. Only classes of SHAPE_MODULES are created, without constructor: attributes are set to
+    object dictionary, so reading entry doesn't execute anything
+
+    :param value: json form
+    :type value: object
+    :return: drawing or its part
+    :rtype: object
+    :raises ValueError: entry is not a drawing
+    """
+    if isinstance(value, list):
+        return [decode_shape(x) for x in value]
+    if not isinstance(value, dict):
+        return value
+    if SHAPE_TAG not in value:
+        return {key: decode_shape(x) for key, x in value.items()}
+    if value[SHAPE_TAG] == 'tuple':
+        return tuple(decode_shape(x) for x in value['items'])
+    module, _, name = str(value[SHAPE_TAG]).partition(':')
+    node_class = getattr(importlib.import_module(module), name, None) if module in SHAPE_MODULES else None
+    if not isinstance(node_class, type) or node_class.__module__ != module:
+        raise ValueError(f'{value[SHAPE_TAG]} is not a drawing class')
+    node = node_class.__new__(node_class)
+    node.__dict__.update({key: decode_shape(x) for key, x in dict(value['attributes']).items()})
+    return node
+
+
+class ChartCache(FileCache):
+    """
+    Cache of rendered charts. Key is hash of drawing description (chart with all attributes and data), entry is
+    PNG file or drawing with expanded user nodes (vector shapes, which are drawn without chart layout), stored as
+    zlib compressed json (see encode_shape) in private directory (see check_directory). MAX_DRAWINGS recent drawings
+    are kept in memory too
+    """
+
+    def __init__(self, directory: str = os.path.expanduser('~/.report/charts'), max_size: int = 128 * 1024 * 1024):
+        """
+        Constructor
+
+        :param directory: cache directory
+        :type directory: str
+        :param max_size: maximum cache size, bytes
+        :type max_size: int
+        """
+        super().__init__(directory, max_size, ('.png', '.rmd'))
+        self._drawings = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    @classmethod
+    def key(cls, drawing: object) -> str:
+        """
+        Cache key: hash of drawing description (all attributes of drawing and its nodes)
+
+        :param drawing: drawing
+        :type drawing: Drawing
+        :return: key
+        :rtype: str
+        """
+        return hashlib.sha256(repr(cls._describe(drawing, set())).encode('utf8')).hexdigest()
+
+    @classmethod
+    def _describe(cls, node: object, path: set) -> object:
+        """
+        Description of object: primitive value or nested tuples of class name and attributes (attributes
+        validators map _attrMap of reportlab nodes is skipped)
+
+        :param node: object
+        :type node: object
+        :param path: ids of objects which are being described (reference cycles and weak references are cut)
+        :type path: set
+        :return: description
+        :rtype: object
+        """
+        if node is None or isinstance(node, (bool, int, float, str, bytes)):
+            return node
+        if id(node) in path or isinstance(node, weakref.ref):
+            return '<reference>'
+        path.add(id(node))
+        try:
+            if isinstance(node, (list, tuple)):
+                return type(node).__name__, tuple(cls._describe(x, path) for x in node)
+            if isinstance(node, (set, frozenset)):
+                return 'set', tuple(sorted(repr(cls._describe(x, path)) for x in node))
+            if isinstance(node, dict):
+                return 'dict', tuple(sorted((repr(key), cls._describe(value, path)) for key, value in node.items()))
+            if callable(node) and hasattr(node, '__qualname__'):
+                return getattr(node, '__module__', None), node.__qualname__
+            attributes = getattr(node, '__dict__', None)
+            if attributes is None:
+                return repr(node)
+            return type(node).__qualname__, tuple(
+                (key, cls._describe(value, path)) for key, value in sorted(attributes.items()) if key != '_attrMap'
+            )
+        finally:
+            path.discard(id(node))
+
+    def image(self, key: str, render: Callable) -> str:
+        """
+        PNG file of chart, rendered if it is not cached
+
+        :param key: entry key
+        :type key: str
+        :param render: function, which renders chart to given file name
+        :type render: Callable
+        :return: PNG file name
+        :rtype: str
+        """
+        path = self.path(key, '.png')
+        self.check_directory(create=True)
+        if os.path.exists(path):
+            self.touch(key, '.png')
+            self.hits += 1
+            return path
+        self.misses += 1
+        temporary_path = self.temporary_path()
+        try:
+            render(temporary_path)
+            self.commit(temporary_path, key, '.png')
+        except Exception:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        return path
+
+    def drawing(self, key: str, expand: Callable) -> object:
+        """
+        Drawing with expanded user nodes, expanded if it is not cached (in memory or on disk)
+
+        :param key: entry key
+        :type key: str
+        :param expand: function, which expands drawing
+        :type expand: Callable
+        :return: drawing
+        :rtype: Drawing
+        """
+        with self._lock:
+            drawing = self._drawings.get(key)
+            if drawing is not None:
+                self._drawings.move_to_end(key)
+                self.hits += 1
+                return drawing
+        drawing = self._load_drawing(key)
+        if drawing is None:
+            drawing = expand()
+            self._save_drawing(key, drawing)
+        with self._lock:
+            self._drawings[key] = drawing
+            while len(self._drawings) > MAX_DRAWINGS:
+                self._drawings.popitem(last=False)
+        return drawing
+
+    def _load_drawing(self, key: str) -> object or None:
+        """
+        Read drawing entry
+
+        :param key: entry key
+        :type key: str
+        :return: drawing or None, if entry is not found or is not readable
+        :rtype: Drawing or None
+        """
+        try:
+            self.check_directory()
+            with open(self.path(key, '.rmd'), 'rb') as entry:
+                drawing = decode_shape(json.loads(zlib.decompress(entry.read()).decode('utf8')))
+        except (OSError, zlib.error, ValueError, KeyError, TypeError, AttributeError, ImportError):
+            with self._lock:
+                self.misses += 1
+            return None
+        self.touch(key, '.rmd')
+        with self._lock:
+            self.hits += 1
+        return drawing
+
+    def _save_drawing(self, key: str, drawing: object):
+        """
+        Write drawing entry (drawing, which has objects other than shapes and colors, is not written)
+
+        :param key: entry key
+        :type key: str
+        :param drawing: expanded drawing
+        :type drawing: Drawing
+        """
+        try:
+            data = zlib.compress(json.dumps(encode_shape(drawing), ensure_ascii=False).encode('utf8'))
+        except (TypeError, ValueError):
+            return
+        try:
+            temporary_path = self.temporary_path()
+        except OSError:
+            return
+        try:
+            with open(temporary_path, 'wb') as entry:
+                entry.write(data)
+            self.commit(temporary_path, key, '.rmd')
+        except OSError:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+
+########################################################################################################################
+#                                                 Plan cache                                                           #
+########################################################################################################################
+
+
+class PlanCache:
+    """
+    Cache of compiled descriptors. Plan is kept in process by descriptor file name, while file modification time and
+    size are the same (plans are objects, so they are not stored on disk)
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def load(self, file_name: str, compile_plan: Callable) -> object:
+        """
+        Compiled descriptor, it is compiled if it is not cached
+
+        :param file_name: descriptor file name
+        :type file_name: str
+        :param compile_plan: function (or class), which compiles descriptor text
+        :type compile_plan: Callable
+        :return: plan
+        :rtype: DescriptorPlan
+        """
+        stat_result = os.stat(file_name)
+        path, version = os.path.abspath(file_name), (stat_result.st_mtime_ns, stat_result.st_size)
+        with self._lock:
+            cached = self._plans.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+        with open(file_name) as descriptor_file:
+            plan = compile_plan(descriptor_file.read())
+        with self._lock:
+            self._plans[path] = version, plan
+        return plan
+
+
+query_cache = QueryCache()
+chart_cache = ChartCache()
+plan_cache = PlanCache()
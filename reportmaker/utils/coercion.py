@@ -0,0 +1,108 @@
+from decimal import Decimal
+from datetime import datetime
+
+########################################################################################################################
+#                                            Column type coercion                                                      #
+########################################################################################################################
+
+# Default coercion options (the same conversion as the formats always had: numbers to float, datetime to string)
+#   integer: 'float' or 'keep'
+#   decimal: 'float', 'str' or 'keep'
+#   datetime: 'str' (2020-01-01 00:00:00), 'iso' (2020-01-01T00:00:00) or 'native'
+#   null: value for NULL
+DEFAULT_OPTIONS = {'integer': 'float', 'decimal': 'float', 'datetime': 'str', 'null': None}
+
+# psycopg2 type codes (OIDs) of text columns: char, name, text, bpchar, varchar
+TEXT_OIDS = {18, 19, 25, 1042, 1043}
+
+
+class TypeCoercion:
+    """
+    Converts batches of rows column by column. Converter is chosen once per value type and applied to the whole
+    column of the batch; text columns (known by cursor description) are not scanned at all
+    """
+
+    def __init__(self, options: dict = None, description: tuple = None):
+        """
+        Constructor
+
+        :param options: coercion options (see DEFAULT_OPTIONS)
+        :type options: dict
+        :param description: cursor description
+        :type description: tuple
+        """
+        self.options = {**DEFAULT_OPTIONS, **(options or {})}
+        self._null = self.options['null']
+        self._converters = {}
+        self._skip = {
+            i for i, desc in enumerate(description or []) if desc[1] is str or desc[1] in TEXT_OIDS
+        } if self._null is None else set()
+
+    def convert(self, batch: list) -> list:
+        """
+        Convert batch of rows
+
+        :param batch: rows
+        :type batch: list
+        :return: converted rows
+        :rtype: list
+        """
+        if not batch:
+            return batch
+        columns, changed = list(zip(*batch)), False
+        for i, column in enumerate(columns):
+            if i in self._skip:
+                continue
+            types = set(map(type, column))
+            nulls = type(None) in types
+            types.discard(type(None))
+            if len(types) > 1:
+                columns[i], changed = [self._convert_value(x) for x in column], True
+                continue
+            converter = self._converter(types.pop()) if types else None
+            if converter and nulls:
+                columns[i] = [self._null if x is None else converter(x) for x in column]
+            elif converter:
+                columns[i] = list(map(converter, column))
+            elif nulls and self._null is not None:
+                columns[i] = [self._null if x is None else x for x in column]
+            else:
+                continue
+            changed = True
+        return list(zip(*columns)) if changed else batch
+
+    def _converter(self, value_type: type):
+        """
+        Converter for value type (memoized)
+
+        :param value_type: value type
+        :type value_type: type
+        :return: converter or None if values are not converted
+        :rtype: Callable or None
+        """
+        if value_type not in self._converters:
+            converter = None
+            if issubclass(value_type, datetime):
+                converter = {'str': str, 'iso': value_type.isoformat}.get(self.options['datetime'])
+            elif issubclass(value_type, Decimal):
+                converter = {'float': float, 'str': str}.get(self.options['decimal'])
+            elif issubclass(value_type, int):
+                converter = float if self.options['integer'] == 'float' else None
+            elif issubclass(value_type, float) or issubclass(value_type, str):
+                converter = None
+            elif hasattr(value_type, 'real') and hasattr(value_type, 'imag'):
+                converter = float
+            self._converters[value_type] = converter
+        return self._converters[value_type]
+
+    def _convert_value(self, value):
+        """
+        Convert single value (column with mixed types)
+
+        :param value: value
+        :return: converted value
+        """
+        if value is None:
+            return self._null
+        converter = self._converter(type(value))
+        return converter(value) if converter else value
@@ -0,0 +1,235 @@
+from array import array
+from typing import Iterable
+
+########################################################################################################################
+#                                                Columnar dataset                                                      #
+########################################################################################################################
+
+# Array typecodes for column types, other columns are stored as lists
+TYPECODES = {'int': 'q', 'float': 'd'}
+
+
+class Dataset:
+    """
+    Columnar sql result: columns names, columns types and one container per column (array for numbers without NULLs,
+    list for other values)
+    """
+
+    def __init__(self, columns: list, dtypes: list = None, data: list = None):
+        """
+        Constructor
+
+        :param columns: columns names
+        :type columns: list
+        :param dtypes: columns types ('int', 'float', 'str', 'object')
+        :type dtypes: list
+        :param data: columns containers
+        :type data: list
+        """
+        self.columns = list(columns)
+        self.dtypes = list(dtypes) if dtypes else ['object'] * len(self.columns)
+        self.data = data if data is not None else [[] for _ in self.columns]
+
+    def __len__(self) -> int:
+        return len(self.data[0]) if self.data else 0
+
+    def __iter__(self):
+        return self.rows()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def rows_count(self) -> int:
+        """
+        Rows count
+
+        :return: rows count
+        :rtype: int
+        """
+        return len(self)
+
+    @classmethod
+    def from_batches(cls, columns: list, batches: Iterable) -> 'Dataset':
+        """
+        Create dataset from batches of rows. Columns types are detected by the first not NULL values
+
+        :param columns: columns names
+        :type columns: list
+        :param batches: batches of rows
+        :type batches: Iterable
+        :return: dataset
+        :rtype: Dataset
+        """
+        dataset = cls(columns)
+        for batch in batches:
+            dataset.extend(batch)
+        return dataset
+
+    @classmethod
+    def from_rows(cls, rows: list) -> 'Dataset':
+        """
+        Create dataset from list of rows, header first (inline descriptor data)
+
+        :param rows: rows, header first
+        :type rows: list
+        :return: dataset
+        :rtype: Dataset
+        """
+        return cls.from_batches(rows[0], [rows[1:]]) if rows else cls([])
+
+    def extend(self, rows: list):
+        """
+        Append batch of rows
+
+        :param rows: rows
+        :type rows: list
+        """
+        if not rows:
+            return
+        width = len(self.columns)
+        if set(map(len, rows)) != {width}:
+            rows = [list(row[:width]) + [None] * (width - len(row)) for row in rows]
+        for i, values in enumerate(zip(*rows)):
+            if not len(self.data[i]) and self.dtypes[i] == 'object':
+                self._set_type(i, values)
+            column = self.data[i]
+            if isinstance(column, array):
+                size = len(column)
+                try:
+                    column.extend(values)
+                    continue
+                except (TypeError, OverflowError):
+                    del column[size:]
+                    self.data[i] = column = column.tolist()
+                    self.dtypes[i] = 'object'
+            column.extend(values)
+
+    def _set_type(self, i: int, values: tuple):
+        """
+        Detect column type and create column container
+
+        :param i: column index
+        :type i: int
+        :param values: first values of column
+        :type values: tuple
+        """
+        value = next((x for x in values if x is not None), None)
+        if isinstance(value, float):
+            self.dtypes[i] = 'float'
+        elif isinstance(value, int) and not isinstance(value, bool):
+            self.dtypes[i] = 'int'
+        elif isinstance(value, str):
+            self.dtypes[i] = 'str'
+        if self.dtypes[i] in TYPECODES:
+            self.data[i] = array(TYPECODES[self.dtypes[i]])
+
+    def column(self, column: int or str) -> array or list:
+        """
+        Column values
+
+        :param column: column index or name
+        :type column: int or str
+        :return: column values
+        :rtype: array or list
+        """
+        return self.data[column if isinstance(column, int) else self.columns.index(column)]
+
+    def row(self, i: int) -> list:
+        """
+        Row values
+
+        :param i: row index
+        :type i: int
+        :return: row
+        :rtype: list
+        """
+        return [column[i] for column in self.data]
+
+    def rows(self) -> Iterable:
+        """
+        Rows iterator
+
+        :return: rows (as tuples)
+        :rtype: Iterable
+        """
+        return zip(*self.data)
+
+    def batches(self, size: int = 10000) -> Iterable:
+        """
+        Rows by batches (same interface as DataStream)
+
+        :param size: batch size
+        :type size: int
+        :return: batches generator
+        :rtype: Iterable
+        """
+        for start in range(0, len(self), size):
+            yield list(zip(*(column[start:start + size] for column in self.data)))
+
+    def select(self, columns: list) -> 'Dataset':
+        """
+        Columns subset (columns containers are shared)
+
+        :param columns: columns names or indexes
+        :type columns: list
+        :return: dataset
+        :rtype: Dataset
+        """
+        indexes = [column if isinstance(column, int) else self.columns.index(column) for column in columns]
+        return Dataset([self.columns[i] for i in indexes], [self.dtypes[i] for i in indexes],
+                       [self.data[i] for i in indexes])
+
+    def slice(self, start: int = None, stop: int = None) -> 'Dataset':
+        """
+        Rows slice
+
+        :param start: first row
+        :type start: int
+        :param stop: row after last
+        :type stop: int
+        :return: dataset
+        :rtype: Dataset
+        """
+        return Dataset(self.columns, self.dtypes, [column[start:stop] for column in self.data])
+
+    def transpose(self) -> 'Dataset':
+        """
+        Transposition: values of the first column become columns names, other columns become rows
+        (query "label, value" gives labels as header and values as the first row)
+
+        :return: dataset
+        :rtype: Dataset
+        """
+        if not self.data:
+            return Dataset([])
+        return Dataset.from_batches([str(x) for x in self.data[0]], [[list(column) for column in self.data[1:]]])
+
+    def to_rows(self, header: bool = True) -> list:
+        """
+        Convert to list of rows
+
+        :param header: if True, columns names are the first row
+        :type header: bool
+        :return: rows
+        :rtype: list
+        """
+        return ([self.columns] if header else []) + [list(row) for row in self.rows()]
+
+    def to_dict(self) -> dict:
+        """
+        Convert to dict of columns (for DataFrame)
+
+        :return: name -> column values
+        :rtype: dict
+        """
+        return dict(zip(self.columns, self.data))
+
+    def close(self):
+        """
+        Nothing to release (same interface as DataStream)
+        """
+        pass
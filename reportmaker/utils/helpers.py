@@ -1,20 +1,37 @@
 import os
+import re
 import sys
-import site
-import gettext
 import logging
 import builtins
-import traceback
-from datetime import datetime
+from typing import Callable
+from datetime import date, datetime
 from argparse import Namespace
+from reportmaker.utils.pool import connection_pool
+from reportmaker.utils.dataset import Dataset
+from reportmaker.utils.coercion import TypeCoercion
+from reportmaker.utils.stats import run_stats, QueryStats
+from reportmaker.utils.cache import query_cache, CacheReader, CacheWriter
 
 _ = builtins.__dict__.get('_', lambda x: x)
 
+# Descriptor parameter placeholder ({{name}} or '{{name}}')
+PLACEHOLDER = re.compile(r"'\{\{(\w+)\}\}'|\{\{(\w+)\}\}")
+
+# Placeholder or sql part, where placeholders are not bound (group 3): string literal, quoted identifier, comment
+SQL_PLACEHOLDER = re.compile(PLACEHOLDER.pattern + r"""|('(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?\*/)""", re.S)
+
 ########################################################################################################################
 #                                                    Some helpers                                                      #
 ########################################################################################################################
 
 
+class ReportError(Exception):
+    """
+    Custom exception (exported by reportmaker.formats)
+    """
+    pass
+
+
 def set_config(config_name: str) -> dict:
     """
 
@@ -28,12 +45,14 @@ def set_config(config_name: str) -> dict:
     """
     import json
     try:
-        return json.load(open(config_name, 'r'))
+        with open(config_name, 'r') as config_file:
+            return json.load(config_file)
     except FileNotFoundError:
-        print('%s %s' % (config_name, 'not found'))
+        print('%s %s' % (config_name, 'not found'), file=sys.stderr)
         exit(1)
     except json.JSONDecodeError as error:
-        print('%s %s: %s' % (config_name, 'format error', str(error)))
+        # stdout carries progress events and batch statuses
+        print('%s %s: %s' % (config_name, 'format error', str(error)), file=sys.stderr)
         exit(1)
 
 
@@ -50,6 +69,7 @@ def activate_virtual_environment(**kwargs):
     - packages (path to packages in environment, default: 'lib/python{VERSION}/site-packages')
 
     """
+    import site
     env = kwargs.get('environment', 'venv').replace('~', os.getenv('HOME'))
     env_path = env if env[0:1] == "/" else os.getcwd() + "/" + env
     env_activation = env_path + '/' + 'bin/activate_this.py'
@@ -79,6 +99,7 @@ def set_localization(**kwargs):
     - quiet (default: False)
 
     """
+    import gettext
     locale_domain = kwargs.get('locale_domain', sys.argv[0])
     locale_dir = kwargs.get('locale_dir', '/usr/share/locale').replace('~', os.getenv('HOME'))
     language = kwargs.get('language', 'en')
@@ -87,7 +108,8 @@ def set_localization(**kwargs):
         gettext.translation(locale_domain, localedir=locale_dir, languages=[language]).install()
     except FileNotFoundError:
         if not kwargs.get('quiet', False):
-            print('%s %s \'%s\' %s, %s' % ('translation', 'for', language, 'not found', 'use default'))
+            print('%s %s \'%s\' %s, %s' % ('translation', 'for', language, 'not found', 'use default'),
+                  file=sys.stderr)
 
 
 def get_logger(logger_name: str, logging_format: str, file_name: str, level: int = logging.INFO) -> logging.Logger:
@@ -148,10 +170,145 @@ def get_parm_value(parameters: dict, name: str, env_name: str, default_value: st
     return os.environ.get(env_name, default=default_value) if not value else value
 
 
-def database_connect(connection_string: str, logger: logging.Logger, cmd_args: Namespace):
+def parse_parameters(parameters: list or dict) -> dict:
     """
 
-    ODBC connection to database
+    Parse command line parameters 'key=value' (the last character of value is a separator and is dropped).
+    Dict (parameters of batch job) is taken as is, values are converted to strings
+
+    :param parameters: command line parameters
+    :type parameters: list or dict
+    :return: name -> value
+    :rtype: dict
+
+    """
+    if isinstance(parameters, dict):
+        return {name: str(value) for name, value in parameters.items()}
+    return {parm.split('=')[0]: parm.split('=')[1][:-1] for parm in parameters}
+
+
+def substitute_parameters(node, parameters: dict, bound: set, in_sql: bool = False):
+    """
+
+    Replace {{name}} with parameter value in all strings of descriptor, except sql strings for bound parameters
+
+    :param node: descriptor part
+    :param parameters: name -> value
+    :type parameters: dict
+    :param bound: names of parameters which are bound to sql
+    :type bound: set
+    :param in_sql: node is part of sql
+    :type in_sql: bool
+    :return: descriptor part with values
+
+    """
+    if isinstance(node, str):
+        for key, value in parameters.items():
+            if not (in_sql and key in bound):
+                node = node.replace('{{' + key + '}}', value)
+        return node
+    if isinstance(node, list):
+        return [substitute_parameters(x, parameters, bound, in_sql) for x in node]
+    if isinstance(node, dict):
+        return {key: substitute_parameters(value, parameters, bound, in_sql or key == 'sql')
+                for key, value in node.items()}
+    return node
+
+
+def load_descriptor(descriptor_string: str, parameters: dict) -> dict:
+    """
+
+    Load descriptor with parameters. If descriptor declares typed parameters (document 'parameters'), they stay
+    placeholders in sql and are bound by driver, other parameters are substituted to descriptor text
+
+    :param descriptor_string: descriptor text
+    :type descriptor_string: str
+    :param parameters: name -> value
+    :type parameters: dict
+    :return: descriptor
+    :rtype: dict
+
+    """
+    from reportmaker.utils.plan import DescriptorPlan
+    return DescriptorPlan(descriptor_string).bind(parameters)
+
+
+def bind_parameters(sql: str, values: dict, driver: str) -> (str, list):
+    """
+
+    Replace placeholders of bound parameters by driver placeholders. Placeholder, which is the whole string literal
+    ('{{name}}'), is bound as value; placeholders in comments and quoted identifiers are kept; placeholder inside
+    string literal ('%{{name}}%') can't be bound, it is an error
+
+    :param sql: sql request with {{name}} placeholders
+    :type sql: str
+    :param values: name -> typed value
+    :type values: dict
+    :param driver: driver name
+    :type driver: str
+    :return: sql request and parameters list
+    :rtype: (str, list)
+    :raises ReportError: placeholder of bound parameter inside string literal
+
+    """
+    if not values or not any((m.group(1) or m.group(2)) in values for m in PLACEHOLDER.finditer(sql)):
+        return sql, []
+    bound, placeholder = [], '%s' if driver == 'psycopg2' else '?'
+
+    def replace(match) -> str:
+        if match.group(3):
+            names = [m.group(1) or m.group(2) for m in PLACEHOLDER.finditer(match.group(3))]
+            if match.group(3).startswith("'") and any(name in values for name in names):
+                raise ReportError(f"{_('parameter')} '{next(name for name in names if name in values)}' "
+                                  f"{_('inside')} {_('sql string')} {match.group(3)}: {_('use')} "
+                                  f"{_('concatenation with placeholder')} {{{{name}}}} {_('instead')}")
+            return match.group(0)
+        name = match.group(1) or match.group(2)
+        if name not in values:
+            return match.group(0)
+        value = values[name]
+        if driver == 'sqlite3' and isinstance(value, date):
+            # sqlite compares dates as text, which is stored as 'YYYY-MM-DD HH:MM:SS'
+            value = value.isoformat(' ') if isinstance(value, datetime) else value.isoformat()
+        bound.append(value)
+        return placeholder
+
+    bound_sql = SQL_PLACEHOLDER.sub(replace, sql.replace('%', '%%') if driver == 'psycopg2' else sql)
+    return (bound_sql, bound) if bound else (sql, [])
+
+
+def prepare_statement(connection, sql: str, parameters: list) -> str:
+    """
+
+    Prepare psycopg2 statement once per connection (PREPARE) and get its execution (EXECUTE)
+
+    :param connection: psycopg2 connection
+    :type connection: Connection
+    :param sql: sql request with %s placeholders
+    :type sql: str
+    :param parameters: parameters list
+    :type parameters: list
+    :return: EXECUTE statement with %s placeholders
+    :rtype: str
+
+    """
+    statements = connection_pool.statements(connection)
+    if sql not in statements:
+        name, number = f'report_{len(statements)}', iter(range(1, len(parameters) + 1))
+        text = re.sub(r'%%|%s', lambda m: '%' if m.group(0) == '%%' else f'${next(number)}', sql)
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f'PREPARE {name} AS {text}')
+        finally:
+            cursor.close()
+        statements[sql] = name
+    return f"EXECUTE {statements[sql]} ({', '.join(['%s'] * len(parameters))})"
+
+
+def parse_connection_string(connection_string: str, logger: logging.Logger, cmd_args: Namespace) -> dict:
+    """
+
+    Parse connection string into lowercase key -> value pairs
 
     :param connection_string: connection string
     :type connection_string: str
@@ -159,17 +316,16 @@ def database_connect(connection_string: str, logger: logging.Logger, cmd_args: N
     :type logger: logging.Logger
     :param cmd_args: command line parameters
     :type cmd_args: Namespace
-    :return: ODBC connection
-    :rtype: Connection
+    :return: connection parameters
+    :rtype: dict
 
     """
-    driver, parameters, error_count = None, None, 0
+    parameters, error_count = {}, 0
     while error_count < 2:
         try:
             parameters = {
                 x.split('=')[0].strip().lower(): x.split('=')[1].strip() for x in connection_string.split(';')
             }
-            driver = parameters.get('driver', '')
             break
         except IndexError as e:
             if error_count:
@@ -177,10 +333,45 @@ def database_connect(connection_string: str, logger: logging.Logger, cmd_args: N
             else:
                 connection_string = connection_string[:-1]
                 error_count += 1
+    return parameters
+
+
+def normalize_connection_string(parameters: dict) -> str:
+    """
+
+    Normalized connection string: sorted lowercase keys, stripped values
+
+    :param parameters: connection parameters
+    :type parameters: dict
+    :return: normalized connection string
+    :rtype: str
+
+    """
+    return ';'.join(f'{key}={parameters[key]}' for key in sorted(parameters))
+
+
+def database_connect(connection_string: str, logger: logging.Logger, cmd_args: Namespace):
+    """
+
+    ODBC connection to database
+
+    :param connection_string: connection string
+    :type connection_string: str
+    :param logger: logger
+    :type logger: logging.Logger
+    :param cmd_args: command line parameters
+    :type cmd_args: Namespace
+    :return: ODBC connection
+    :rtype: Connection
+
+    """
+    parameters = parse_connection_string(connection_string, logger, cmd_args)
+    driver = parameters.get('driver', '')
     if driver == 'sqlite3':
         import sqlite3
         try:
-            return sqlite3.connect(get_parm_value(parameters, 'database', 'POSTGRES_DB_NAME', 'postgres'))
+            return sqlite3.connect(get_parm_value(parameters, 'database', 'POSTGRES_DB_NAME', 'postgres'),
+                                   check_same_thread=False)
         except Exception as e:
             error_handler(logger, e, 'sqlite3 ', cmd_args, True)
     if driver == 'psycopg2':
@@ -226,6 +417,7 @@ def error_handler(logger: logging.Logger, error: Exception, message: str, cmd_ar
     """
     _ = builtins.__dict__.get('_', lambda x: x)
     if debug_info:
+        import traceback
         et, ev, tb = sys.exc_info()
         logger.error(
             '%s %s: %s\n%s\n' % (message, _('error'), error,
@@ -235,12 +427,334 @@ def error_handler(logger: logging.Logger, error: Exception, message: str, cmd_ar
     if sys_exit:
         logger.error(_('error termination'))
         if cmd_args and hasattr(cmd_args, 'token') and cmd_args.token:
-            print(cmd_args.callback_url)
-            # TODO: Send request to callback url with token
+            # Token is taken, so failure is sent once (errors of parallel requests)
+            token, cmd_args.token = cmd_args.token, ''
+            send_callback(logger, cmd_args.callback_url, token, {'status': 'error', 'error': str(error)})
         exit(1)
 
 
-def get_database_data(connection_string: str, sql: str, logger: logging.Logger, cmd_args: Namespace) -> list:
+def inside_roots(path: str, roots: list) -> bool:
+    """
+
+    Path (with resolved symbolic links) is inside one of directories
+
+    :param path: file or directory name
+    :type path: str
+    :param roots: directories
+    :type roots: list
+    :return: True, if path is inside one of roots
+    :rtype: bool
+
+    """
+    path = os.path.realpath(path)
+    for root in map(os.path.realpath, roots):
+        if os.path.commonpath([path, root]) == root:
+            return True
+    return False
+
+
+def send_callback(logger: logging.Logger, url: str, token: str, payload: dict, timeout: float = 10) -> bool:
+    """
+
+    Send POST request with json {"token": token, ...payload} to callback url. Errors are logged, not raised
+
+    :param logger: logger
+    :type logger: logging.Logger
+    :param url: callback url
+    :type url: str
+    :param token: unique token for frontend
+    :type token: str
+    :param payload: request data
+    :type payload: dict
+    :param timeout: request timeout (seconds)
+    :type timeout: float
+    :return: True if request is sent
+    :rtype: bool
+
+    """
+    import json
+    import urllib.request
+    _ = builtins.__dict__.get('_', lambda x: x)
+    request = urllib.request.Request(url, data=json.dumps({'token': token, **payload}, default=str).encode('utf8'),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+        return True
+    except Exception as e:
+        logger.warning('%s %s: %s' % (_('callback'), url, e))
+        return False
+
+
+class DataStream:
+    """
+    Database result, fetched in batches
+
+    The statement is executed and the first batch is fetched by constructor, so columns names are known before
+    the first row is consumed. Connection is released when all rows are consumed or by close().
+    """
+
+    def __init__(self, connection, cursor, sql: str, batch_size: int, release: Callable = None, types: dict = None,
+                 parameters: list = None, stats: QueryStats = None):
+        """
+        Constructor
+
+        :param connection: database connection
+        :type connection: Connection
+        :param cursor: database cursor
+        :type cursor: Cursor
+        :param sql: sql request
+        :type sql: str
+        :param batch_size: rows per fetch
+        :type batch_size: int
+        :param release: callback which takes back connection, if None connection is closed
+        :type release: Callable
+        :param types: type coercion options (see reportmaker.utils.coercion.DEFAULT_OPTIONS)
+        :type types: dict
+        :param parameters: bound parameters
+        :type parameters: list
+        :param stats: execution statistics
+        :type stats: QueryStats
+        """
+        self._connection = connection
+        self._release = release if release else lambda connection_obj: connection_obj.close()
+        self._cursor = cursor
+        self._batch_size = batch_size
+        self.stats = stats if stats else QueryStats(sql)
+        with self.stats.measure('execute'):
+            if parameters:
+                self._cursor.execute(sql, parameters)
+            else:
+                self._cursor.execute(sql)
+        with self.stats.measure('fetch'):
+            self._batch = self._cursor.fetchmany(self._batch_size)
+        self.columns = [desc[0] for desc in self._cursor.description] if self._cursor.description else []
+        self.stats.columns = len(self.columns)
+        self.rows_count = 0
+        self._coercion = TypeCoercion(types, self._cursor.description)
+        self._recorder = None
+        self._watcher = None
+        self._closed = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+    def record(self, writer: CacheWriter):
+        """
+        Write batches to query cache while they are consumed. Entry is committed when all rows are consumed
+
+        :param writer: cache entry writer
+        :type writer: CacheWriter
+        """
+        self._recorder = writer
+
+    def watch(self, callback: Callable):
+        """
+        Pass batches to callback (columns, rows) while they are consumed (fetched rows, before type coercion)
+
+        :param callback: batch observer
+        :type callback: Callable
+        """
+        self._watcher = callback
+
+    def on_close(self, callback: Callable):
+        """
+        Call callback once, when stream is closed
+
+        :param callback: function without arguments
+        :type callback: Callable
+        """
+        self._closed = callback
+
+    def batches(self):
+        """
+        Converted rows by batches
+
+        :return: batches generator
+        :rtype: Generator
+        """
+        try:
+            while self._batch:
+                batch, self._batch = self._batch, None
+                self.rows_count += len(batch)
+                with self.stats.measure('convert'):
+                    rows = self._coercion.convert(batch)
+                self.stats.count(rows)
+                if self._recorder:
+                    self._recorder.write(rows)
+                if self._watcher:
+                    self._watcher(self.columns, batch)
+                yield rows
+                with self.stats.measure('fetch'):
+                    self._batch = self._cursor.fetchmany(self._batch_size)
+            if self._recorder:
+                recorder, self._recorder = self._recorder, None
+                recorder.commit()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Close cursor and release connection, incomplete cache entry is discarded
+        """
+        if self._recorder:
+            recorder, self._recorder = self._recorder, None
+            recorder.discard()
+        try:
+            if self._connection is not None:
+                connection, self._connection, self._batch = self._connection, None, None
+                try:
+                    self._cursor.close()
+                finally:
+                    self._release(connection)
+        finally:
+            if self._closed:
+                callback, self._closed = self._closed, None
+                callback()
+
+
+class CachedStream(DataStream):
+    """
+    Database result, read from query cache
+    """
+
+    def __init__(self, reader: CacheReader, stats: QueryStats = None):
+        """
+        Constructor
+
+        :param reader: cache entry reader
+        :type reader: CacheReader
+        :param stats: execution statistics
+        :type stats: QueryStats
+        """
+        self._reader = reader
+        self.columns = reader.columns
+        self.rows_count = 0
+        self.stats = stats if stats else QueryStats('', 'cache')
+        self.stats.columns = len(self.columns)
+        self._watcher = None
+
+    def batches(self):
+        """
+        Rows by batches
+
+        :return: batches generator
+        :rtype: Generator
+        """
+        batches = self._reader.batches()
+        while True:
+            with self.stats.measure('fetch'):
+                batch = next(batches, None)
+            if batch is None:
+                return
+            self.rows_count += len(batch)
+            self.stats.count(batch)
+            if self._watcher:
+                self._watcher(self.columns, batch)
+            yield batch
+
+    def on_close(self, callback: Callable):
+        """
+        Call callback at once (cached result doesn't hold database)
+
+        :param callback: function without arguments
+        :type callback: Callable
+        """
+        callback()
+
+    def close(self):
+        """
+        Close cache entry
+        """
+        self._reader.close()
+
+
+def stream_database_data(connection_string: str, sql: str, logger: logging.Logger, cmd_args: Namespace,
+                         batch_size: int = 10000, server_side: bool = True, cache_ttl: int = 0,
+                         types: dict = None, sql_parameters: dict = None) -> DataStream:
+    """
+    Get data from database by batches
+
+    Connection is taken from the connection pool. psycopg2 uses named (server side) cursor, other drivers use
+    fetchmany with cursor arraysize. If cache_ttl is set, result is read from/written to query cache
+    (command line options --no-cache and --refresh disable cache reading; query runs without cache, if cache entry
+    can't be created). Execution statistics are registered in
+    run_stats. sql_parameters are bound by driver;
+    psycopg2 statement with parameters is prepared once per connection (other drivers reuse statements with the same
+    text themselves)
+
+    :param connection_string: database connection string
+    :type connection_string: str
+    :param sql: sql request
+    :type sql: str
+    :param logger: logger
+    :type logger: logging.Logger
+    :param cmd_args: commandline arguments
+    :type cmd_args: Namespace
+    :param batch_size: rows per fetch
+    :type batch_size: int
+    :param server_side: if True, use server side cursor (psycopg2 only)
+    :type server_side: bool
+    :param cache_ttl: query cache time to live, seconds (0 - don't use cache)
+    :type cache_ttl: int
+    :param types: type coercion options (see reportmaker.utils.coercion.DEFAULT_OPTIONS)
+    :type types: dict
+    :param sql_parameters: name -> typed value of parameters, bound to {{name}} placeholders
+    :type sql_parameters: dict
+    :return: data stream
+    :rtype: DataStream
+    """
+    parameters = parse_connection_string(connection_string, logger, cmd_args)
+    driver, key = parameters.get('driver', ''), normalize_connection_string(parameters)
+    sql, bound = bind_parameters(sql, sql_parameters, driver)
+    cache_key = None
+    if cache_ttl and not getattr(cmd_args, 'no_cache', False):
+        cache_key = query_cache.key(sql, key, tuple(bound), options=types)
+        reader = None if getattr(cmd_args, 'refresh', False) else query_cache.open(cache_key, cache_ttl)
+        if reader:
+            logger.info(f"{_('query cache')} {_('hit')} {cache_key[:16]}")
+            return CachedStream(reader, run_stats.query(sql, 'cache'))
+        logger.info(f"{_('query cache')} {_('miss')} {cache_key[:16]}")
+    stats = run_stats.query(sql)
+    with stats.measure('connect'):
+        connection = connection_pool.acquire(key, lambda: database_connect(connection_string, logger, cmd_args))
+    if driver == 'psycopg2' and server_side:
+        cursor = connection.cursor(name=f'report_{os.getpid()}_{id(connection)}')
+        cursor.itersize = batch_size
+    else:
+        cursor = connection.cursor()
+        cursor.arraysize = batch_size
+    try:
+        if driver == 'psycopg2' and bound and not server_side:
+            with stats.measure('execute'):
+                sql = prepare_statement(connection, sql, bound)
+        stream = DataStream(connection, cursor, sql, batch_size,
+                            release=lambda connection_obj: connection_pool.release(key, connection_obj), types=types,
+                            parameters=bound, stats=stats)
+    except Exception:
+        connection_pool.release(key, connection)
+        raise
+    if cache_key:
+        try:
+            stream.record(query_cache.writer(cache_key, stream.columns))
+        except OSError as e:
+            logger.warning(f"{_('query cache')} {_('not written')}: {e}")
+        except BaseException:
+            stream.close()
+            raise
+    return stream
+
+
+def get_database_data(connection_string: str, sql: str, logger: logging.Logger, cmd_args: Namespace,
+                      batch_size: int = 10000, cache_ttl: int = 0, types: dict = None,
+                      sql_parameters: dict = None) -> Dataset:
     """
     Get data from database
 
@@ -252,26 +766,17 @@ def get_database_data(connection_string: str, sql: str, logger: logging.Logger,
     :type logger: logging.Logger
     :param cmd_args: commandline arguments
     :type cmd_args: Namespace
+    :param batch_size: rows per fetch
+    :type batch_size: int
+    :param cache_ttl: query cache time to live, seconds (0 - don't use cache)
+    :type cache_ttl: int
+    :param types: type coercion options (see reportmaker.utils.coercion.DEFAULT_OPTIONS)
+    :type types: dict
+    :param sql_parameters: name -> typed value of parameters, bound to {{name}} placeholders
+    :type sql_parameters: dict
     :return: sql result
-    :rtype: list
-    """
-    connection = database_connect(connection_string, logger, cmd_args)
-    cursor = connection.cursor()
-    cursor.execute(sql)
-    columns_names = [desc[0] for desc in cursor.description]
-    response = cursor.fetchall()
-    data = list()
-    data.append(columns_names)
-    for row in response:
-        formatted_row = []
-        for col in row:
-            if hasattr(col, 'real') and hasattr(col, 'imag'):
-                formatted_row.append(float(col))
-            elif isinstance(col, datetime):
-                formatted_row.append(str(col))
-            else:
-                formatted_row.append(col)
-        data.append(formatted_row)
-    cursor.close()
-    connection.close()
-    return data
+    :rtype: Dataset
+    """
+    with stream_database_data(connection_string, sql, logger, cmd_args, batch_size, server_side=False,
+                              cache_ttl=cache_ttl, types=types, sql_parameters=sql_parameters) as stream:
+        return Dataset.from_batches(stream.columns, stream.batches())
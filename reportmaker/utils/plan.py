@@ -0,0 +1,212 @@
+import re
+import json
+import pickle
+import hashlib
+from typing import Any
+from reportmaker.utils.helpers import substitute_parameters
+
+########################################################################################################################
+#                                             Compiled descriptor                                                      #
+########################################################################################################################
+
+# Characters of parameter value, which text substitution writes to json as syntax, not as string
+JSON_SYNTAX = {'"', '\\'} | {chr(x) for x in range(32)}
+
+# Json string or placeholder (group 1: parameter name), placeholders out of strings are substituted to text
+TEXT_PLACEHOLDER = re.compile(r'"(?:[^"\\]|\\.)*"|\{\{(\w+)\}\}', re.S)
+
+# Keys of inline data payloads, which are not resolved as descriptors (except objects in place of rows or cells)
+PAYLOAD_KEYS = ('data',)
+
+
+class Descriptor(dict):
+    """
+    Descriptor, bound by plan (plan is used by document instead of descriptor traversal)
+    """
+
+    plan = None
+
+
+class DescriptorPlan:
+    """
+    Compiled descriptor: parsed descriptor template, parameters slots (paths of strings with {{name}}), element
+    builders (create methods of layout elements) and data sources (paths of sql data blocks).
+
+    Binding copies template and substitutes parameters into slots only. Descriptor, which is not valid json before
+    substitution (or has placeholders out of strings), is bound by text substitution, as before, but declared
+    parameters stay placeholders in sql (see _bind_text)
+    """
+
+    def __init__(self, text: str):
+        """
+        Constructor
+
+        :param text: descriptor text
+        :type text: str
+        """
+        self.hash = hashlib.sha256(text.encode('utf8')).hexdigest()
+        self.slots, self.sources, self.builders, self.declared = [], [], [], {}
+        self._text, self._template = text, None
+        try:
+            template = json.loads(text)
+        except json.JSONDecodeError:
+            return
+        if not isinstance(template, dict):
+            return
+        document = template.get('document', {})
+        self.declared = document.get('parameters', {}) if isinstance(document, dict) else {}
+        self._placeholders = '{{' in text
+        self._walk(template, (), False, False)
+        if not self.declared and text.count('{{') != sum(self._get(template, path).count('{{') for path, _ in
+                                                         self.slots):
+            return
+        if isinstance(document, dict):
+            self.builders = [
+                f"create_{str(element['type']).lower()}" if isinstance(element, dict) and element.get('type') else None
+                for element in document.get('layout', None) or []
+            ]
+        self._template = pickle.dumps(template, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @property
+    def compiled(self) -> bool:
+        """
+        Descriptor is compiled (bound without parsing)
+
+        :return: True, if compiled
+        :rtype: bool
+        """
+        return self._template is not None
+
+    def bind(self, parameters: dict) -> dict:
+        """
+        Descriptor with parameters
+
+        :param parameters: name -> value
+        :type parameters: dict
+        :return: descriptor
+        :rtype: dict
+        """
+        if not self.compiled:
+            return self._bind_text(parameters)
+        if not self.declared and any(JSON_SYNTAX & set(x) for x in parameters.values()):
+            return self._substitute_text(self._text, parameters)
+        descriptor, bound = Descriptor(pickle.loads(self._template)), set(self.declared)
+        for path, in_sql in self.slots:
+            parent = self._get(descriptor, path[:-1])
+            parent[path[-1]] = substitute_parameters(parent[path[-1]], parameters, bound, in_sql)
+        descriptor.plan = self
+        return descriptor
+
+    def _bind_text(self, parameters: dict) -> dict:
+        """
+        Bind descriptor, which is not valid json before substitution. Placeholders out of json strings are substituted
+        to text first, then declared parameters (known after parsing) are substituted to descriptor strings, except
+        sql ones, where they are bound by driver. Descriptor without declared parameters is bound by text substitution
+
+        :param parameters: name -> value
+        :type parameters: dict
+        :return: descriptor
+        :rtype: dict
+        """
+        descriptor = json.loads(TEXT_PLACEHOLDER.sub(
+            lambda match: parameters.get(match.group(1), match.group(0)) if match.group(1) else match.group(0),
+            self._text))
+        document = descriptor.get('document', {}) if isinstance(descriptor, dict) else {}
+        declared = document.get('parameters', {}) if isinstance(document, dict) else {}
+        if not declared:
+            return self._substitute_text(self._text, parameters)
+        return substitute_parameters(descriptor, parameters, set(declared))
+
+    @staticmethod
+    def _substitute_text(text: str, parameters: dict) -> dict:
+        """
+        Bind descriptor by text substitution
+
+        :param text: descriptor text
+        :type text: str
+        :param parameters: name -> value
+        :type parameters: dict
+        :return: descriptor
+        :rtype: dict
+        """
+        for key, value in parameters.items():
+            text = text.replace('{{' + key + '}}', value)
+        return json.loads(text)
+
+    def _walk(self, node: Any, path: tuple, in_sql: bool, in_source: bool):
+        """
+        Collect parameters slots and data sources (sql data blocks and dataset references of layout, in layout
+        order) of descriptor part
+
+        :param node: descriptor part
+        :type node: Any
+        :param path: path of part
+        :type path: tuple
+        :param in_sql: part of sql
+        :type in_sql: bool
+        :param in_source: part of data source
+        :type in_source: bool
+        """
+        if isinstance(node, str):
+            if '{{' in node:
+                self.slots.append((path, in_sql))
+        elif isinstance(node, list):
+            for i, value in enumerate(node):
+                self._walk(value, path + (i,), in_sql, in_source)
+        elif isinstance(node, dict):
+            for key, value in node.items():
+                if key in PAYLOAD_KEYS and isinstance(value, list):
+                    self._walk_payload(value, path + (key,), in_sql, in_source)
+                    continue
+                source = not in_source and key == 'data' and isinstance(value, dict) and \
+                    ('sql' in value or 'dataset' in value) and path[:2] == ('document', 'layout')
+                if source:
+                    self.sources.append(path + (key,))
+                self._walk(value, path + (key,), in_sql or key == 'sql', in_source or source)
+
+    def _walk_payload(self, payload: list, path: tuple, in_sql: bool, in_source: bool):
+        """
+        Walk inline data payload: only objects in place of rows or cells and rows with placeholders are walked
+
+        :param payload: inline data
+        :type payload: list
+        :param path: path of payload
+        :type path: tuple
+        :param in_sql: part of sql
+        :type in_sql: bool
+        :param in_source: part of data source
+        :type in_source: bool
+        """
+        for i, row in enumerate(payload):
+            if type(row) is list and dict not in map(type, row) and not (
+                    self._placeholders and any('{{' in cell for cell in row if type(cell) is str)):
+                continue
+            if type(row) in (list, dict) or (self._placeholders and type(row) is str):
+                self._walk(row, path + (i,), in_sql, in_source)
+
+    @staticmethod
+    def _get(node: Any, path: tuple) -> Any:
+        """
+        Descriptor part by path
+
+        :param node: descriptor
+        :type node: Any
+        :param path: path of part
+        :type path: tuple
+        :return: descriptor part
+        :rtype: Any
+        """
+        for key in path:
+            node = node[key]
+        return node
+
+    def data_blocks(self, descriptor: dict) -> list:
+        """
+        Data sources of bound descriptor
+
+        :param descriptor: descriptor, bound by this plan
+        :type descriptor: dict
+        :return: data blocks in layout order
+        :rtype: list
+        """
+        return [self._get(descriptor, path) for path in self.sources]
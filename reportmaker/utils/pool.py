@@ -0,0 +1,166 @@
+import threading
+from typing import Callable
+
+########################################################################################################################
+#                                                 Connection pool                                                      #
+########################################################################################################################
+
+
+class ConnectionPool:
+    """
+    Pool of idle database connections, keyed by normalized connection string
+
+    Pool lives as long as the process: one run of the command line utility or a long-lived worker
+    """
+
+    def __init__(self, size: int = 4):
+        """
+        Constructor
+
+        :param size: maximum idle connections per connection string
+        :type size: int
+        """
+        self.size = size
+        self._idle = {}
+        self._statements = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, connect: Callable):
+        """
+        Get idle connection or create new one. Idle connections, which are found closed, are dropped (with their
+        prepared statements)
+
+        :param key: normalized connection string
+        :type key: str
+        :param connect: connection factory
+        :type connect: Callable
+        :return: database connection
+        :rtype: Connection
+        """
+        connection, dropped = None, []
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate = idle.pop()
+                if not getattr(candidate, 'closed', False):
+                    connection = candidate
+                    break
+                dropped.append(candidate)
+        for candidate in dropped:
+            self._close(candidate)
+        return connection if connection is not None else connect()
+
+    def release(self, key: str, connection):
+        """
+        Return connection to pool. Open transaction is rolled back, broken connection is closed
+
+        :param key: normalized connection string
+        :type key: str
+        :param connection: database connection
+        :type connection: Connection
+        """
+        try:
+            connection.rollback()
+        except Exception:
+            self._close(connection)
+            return
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append(connection)
+                return
+        self._close(connection)
+
+    def statements(self, connection) -> dict:
+        """
+        Prepared statements of connection (sql -> statement name)
+
+        :param connection: database connection
+        :type connection: Connection
+        :return: prepared statements
+        :rtype: dict
+        """
+        with self._lock:
+            return self._statements.setdefault(id(connection), {})
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                self._close(connection)
+
+    def _close(self, connection):
+        """
+        Close connection, ignoring errors
+
+        :param connection: database connection
+        :type connection: Connection
+        """
+        with self._lock:
+            self._statements.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+class RequestLimit:
+    """
+    Limit of concurrent prefetched requests to one database. Slot is taken by prefetch thread before request and is
+    given back when result is fetched or, for streamed result, when stream is closed. Request, which document waits
+    for, is urged: it runs without slot, because held slots may belong to streams, which document consumes later
+    """
+
+    def __init__(self, size: int):
+        """
+        Constructor
+
+        :param size: maximum concurrent requests
+        :type size: int
+        """
+        self.size, self.used = size, 0
+        self._urged = set()
+        self._condition = threading.Condition()
+
+    def acquire(self, key: int) -> bool:
+        """
+        Wait for free slot or for request to be urged
+
+        :param key: request key
+        :type key: int
+        :return: True, if slot is taken (it must be released)
+        :rtype: bool
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.used < self.size or key in self._urged)
+            self._urged.discard(key)
+            if self.used < self.size:
+                self.used += 1
+                return True
+            return False
+
+    def release(self):
+        """
+        Give slot back
+        """
+        with self._condition:
+            self.used -= 1
+            self._condition.notify_all()
+
+    def urge(self, key: int):
+        """
+        Let request run without slot
+
+        :param key: request key
+        :type key: int
+        """
+        with self._condition:
+            self._urged.add(key)
+            self._condition.notify_all()
+
+
+connection_pool = ConnectionPool()
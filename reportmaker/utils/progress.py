@@ -0,0 +1,159 @@
+import sys
+import json
+import time
+import logging
+import threading
+
+########################################################################################################################
+#                                               Progress reporting                                                     #
+########################################################################################################################
+
+
+class Progress:
+    """
+    Progress of report generation: phase, layout elements done of total, rows fetched and written.
+
+    Counters are updated by batches of rows, event is emitted not more often than once per 'frequency' seconds
+    (phase change is emitted at once). Sinks: 'callback' (POST to callback url with token, in background thread),
+    'stdout' or 'stderr' (json line) or status file name (rewritten with the last event). Counters are approximate when
+    requests are fetched in parallel
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self._lock = threading.Lock()
+        self.start()
+
+    def start(self, total: int = 0, frequency: float = 0, sink: str = None, logger: logging.Logger = None,
+              callback_url: str = '', token: str = ''):
+        """
+        Start new run
+
+        :param total: layout elements
+        :type total: int
+        :param frequency: minimum interval between events (seconds), 0 - progress is not reported
+        :type frequency: float
+        :param sink: 'callback', 'stdout', 'stderr' or status file name
+        :type sink: str
+        :param logger: logger (for errors of sink)
+        :type logger: logging.Logger
+        :param callback_url: callback url
+        :type callback_url: str
+        :param token: unique token for frontend
+        :type token: str
+        """
+        self.phase, self.done, self.total, self.fetched, self.written = '', 0, total, 0, 0
+        self._frequency, self._sink, self._logger = frequency, sink if frequency > 0 else None, logger
+        self._callback_url, self._token = callback_url, token
+        self._started = time.monotonic()
+        self._next = self._started + frequency if self._sink else float('inf')
+        self._sending = None
+
+    def set_phase(self, phase: str):
+        """
+        Set phase (event is emitted at once)
+
+        :param phase: phase name
+        :type phase: str
+        """
+        self.phase = phase
+        self.emit()
+
+    def element(self):
+        """
+        Layout element is done
+        """
+        self.done += 1
+        if time.monotonic() >= self._next:
+            self.emit()
+
+    def rows_fetched(self, count: int):
+        """
+        Batch of rows is fetched
+
+        :param count: rows
+        :type count: int
+        """
+        self.fetched += count
+        if time.monotonic() >= self._next:
+            self.emit()
+
+    def rows_written(self, count: int):
+        """
+        Batch of rows is written
+
+        :param count: rows
+        :type count: int
+        """
+        self.written += count
+        if time.monotonic() >= self._next:
+            self.emit()
+
+    def to_dict(self) -> dict:
+        """
+        Progress event
+
+        :return: event
+        :rtype: dict
+        """
+        return {'phase': self.phase, 'elements': self.done, 'total': self.total,
+                'rows_fetched': self.fetched, 'rows_written': self.written,
+                'elapsed': round(time.monotonic() - self._started, 3)}
+
+    def finish(self, status: str):
+        """
+        Finish run: the last event is written to stdout, stderr or status file. Callback sink waits for event being
+        sent, final status is sent to callback url by caller
+
+        :param status: 'ok' or 'error'
+        :type status: str
+        """
+        if self._sending:
+            self._sending.join(timeout=10)
+        if self._sink and self._sink != 'callback':
+            self.phase = 'done'
+            self.emit(status)
+        self._sink, self._next = None, float('inf')
+
+    def emit(self, status: str = 'progress'):
+        """
+        Send event to sink
+
+        :param status: event status
+        :type status: str
+        """
+        if not self._sink:
+            return
+        with self._lock:
+            self._next = time.monotonic() + self._frequency
+            event = {'status': status, **self.to_dict()}
+        try:
+            if self._sink == 'callback':
+                self._send(event)
+            elif self._sink in ('stdout', 'stderr'):
+                print(json.dumps(event), file=getattr(sys, self._sink), flush=True)
+            else:
+                with open(self._sink, 'w') as status_file:
+                    json.dump(event, status_file)
+        except OSError as e:
+            if self._logger:
+                self._logger.warning(f'progress: {e}')
+
+    def _send(self, event: dict):
+        """
+        Send event to callback url in background thread (event is skipped, if previous one is being sent)
+
+        :param event: event
+        :type event: dict
+        """
+        from reportmaker.utils.helpers import send_callback
+        if not self._token or (self._sending and self._sending.is_alive()):
+            return
+        self._sending = threading.Thread(target=send_callback, args=(self._logger, self._callback_url, self._token,
+                                                                     event), daemon=True)
+        self._sending.start()
+
+
+progress = Progress()
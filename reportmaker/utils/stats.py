@@ -0,0 +1,167 @@
+import re
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from reportmaker.utils.progress import progress
+
+########################################################################################################################
+#                                              Execution statistics                                                    #
+########################################################################################################################
+
+# Stages of sql request
+QUERY_STAGES = ('connect', 'execute', 'fetch', 'convert')
+
+
+class QueryStats:
+    """
+    Execution statistics of one sql request: stages durations, rows, columns and approximate result size
+    """
+
+    def __init__(self, sql: str, source: str = 'database'):
+        """
+        Constructor
+
+        :param sql: sql request
+        :type sql: str
+        :param source: 'database' or 'cache'
+        :type source: str
+        """
+        self.sql = re.sub(r'\s+', ' ', sql).strip()
+        self.source = source
+        self.timings = dict.fromkeys(QUERY_STAGES, 0.0)
+        self.rows, self.columns, self.bytes = 0, 0, 0
+
+    @contextmanager
+    def measure(self, stage: str):
+        """
+        Add duration of block to stage
+
+        :param stage: stage name (see QUERY_STAGES)
+        :type stage: str
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] += time.perf_counter() - start
+
+    def count(self, batch: list):
+        """
+        Count batch of rows (and report progress). Size is estimated by the first row of batch
+
+        :param batch: rows
+        :type batch: list
+        """
+        if batch:
+            self.rows += len(batch)
+            self.bytes += sum(map(sys.getsizeof, batch[0])) * len(batch)
+            progress.rows_fetched(len(batch))
+
+    def to_dict(self) -> dict:
+        """
+        Statistics as dict
+
+        :return: statistics
+        :rtype: dict
+        """
+        return {'sql': self.sql, 'source': self.source, 'rows': self.rows, 'columns': self.columns,
+                'bytes': self.bytes, 'timings': {key: round(value, 6) for key, value in self.timings.items()}}
+
+
+class RunStats:
+    """
+    Execution statistics of report generation: sql requests and document stages (layout, document writing)
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Start new run
+        """
+        with self._lock:
+            self.started = time.time()
+            self.queries, self.stages, self.info = [], {}, {}
+
+    def query(self, sql: str, source: str = 'database') -> QueryStats:
+        """
+        Register sql request
+
+        :param sql: sql request
+        :type sql: str
+        :param source: 'database' or 'cache'
+        :type source: str
+        :return: request statistics
+        :rtype: QueryStats
+        """
+        stats = QueryStats(sql, source)
+        with self._lock:
+            self.queries.append(stats)
+        return stats
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Add duration of block to run stage
+
+        :param name: stage name
+        :type name: str
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def to_dict(self) -> dict:
+        """
+        Run summary
+
+        :return: summary
+        :rtype: dict
+        """
+        with self._lock:
+            queries = [stats.to_dict() for stats in self.queries]
+            stages = {key: round(value, 6) for key, value in self.stages.items()}
+        return {**self.info, 'started': self.started, 'duration': round(time.time() - self.started, 6),
+                'stages': stages, 'queries': queries,
+                'totals': {'queries': len(queries), 'rows': sum(x['rows'] for x in queries),
+                           'bytes': sum(x['bytes'] for x in queries)}}
+
+    def log(self, logger: logging.Logger):
+        """
+        Write summary to log
+
+        :param logger: logger
+        :type logger: logging.Logger
+        """
+        summary = self.to_dict()
+        for stats in summary['queries']:
+            timings = ', '.join(f'{key} {value:.3f}s' for key, value in stats['timings'].items())
+            logger.info(f"sql [{stats['source']}] {stats['sql'][:80]}: {stats['rows']} rows, {stats['columns']} "
+                        f"columns, ~{stats['bytes']} bytes; {timings}")
+        if summary['stages']:
+            logger.info('stages: ' + ', '.join(f'{key} {value:.3f}s' for key, value in summary['stages'].items()))
+
+    def save(self, file_name: str):
+        """
+        Write summary to json file
+
+        :param file_name: file name
+        :type file_name: str
+        """
+        with open(file_name, 'w') as output:
+            json.dump(self.to_dict(), output, ensure_ascii=False, indent=4, default=str)
+
+
+run_stats = RunStats()
@@ -0,0 +1,93 @@
+import json
+import threading
+from typing import Callable
+from collections import OrderedDict
+
+########################################################################################################################
+#                                                 Style registry                                                       #
+########################################################################################################################
+
+# Compiled styles sets, which are kept by registry
+MAX_STYLE_SETS = 256
+
+
+class StyleRegistry:
+    """
+    Styles, compiled once per process. Styles set (descriptor styles or 'default_styles' of configuration) is
+    compiled by the first document of format and shared by next documents with equal styles (batch and server
+    workers compile styles by the first job only). Style objects must not depend on document (workbook formats,
+    for example, are not registered here)
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self._sets = OrderedDict()
+        self._lock = threading.Lock()
+        self._sample = None
+        self.hits, self.misses = 0, 0
+
+    @staticmethod
+    def key(document_format: str, styles: dict) -> str:
+        """
+        Key of styles set
+
+        :param document_format: document class name
+        :type document_format: str
+        :param styles: styles descriptors (name -> style)
+        :type styles: dict
+        :return: key
+        :rtype: str
+        """
+        return document_format + json.dumps(styles, sort_keys=True, ensure_ascii=False, default=str)
+
+    def get(self, document_format: str, styles: dict, compile_styles: Callable) -> dict:
+        """
+        Compiled styles set
+
+        :param document_format: document class name
+        :type document_format: str
+        :param styles: styles descriptors (name -> style)
+        :type styles: dict
+        :param compile_styles: function, which compiles styles set (name -> style object)
+        :type compile_styles: Callable
+        :return: name -> style object
+        :rtype: dict
+        """
+        key = self.key(document_format, styles)
+        with self._lock:
+            compiled = self._sets.get(key)
+            if compiled is not None:
+                self._sets.move_to_end(key)
+                self.hits += 1
+                return compiled
+        compiled = compile_styles(styles)
+        with self._lock:
+            self.misses += 1
+            self._sets[key] = compiled
+            while len(self._sets) > MAX_STYLE_SETS:
+                self._sets.popitem(last=False)
+        return compiled
+
+    def sample_stylesheet(self) -> object:
+        """
+        Sample stylesheet of reportlab (created once)
+
+        :return: stylesheet
+        :rtype: StyleSheet1
+        """
+        if self._sample is None:
+            from reportlab.lib.styles import getSampleStyleSheet
+            self._sample = getSampleStyleSheet()
+        return self._sample
+
+    def clear(self):
+        """
+        Drop compiled styles
+        """
+        with self._lock:
+            self._sets.clear()
+
+
+style_registry = StyleRegistry()
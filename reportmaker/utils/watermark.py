@@ -0,0 +1,138 @@
+import os
+import json
+from datetime import datetime
+from typing import Iterable, Callable
+
+########################################################################################################################
+#                                              Incremental export                                                      #
+########################################################################################################################
+
+
+class Watermark:
+    """
+    Watermark of incremental export: the last value of monotonic column (id, timestamp) in exported rows. State is
+    kept next to output (<document file>.watermark): column, value, output file and number of parts. Watermark is
+    bound to declared parameter of descriptor, so sql fetches only rows after it. Values are converted by type of
+    the parameter (integer id, which is float after result type coercion, is kept as integer)
+    """
+
+    def __init__(self, file_name: str, column: str, parameter: str, value_type: Callable = None):
+        """
+        Constructor
+
+        :param file_name: document file name
+        :type file_name: str
+        :param column: watermark column
+        :type column: str
+        :param parameter: declared parameter, which watermark is bound to
+        :type parameter: str
+        :param value_type: converter of declared parameter type
+        :type value_type: Callable
+        """
+        self.state_file = f'{file_name}.watermark'
+        self.column, self.parameter = column, parameter
+        self.file, self.value, self.parts = file_name, None, 0
+        self.append = False
+        self._value_type = value_type
+        self._last = None
+
+    @classmethod
+    def load(cls, file_name: str, column: str, parameter: str, full: bool = False,
+             value_type: Callable = None) -> 'Watermark':
+        """
+        Load state of export. Export is appended, if state of the same column exists and its output file exists,
+        otherwise (or if full is True) it is rebuilt
+
+        :param file_name: document file name
+        :type file_name: str
+        :param column: watermark column
+        :type column: str
+        :param parameter: declared parameter, which watermark is bound to
+        :type parameter: str
+        :param full: full rebuild
+        :type full: bool
+        :param value_type: converter of declared parameter type
+        :type value_type: Callable
+        :return: watermark
+        :rtype: Watermark
+        """
+        watermark = cls(file_name, column, parameter, value_type)
+        if full:
+            return watermark
+        try:
+            with open(watermark.state_file) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return watermark
+        if state.get('column') == column and state.get('value') is not None and os.path.exists(state.get('file', '')):
+            watermark.file, watermark.parts = state['file'], state.get('parts', 0)
+            watermark.value = watermark._typed(state['value'])
+            watermark.append = True
+        return watermark
+
+    def observe(self, columns: list, rows: Iterable):
+        """
+        Take watermark column values of fetched rows
+
+        :param columns: columns names
+        :type columns: list
+        :param rows: batch of rows
+        :type rows: Iterable
+        """
+        if self.column not in columns:
+            return
+        i = columns.index(self.column)
+        last = self._typed(max((row[i] for row in rows if row[i] is not None), default=None))
+        if last is not None and (self._last is None or last > self._last):
+            self._last = last
+
+    def _typed(self, value: object) -> object:
+        """
+        Value, converted by type of declared parameter (value, which is not convertible, is kept, so it is bound as
+        string)
+
+        :param value: column value
+        :type value: object
+        :return: converted value
+        :rtype: object
+        """
+        if value is None or self._value_type is None or isinstance(value, str):
+            return value
+        try:
+            return self._value_type(value)
+        except (TypeError, ValueError, AttributeError, ArithmeticError):
+            return value
+
+    @property
+    def changed(self) -> bool:
+        """
+        New rows are fetched
+
+        :return: True, if watermark column value is fetched
+        :rtype: bool
+        """
+        return self._last is not None
+
+    @property
+    def last(self) -> object:
+        """
+        New watermark: the last fetched value (previous one, if there are no new rows)
+
+        :return: watermark value
+        :rtype: object
+        """
+        return self.value if self._last is None else self._last
+
+    def save(self, file_name: str = None):
+        """
+        Save state of export (after document is saved)
+
+        :param file_name: output file (default: output file of loaded state)
+        :type file_name: str
+        """
+        self.file = file_name or self.file
+        temporary_file = f'{self.state_file}.tmp'
+        with open(temporary_file, 'w') as state_file:
+            json.dump({'column': self.column, 'value': self.last, 'file': self.file, 'parts': self.parts,
+                       'updated': datetime.now().isoformat(timespec='seconds')}, state_file, default=str)
+        os.replace(temporary_file, self.state_file)
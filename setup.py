@@ -26,7 +26,9 @@ setup(
     ],
     entry_points={
         'console_scripts': [
-            'report = reportmaker.__main__:main'
+            'report = reportmaker.__main__:main',
+            'report-batch = reportmaker.batch:main',
+            'report-server = reportmaker.server:main'
         ]
     },
     python_requires='>=3',
@@ -0,0 +1,69 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'reportmaker')
+CONFIG = os.path.join(ROOT, 'data', 'config.json')
+CHINOOK = os.path.join(ROOT, 'data', 'test', 'chinook.sqlite')
+OUTPUT = tempfile.mkdtemp(prefix='report-tests-')
+
+
+def pytest_configure(config):
+    """
+    Settings are configured before tests import formats (import of module must not parse pytest commandline)
+    """
+    from reportmaker.config import configure
+    configure(['-c', CONFIG, '-i', '-', '-o', OUTPUT, '-d', f'driver=sqlite3;database={CHINOOK}', '-f', '0',
+               '--no-cache', '-l', 'WARNING'])
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(OUTPUT, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def config_file() -> str:
+    """
+    Configuration of repository
+    """
+    return CONFIG
+
+
+@pytest.fixture(scope='session')
+def database() -> str:
+    """
+    Test database (must not be changed)
+    """
+    return CHINOOK
+
+
+@pytest.fixture
+def chinook(database, tmp_path) -> str:
+    """
+    Copy of test database (tests may change it)
+    """
+    copy = str(tmp_path / 'chinook.sqlite')
+    shutil.copyfile(database, copy)
+    return copy
+
+
+@pytest.fixture
+def connection(database):
+    connection = sqlite3.connect(database)
+    yield connection
+    connection.close()
+
+
+@pytest.fixture
+def cmd_args(monkeypatch, tmp_path, database):
+    """
+    Commandline parameters of one report: output to temporary directory
+    """
+    from reportmaker.config import cmd_args
+    monkeypatch.setattr(cmd_args, 'output', str(tmp_path))
+    monkeypatch.setattr(cmd_args, 'parameters', [])
+    monkeypatch.setattr(cmd_args, 'full', False)
+    monkeypatch.setattr(cmd_args, 'database', f'driver=sqlite3;database={database}')
+    return cmd_args
@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+CHART = {'type': 'Pie', 'drawing': {'width': 300, 'height': 200}, 'x': 50, 'y': 20, 'width': 150, 'height': 150}
+
+DESCRIPTOR = {
+    'document': {
+        'format': 'pdf',
+        'file_name': 'charts.pdf',
+        'layout': [{'type': 'Paragraph', 'text': 'Charts'}] + [
+            dict(CHART, data={'sql': [f'select count(*) as tracks, sum(Milliseconds) / 1000 as seconds from Track '
+                                      f'where GenreId = {genre} group by MediaTypeId']})
+            for genre in range(1, 5)
+        ]
+    }
+}
+
+ARTISTS = {
+    'document': {
+        'format': 'csv',
+        'file_name': 'artists.csv',
+        'layout': [{'type': 'Table', 'data': {'sql': ['select ArtistId, Name from Artist where ArtistId <= 3']}}]
+    }
+}
+
+
+@pytest.fixture
+def artists(tmp_path, config_file, database, cmd_args, monkeypatch) -> dict:
+    """
+    Jobs of csv document and job with missing descriptor, each job has its output directory
+    """
+    # Formats are imported by document_class as 'formats.<format>' (worker processes take path of this process)
+    monkeypatch.syspath_prepend(os.path.dirname(os.path.dirname(config_file)))
+    descriptor = tmp_path / 'artists.json'
+    descriptor.write_text(json.dumps(ARTISTS))
+    jobs = [{'id': 'first', 'input': str(descriptor)}, {'id': 'missing', 'input': str(tmp_path / 'missing.json')},
+            {'id': 'second', 'input': str(descriptor)}]
+    for job in jobs:
+        job['output'] = str(tmp_path / job['id'])
+        os.makedirs(job['output'])
+    return {'jobs': jobs, 'config': config_file,
+            'argv': ['-c', config_file, '-i', str(descriptor), '-o', str(tmp_path), '-d',
+                     f'driver=sqlite3;database={database}', '-f', '0', '--no-cache', '-l', 'WARNING']}
+
+
+@pytest.fixture
+def charts(tmp_path, config_file, database, monkeypatch) -> dict:
+    """
+    Batch of pdf document with 4 charts, which are rendered by 2 chart workers
+    """
+    from reportmaker.config import config_args, cmd_args
+    # Formats are imported by document_class as 'formats.<format>'
+    monkeypatch.syspath_prepend(os.path.dirname(os.path.dirname(config_file)))
+    descriptor = tmp_path / 'charts.json'
+    descriptor.write_text(json.dumps(DESCRIPTOR))
+    config = json.loads(open(config_file).read())
+    config.update(chart_workers=2, chart_pool_threshold=2)
+    (tmp_path / 'config.json').write_text(json.dumps(config))
+    for key in ('chart_workers', 'chart_pool_threshold'):
+        monkeypatch.setitem(config_args, key, config[key])
+    monkeypatch.setattr(cmd_args, 'output', str(tmp_path))
+    yield {'descriptor': str(descriptor), 'output': str(tmp_path),
+           'argv': ['-c', str(tmp_path / 'config.json'), '-i', str(descriptor), '-o', str(tmp_path), '-d',
+                    f'driver=sqlite3;database={database}', '-f', '0', '--no-cache', '-l', 'WARNING']}
+    if 'formats.pdf' in sys.modules:
+        sys.modules['formats.pdf'].close_chart_pool()
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_chart_workers(charts, workers):
+    from reportmaker.batch import run_batch
+    jobs = [{'id': i, 'input': charts['descriptor'], 'output': f"{charts['output']}/{i}"} for i in range(2)]
+    for job in jobs:
+        os.makedirs(job['output'])
+    statuses = run_batch(jobs, workers, 0, charts['argv'])
+    assert [status['status'] for status in statuses] == ['ok', 'ok'], statuses
+    for job, status in zip(jobs, statuses):
+        assert status['file'] == f"{job['output']}/charts.pdf"
+        with open(status['file'], 'rb') as document:
+            assert document.read(5) == b'%PDF-'
+    if not workers:
+        assert sys.modules['formats.pdf']._chart_pool is not None
+
+
+def test_chart_workers_output_roots(charts, tmp_path):
+    from reportmaker.batch import run_job
+    status = run_job({'id': 0, 'input': charts['descriptor']}, output_roots=[str(tmp_path)])
+    assert status['status'] == 'ok', status
+    assert sys.modules['formats.pdf']._chart_pool is not None
+
+
+def test_load_manifest(tmp_path):
+    from reportmaker.batch import load_manifest
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps({'workers': 2, 'defaults': {'output': '/tmp', 'full': True},
+                                    'jobs': [{'input': 'a.json'}, {'id': 'b', 'input': 'b.json', 'full': False}]}))
+    assert load_manifest(str(manifest)) == {
+        'workers': 2, 'defaults': {'output': '/tmp', 'full': True},
+        'jobs': [{'id': 0, 'input': 'a.json', 'output': '/tmp', 'full': True},
+                 {'id': 'b', 'input': 'b.json', 'output': '/tmp', 'full': False}]}
+    manifest.write_text(json.dumps([{'input': 'a.json'}]))
+    assert load_manifest(str(manifest)) == {'jobs': [{'id': 0, 'input': 'a.json'}]}
+    manifest.write_text(json.dumps([{'input': 'a.json'}, {'output': '/tmp'}]))
+    with pytest.raises(ValueError, match='job 1'):
+        load_manifest(str(manifest))
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_run_batch(artists, workers):
+    from reportmaker.batch import run_batch
+    from reportmaker.config import cmd_args
+    saved = vars(cmd_args).copy()
+    statuses = run_batch(artists['jobs'], workers, 1, artists['argv'])
+    assert [(status['id'], status['status']) for status in statuses] == [
+        ('first', 'ok'), ('missing', 'error'), ('second', 'ok')]
+    assert statuses[1]['error'] and statuses[1]['file'] is None
+    for job, status in zip(artists['jobs'][::2], statuses[::2]):
+        assert status['file'] == f"{job['output']}/artists.csv"
+        with open(status['file']) as output:
+            assert output.read().splitlines() == ['ArtistId,Name', '1.0,AC/DC', '2.0,Accept', '3.0,Aerosmith']
+    assert vars(cmd_args) == saved
+
+
+def test_main_stdout(artists, tmp_path, database):
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps({'jobs': artists['jobs']}))
+    root = os.path.dirname(os.path.dirname(artists['config']))
+    process = subprocess.run([sys.executable, 'batch.py', '-m', str(manifest), '-w', '0', '-c', artists['config'],
+                              '-d', f'driver=sqlite3;database={database}', '--no-cache', '-f', '0.001',
+                              '--progress', 'stdout', '-l', 'WARNING'],
+                             cwd=root, env=dict(os.environ, PYTHONPATH=os.path.dirname(root)), capture_output=True,
+                             text=True, timeout=120)
+    assert process.returncode == 1, process.stderr
+    assert [status['status'] for status in json.loads(process.stdout)] == ['ok', 'error', 'ok']
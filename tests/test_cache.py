@@ -0,0 +1,182 @@
+import os
+import json
+import zlib
+import types
+import pytest
+from decimal import Decimal
+from datetime import datetime, date, time, timedelta
+from reportmaker.utils import cache
+from reportmaker.utils.cache import QueryCache, ChartCache
+
+SQL = 'select TrackId, Name, UnitPrice from Track where AlbumId = ? order by TrackId'
+
+
+@pytest.fixture
+def clock(monkeypatch) -> list:
+    """
+    Cache time (clock[0] is current time)
+    """
+    now = [1000000.0]
+    monkeypatch.setattr(cache, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def write_entry(query_cache: QueryCache, key: str, cursor) -> list:
+    writer = query_cache.writer(key, [column[0] for column in cursor.description])
+    batches = [cursor.fetchmany(5), cursor.fetchall()]
+    for batch in batches:
+        writer.write(batch)
+    writer.commit()
+    return batches
+
+
+def test_key():
+    key = QueryCache.key(SQL, 'driver=sqlite3', (1,))
+    assert key == QueryCache.key(f'  {SQL.replace(" ", chr(10))} ; ', 'driver=sqlite3', [1])
+    assert key != QueryCache.key(SQL, 'driver=sqlite3', (2,))
+    assert key != QueryCache.key(SQL, 'driver=psycopg2', (1,))
+    assert key != QueryCache.key(SQL, 'driver=sqlite3', (1,), {'integer': 'float'})
+
+
+def test_key_literals():
+    sql = "select * from Artist where Name = 'a  b' -- x\n and  1 = 1"
+    assert QueryCache.key(sql, 'chinook') != QueryCache.key(sql.replace('a  b', 'a b'), 'chinook')
+    assert QueryCache.key(sql, 'chinook') != QueryCache.key(sql.replace('\n', ' '), 'chinook')
+    assert QueryCache.key(sql, 'chinook') == QueryCache.key(sql.replace(' and  1', '   and 1') + ';', 'chinook')
+    assert QueryCache.key('select "a  b" from t', 'chinook') != QueryCache.key('select "a b" from t', 'chinook')
+
+
+def test_miss_and_hit(tmp_path, connection, clock):
+    query_cache, key = QueryCache(str(tmp_path / 'cache')), QueryCache.key(SQL, 'chinook', (1,))
+    assert query_cache.open(key, 60) is None
+    batches = write_entry(query_cache, key, connection.execute(SQL, (1,)))
+    assert (query_cache.hits, query_cache.misses) == (0, 1)
+    assert oct(os.stat(query_cache.directory).st_mode & 0o777) == oct(0o700)
+    reader = query_cache.open(key, 60)
+    assert reader.columns == ['TrackId', 'Name', 'UnitPrice']
+    assert list(reader.batches()) == batches
+    assert (query_cache.hits, query_cache.misses) == (1, 1)
+
+
+def test_ttl(tmp_path, connection, clock):
+    query_cache, key = QueryCache(str(tmp_path / 'cache')), QueryCache.key(SQL, 'chinook', (2,))
+    write_entry(query_cache, key, connection.execute(SQL, (2,)))
+    clock[0] += 60
+    reader = query_cache.open(key, 60)
+    assert reader is not None
+    reader.close()
+    clock[0] += 1
+    assert query_cache.open(key, 60) is None
+    assert query_cache.hits == 1
+
+
+def test_values(tmp_path):
+    query_cache, key = QueryCache(str(tmp_path / 'cache')), 'values'
+    row = (Decimal('0.99'), datetime(2020, 1, 2, 3, 4, 5), date(2020, 1, 2), time(3, 4), timedelta(days=1.5),
+           b'\x00\xff', None, 'текст', 1.5, 2 ** 63)
+    writer = query_cache.writer(key, ['value'] * len(row))
+    writer.write([row])
+    writer.commit()
+    assert list(query_cache.open(key, 60).batches()) == [[row]]
+
+
+def test_unsupported_value(tmp_path):
+    query_cache = QueryCache(str(tmp_path / 'cache'))
+    writer = query_cache.writer('object', ['value'])
+    writer.write([(object(),)])
+    writer.commit()
+    assert writer.failed
+    assert query_cache.open('object', 60) is None
+    assert not os.listdir(query_cache.directory)
+
+
+def test_corrupted_entry(tmp_path):
+    query_cache = QueryCache(str(tmp_path / 'cache'))
+    query_cache.check_directory(create=True)
+    with open(query_cache.path('corrupted'), 'wb') as entry:
+        entry.write(b'\x10\x00\x00\x00not compressed')
+    assert query_cache.open('corrupted', 60) is None
+
+
+def test_evict(tmp_path, connection):
+    query_cache = QueryCache(str(tmp_path / 'cache'))
+    keys = [QueryCache.key(SQL, 'chinook', (album,)) for album in range(1, 4)]
+    for i, key in enumerate(keys):
+        write_entry(query_cache, key, connection.execute(SQL, (i + 1,)))
+        os.utime(query_cache.path(key), (1000 + i, 1000 + i))
+    query_cache.max_size = sum(os.path.getsize(query_cache.path(key)) for key in keys[1:])
+    query_cache.evict()
+    assert [os.path.exists(query_cache.path(key)) for key in keys] == [False, True, True]
+
+
+def test_shared_directory(tmp_path, connection):
+    directory = tmp_path / 'cache'
+    directory.mkdir()
+    directory.chmod(0o777)
+    query_cache, key = QueryCache(str(directory)), QueryCache.key(SQL, 'chinook', (1,))
+    with pytest.raises(PermissionError):
+        write_entry(query_cache, key, connection.execute(SQL, (1,)))
+    directory.chmod(0o700)
+    write_entry(query_cache, key, connection.execute(SQL, (1,)))
+    directory.chmod(0o777)
+    assert query_cache.open(key, 60) is None
+    directory.chmod(0o755)
+    assert query_cache.open(key, 60) is not None
+    assert oct(directory.stat().st_mode & 0o777) == oct(0o700)
+
+
+########################################################################################################################
+#                                                   Chart cache                                                        #
+########################################################################################################################
+
+
+def pie_drawing():
+    from reportlab.graphics.shapes import Drawing
+    from reportlab.graphics.charts.piecharts import Pie
+    from reportmaker.formats.pdf import PdfDocument
+    drawing, pie = Drawing(300, 200), Pie()
+    pie.x, pie.y, pie.width, pie.height, pie.data, pie.labels = 50, 20, 150, 150, [10, 20, 30], ['a', 'b', 'в']
+    pie.slices.strokeDashArray = [2, 2]
+    drawing.add(pie)
+    return PdfDocument._expand_drawing(drawing)
+
+
+def draw(drawing) -> bytes:
+    from reportlab import rl_config
+    from reportlab.graphics import renderPDF
+    invariant, rl_config.invariant = rl_config.invariant, 1
+    try:
+        return renderPDF.drawToString(drawing)
+    finally:
+        rl_config.invariant = invariant
+
+
+def test_chart_drawing_persisted(tmp_path):
+    expanded = []
+    chart_cache = ChartCache(str(tmp_path / 'cache'))
+    drawing = chart_cache.drawing('pie', lambda: expanded.append(pie_drawing()) or expanded[-1])
+    assert os.path.exists(chart_cache.path('pie', '.rmd'))
+    chart_cache = ChartCache(str(tmp_path / 'cache'))
+    loaded = chart_cache.drawing('pie', lambda: expanded.append(pie_drawing()) or expanded[-1])
+    assert len(expanded) == 1 and (chart_cache.hits, chart_cache.misses) == (1, 0)
+    assert loaded is not drawing
+    assert draw(loaded) == draw(drawing)
+
+
+def test_chart_drawing_tampered(tmp_path):
+    chart_cache = ChartCache(str(tmp_path / 'cache'))
+    chart_cache.check_directory(create=True)
+    with open(chart_cache.path('tampered', '.rmd'), 'wb') as entry:
+        entry.write(zlib.compress(json.dumps({cache.SHAPE_TAG: 'os:system', 'attributes': {}}).encode('utf8')))
+    assert chart_cache.drawing('tampered', lambda: 'expanded') == 'expanded'
+    assert chart_cache.misses == 1
+    with pytest.raises(ValueError):
+        cache.decode_shape({cache.SHAPE_TAG: 'reportlab.graphics.shapes:os', 'attributes': {}})
+
+
+def test_chart_drawing_not_persisted(tmp_path):
+    chart_cache = ChartCache(str(tmp_path / 'cache'))
+    drawing = types.SimpleNamespace()
+    assert chart_cache.drawing('object', lambda: drawing) is drawing
+    assert chart_cache.drawing('object', lambda: None) is drawing
+    assert not os.path.exists(chart_cache.directory)
@@ -0,0 +1,54 @@
+from array import array
+from reportmaker.utils.dataset import Dataset
+
+
+def album_dataset(connection) -> Dataset:
+    cursor = connection.execute('select AlbumId, Title, ArtistId from Album where ArtistId < 4 order by AlbumId')
+    return Dataset.from_batches([column[0] for column in cursor.description], [cursor.fetchmany(2), cursor.fetchall()])
+
+
+def test_from_batches(connection):
+    dataset = album_dataset(connection)
+    assert dataset.columns == ['AlbumId', 'Title', 'ArtistId']
+    assert dataset.dtypes == ['int', 'str', 'int']
+    assert isinstance(dataset.column('AlbumId'), array)
+    assert dataset.rows_count == len(dataset) == 5
+    assert dataset.row(0) == [1, 'For Those About To Rock We Salute You', 1]
+    assert list(dataset.column(2)) == [1, 2, 2, 1, 3]
+
+
+def test_select(connection):
+    dataset = album_dataset(connection)
+    selected = dataset.select(['ArtistId', 0])
+    assert selected.columns == ['ArtistId', 'AlbumId']
+    assert selected.dtypes == ['int', 'int']
+    assert selected.to_rows(header=False) == [[1, 1], [2, 2], [2, 3], [1, 4], [3, 5]]
+    assert selected.column('AlbumId') is dataset.column('AlbumId')
+
+
+def test_slice(connection):
+    dataset = album_dataset(connection)
+    sliced = dataset.slice(1, 3)
+    assert sliced.columns == dataset.columns and sliced.dtypes == dataset.dtypes
+    assert sliced.to_rows() == [['AlbumId', 'Title', 'ArtistId'], [2, 'Balls to the Wall', 2],
+                                [3, 'Restless and Wild', 2]]
+    assert dataset.slice(3).rows_count == 2
+    assert not dataset.slice(10).to_rows(header=False)
+
+
+def test_transpose(connection):
+    cursor = connection.execute('select MediaTypeId, count(*), sum(Milliseconds) from Track where MediaTypeId < 3 '
+                                'group by MediaTypeId order by MediaTypeId')
+    transposed = Dataset.from_batches(['type', 'tracks', 'length'], [cursor.fetchall()]).transpose()
+    assert transposed.columns == ['1', '2']
+    assert transposed.dtypes == ['int', 'int']
+    assert transposed.to_rows(header=False) == [[3034, 237], [805752392, 66768558]]
+    assert Dataset([]).transpose().columns == []
+
+
+def test_from_rows():
+    dataset = Dataset.from_rows([['a', 'b'], [1, None], [None, 'x'], [2.5, 'y']])
+    assert dataset.dtypes == ['object', 'str']
+    assert dataset.to_dict() == {'a': [1, None, 2.5], 'b': [None, 'x', 'y']}
+    assert list(dataset.batches(2)) == [[(1, None), (None, 'x')], [(2.5, 'y')]]
+    assert Dataset.from_rows([]).rows_count == 0
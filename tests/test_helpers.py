@@ -0,0 +1,133 @@
+import pytest
+from datetime import date, datetime
+from reportmaker.utils.pool import connection_pool
+from reportmaker.utils.helpers import bind_parameters, prepare_statement, set_config, ReportError
+
+
+class FakeCursor:
+
+    def __init__(self, executed: list):
+        self._executed = executed
+
+    def execute(self, sql: str):
+        self._executed.append(sql)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """
+    psycopg2-like connection, which records executed sql
+    """
+
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self.executed)
+
+    def close(self):
+        pass
+
+
+########################################################################################################################
+#                                                 bind_parameters                                                      #
+########################################################################################################################
+
+
+def test_bind_parameters_sqlite(connection):
+    sql, parameters = bind_parameters('select TrackId from Track where AlbumId = {{album}} and Name <> {{name}} '
+                                      'order by TrackId', {'album': 1, 'name': 'Balls to the Wall'}, 'sqlite3')
+    assert sql == 'select TrackId from Track where AlbumId = ? and Name <> ? order by TrackId'
+    assert parameters == [1, 'Balls to the Wall']
+    assert [row[0] for row in connection.execute(sql, parameters)] == [1, 6, 7, 8, 9, 10, 11, 12, 13, 14]
+
+
+def test_bind_parameters_whole_literal(connection):
+    sql, parameters = bind_parameters("select ArtistId from Artist where Name = '{{name}}'", {'name': 'AC/DC'},
+                                      'sqlite3')
+    assert sql == 'select ArtistId from Artist where Name = ?'
+    assert connection.execute(sql, parameters).fetchall() == [(1,)]
+
+
+def test_bind_parameters_date():
+    assert bind_parameters('select {{day}}', {'day': date(2020, 1, 2)}, 'sqlite3') == ('select ?', ['2020-01-02'])
+    assert bind_parameters('select {{day}}', {'day': date(2020, 1, 2)}, 'psycopg2') == \
+        ('select %s', [date(2020, 1, 2)])
+
+
+def test_bind_parameters_datetime(connection):
+    sql, parameters = bind_parameters('select InvoiceId from Invoice where InvoiceDate >= {{since}}',
+                                      {'since': datetime(2013, 12, 22)}, 'sqlite3')
+    assert parameters == ['2013-12-22 00:00:00']
+    assert connection.execute(sql, parameters).fetchall() == [(412,)]
+    sql, parameters = bind_parameters('select count(*) from Invoice where date(InvoiceDate) = {{day}}',
+                                      {'day': date(2013, 12, 22)}, 'sqlite3')
+    assert connection.execute(sql, parameters).fetchall() == [(1,)]
+
+
+def test_bind_parameters_inside_literal():
+    with pytest.raises(ReportError):
+        bind_parameters("select * from Track where Name like '%{{name}}%'", {'name': 'Love'}, 'sqlite3')
+
+
+def test_bind_parameters_not_bound():
+    sql = 'select "{{id}}", {{other}} from Track -- {{id}}\n/* {{id}} */'
+    assert bind_parameters(sql, {'id': 1}, 'sqlite3') == (sql, [])
+    sql = "select * from Track where Name like '%{{name}}%'"
+    assert bind_parameters(sql, {}, 'sqlite3') == (sql, [])
+    assert bind_parameters(sql, {'id': 1}, 'psycopg2') == (sql, [])
+
+
+def test_bind_parameters_comments_kept():
+    sql, parameters = bind_parameters('select {{id}} -- {{id}}\n/* {{id}} */ from "{{id}}"', {'id': 1}, 'sqlite3')
+    assert sql == 'select ? -- {{id}}\n/* {{id}} */ from "{{id}}"'
+    assert parameters == [1]
+
+
+def test_bind_parameters_psycopg2_percent():
+    sql, parameters = bind_parameters("select 100 % {{id}}, '50%'", {'id': 3}, 'psycopg2')
+    assert sql == "select 100 %% %s, '50%%'"
+    assert parameters == [3]
+
+
+########################################################################################################################
+#                                                prepare_statement                                                     #
+########################################################################################################################
+
+
+def test_prepare_statement():
+    connection = FakeConnection()
+    try:
+        sql = "select * from Track where TrackId > %s and Name like '50%%' and AlbumId = %s"
+        assert prepare_statement(connection, sql, [1, 2]) == 'EXECUTE report_0 (%s, %s)'
+        assert connection.executed == [
+            "PREPARE report_0 AS select * from Track where TrackId > $1 and Name like '50%' and AlbumId = $2"]
+        assert prepare_statement(connection, sql, [3, 4]) == 'EXECUTE report_0 (%s, %s)'
+        assert prepare_statement(connection, 'select %s', [5]) == 'EXECUTE report_1 (%s)'
+        assert len(connection.executed) == 2
+        assert connection_pool.statements(connection) == {sql: 'report_0', 'select %s': 'report_1'}
+    finally:
+        connection_pool._close(connection)
+    assert id(connection) not in connection_pool._statements
+
+
+########################################################################################################################
+#                                                   set_config                                                         #
+########################################################################################################################
+
+
+def test_set_config(tmp_path, capsys):
+    config = tmp_path / 'config.json'
+    config.write_text('{"chart_workers": 2}')
+    assert set_config(str(config)) == {'chart_workers': 2}
+    for content in (None, '{"chart_workers": }'):
+        if content is None:
+            config.unlink()
+        else:
+            config.write_text(content)
+        with pytest.raises(SystemExit):
+            set_config(str(config))
+        output = capsys.readouterr()
+        assert not output.out and output.err.startswith(str(config))
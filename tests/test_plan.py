@@ -0,0 +1,53 @@
+from reportmaker.utils.plan import DescriptorPlan
+
+# Template is not valid json before substitution ('chunkRows' placeholder out of string)
+TEMPLATE = '''{"document": {
+    "format": "csv",
+    "file_name": "artists.csv",
+    "title": "Artist {{name}}",
+    "parameters": {"name": "str"},
+    "layout": [
+        {"type": "Table", "chunkRows": {{rows}},
+         "data": {"sql": ["select ArtistId, Name from Artist where Name = {{name}}"]}}
+    ]
+}}'''
+
+INJECTION = "'x' or 1=1"
+
+
+def test_bind_compiled():
+    plan = DescriptorPlan(TEMPLATE.replace('{{rows}}', '10'))
+    assert plan.compiled
+    descriptor = plan.bind({'name': INJECTION})
+    assert descriptor['document']['title'] == f'Artist {INJECTION}'
+    assert descriptor['document']['layout'][0]['data']['sql'] == [
+        'select ArtistId, Name from Artist where Name = {{name}}']
+
+
+def test_bind_uncompiled():
+    plan = DescriptorPlan(TEMPLATE)
+    assert not plan.compiled
+    descriptor = plan.bind({'name': INJECTION, 'rows': '10'})
+    assert descriptor['document']['title'] == f'Artist {INJECTION}'
+    assert descriptor['document']['layout'][0]['chunkRows'] == 10
+    assert descriptor['document']['layout'][0]['data']['sql'] == [
+        'select ArtistId, Name from Artist where Name = {{name}}']
+    assert plan.bind({'name': 'a "quoted" name', 'rows': '1'})['document']['title'] == 'Artist a "quoted" name'
+
+
+def test_bind_uncompiled_not_declared():
+    plan = DescriptorPlan(TEMPLATE.replace('"parameters": {"name": "str"},', ''))
+    descriptor = plan.bind({'name': "'AC/DC'", 'rows': '10'})
+    assert descriptor['document']['layout'][0]['data']['sql'] == [
+        "select ArtistId, Name from Artist where Name = 'AC/DC'"]
+
+
+def test_uncompiled_sql_is_bound(cmd_args):
+    from reportmaker.formats.csv import CsvDocument
+    plan = DescriptorPlan(TEMPLATE)
+    for name, rows in ((INJECTION, []), ('AC/DC', ['1.0,AC/DC'])):
+        cmd_args.parameters = {'name': name, 'rows': '10'}
+        document = CsvDocument(plan.bind({'name': name, 'rows': '10'}))
+        document.generate_document()
+        with open(document._file_name) as output:
+            assert output.read().splitlines() == ['ArtistId,Name'] + rows
@@ -0,0 +1,110 @@
+import sqlite3
+import threading
+from reportmaker.utils.pool import ConnectionPool, RequestLimit
+
+
+class Connection:
+    """
+    sqlite3 connection, which tells if it is closed (as psycopg2 connection does)
+    """
+
+    def __init__(self, database: str):
+        self._connection = sqlite3.connect(database, check_same_thread=False)
+        self.closed = False
+
+    def __getattr__(self, name: str):
+        return getattr(self._connection, name)
+
+    def close(self):
+        self.closed = True
+        self._connection.close()
+
+
+class BrokenConnection(Connection):
+
+    def rollback(self):
+        raise sqlite3.OperationalError('connection is broken')
+
+
+def test_acquire_release(database):
+    pool, created = ConnectionPool(2), []
+
+    def connect() -> Connection:
+        created.append(Connection(database))
+        return created[-1]
+
+    connection = pool.acquire('chinook', connect)
+    assert connection.execute('select count(*) from Artist').fetchone() == (275,)
+    pool.release('chinook', connection)
+    assert pool.acquire('chinook', connect) is connection
+    assert pool.acquire('other', connect) is not connection
+    assert len(created) == 2
+    pool.release('chinook', connection)
+    pool.close()
+    assert connection.closed and not pool._idle
+
+
+def test_release_rolls_back(database):
+    pool = ConnectionPool()
+    connection = pool.acquire('chinook', lambda: Connection(database))
+    connection.execute('delete from Artist')
+    pool.release('chinook', connection)
+    acquired = pool.acquire('chinook', lambda: Connection(database))
+    assert acquired is connection
+    assert acquired.execute('select count(*) from Artist').fetchone() == (275,)
+    connection.close()
+
+
+def test_release_size_limit(database):
+    pool = ConnectionPool(1)
+    connections = [pool.acquire('chinook', lambda: Connection(database)) for _ in range(3)]
+    for connection in connections:
+        pool.release('chinook', connection)
+    assert pool._idle['chinook'] == connections[:1]
+    assert [connection.closed for connection in connections] == [False, True, True]
+    pool.close()
+
+
+def test_release_broken(database):
+    pool = ConnectionPool()
+    connection = BrokenConnection(database)
+    pool.statements(connection)['select 1'] = 'report_0'
+    pool.release('chinook', connection)
+    assert connection.closed and not pool._idle.get('chinook') and not pool._statements
+
+
+def test_acquire_drops_closed(database):
+    pool = ConnectionPool()
+    closed, alive = Connection(database), Connection(database)
+    for connection in (alive, closed):
+        pool.statements(connection)['select 1'] = 'report_0'
+        pool.release('chinook', connection)
+    closed.close()
+    assert pool.acquire('chinook', lambda: Connection(database)) is alive
+    assert list(pool._statements) == [id(alive)]
+    assert not pool._idle['chinook']
+    alive.close()
+
+
+def test_request_limit():
+    limit, started, finished = RequestLimit(1), threading.Event(), threading.Event()
+    assert limit.acquire(1)
+
+    def request():
+        started.set()
+        if limit.acquire(2):
+            limit.release()
+        finished.set()
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    started.wait()
+    assert not finished.wait(0.1)
+    limit.release()
+    assert finished.wait(5)
+    thread.join()
+    assert limit.acquire(3)
+    limit.urge(4)
+    assert not limit.acquire(4)
+    limit.release()
+    assert limit.used == 0
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import threading
+import http.client
+import pytest
+from http.server import ThreadingHTTPServer
+
+TOKEN = 'secret'
+
+ARTISTS = {
+    'document': {
+        'format': 'csv',
+        'file_name': 'artists.csv',
+        'layout': [{'type': 'Table', 'data': {'sql': ['select ArtistId, Name from Artist where ArtistId <= 2']}}]
+    }
+}
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory, config_file, database) -> dict:
+    """
+    Report server with one worker on free port of localhost. Inputs are allowed in 'input', outputs in 'output'
+    """
+    from reportmaker.server import ReportServer, RequestHandler
+    directory = tmp_path_factory.mktemp('server')
+    for name in ('input', 'output', 'other'):
+        (directory / name).mkdir()
+    (directory / 'input' / 'artists.json').write_text(json.dumps(ARTISTS))
+    (directory / 'input' / 'escape.json').write_text(json.dumps(
+        {'document': dict(ARTISTS['document'], file_name='../other/artists.csv')}))
+    config = json.loads(open(config_file).read())
+    config['connections'] = {'chinook': f'driver=sqlite3;database={database}'}
+    (directory / 'config.json').write_text(json.dumps(config))
+    argv = ['-c', str(directory / 'config.json'), '-i', '-', '-o', str(directory / 'output'), '-d',
+            f'driver=sqlite3;database={database}', '-f', '0', '--no-cache', '-l', 'WARNING']
+    settings = {'token': TOKEN, 'input_roots': [str(directory / 'input')], 'output_roots': [str(directory / 'output')],
+                'callbacks': ['http://localhost:9/report/'], 'connections': ['chinook']}
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # Formats are imported by document_class as 'formats.<format>' (worker processes take path of this process)
+        monkeypatch.syspath_prepend(os.path.dirname(os.path.dirname(config_file)))
+        report_server = ReportServer(1, argv, settings)
+    http_server = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+    http_server.report_server = report_server
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield {'directory': directory, 'port': http_server.server_address[1], 'report_server': report_server}
+    http_server.shutdown()
+    http_server.server_close()
+    report_server.close()
+
+
+def request(server: dict, method: str, path: str, body: dict = None, token: str = TOKEN) -> (int, dict):
+    connection = http.client.HTTPConnection('127.0.0.1', server['port'], timeout=60)
+    try:
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def finished(server: dict, job_id: str) -> dict:
+    for _ in range(600):
+        code, status = request(server, 'GET', f'/jobs/{job_id}')
+        assert code == 200
+        if status['status'] != 'queued':
+            return status
+        time.sleep(0.1)
+    raise TimeoutError(job_id)
+
+
+@pytest.mark.parametrize('job, error', [
+    ({'input': 1}, 'input expected'),
+    ({'input': 'other/artists.json'}, 'input is out of allowed directories'),
+    ({'input': 'input/../other/artists.json'}, 'input is out of allowed directories'),
+    ({'output': 'other'}, 'output is out of allowed directories'),
+    ({'output': 1}, 'output is out of allowed directories'),
+    ({'progress': 'other/progress.json'}, 'progress file is out of allowed directories'),
+    ({'callback_url': 'http://localhost:9/reports'}, 'callback url is not allowed'),
+    ({'callback_url': 'https://localhost:9/report/'}, 'callback url is not allowed'),
+    ({'callback_url': 'http://example.com/report/'}, 'callback url is not allowed'),
+    ({'database': 'driver=sqlite3;database=/tmp/other.sqlite'}, 'database must be named connection of configuration')
+])
+def test_check(server, job, error):
+    job = {key: str(server['directory'] / value) if key in ('input', 'output', 'progress') and isinstance(value, str)
+           else value for key, value in dict({'input': 'input/artists.json'}, **job).items()}
+    with pytest.raises(ValueError, match=error):
+        server['report_server']._check(job)
+
+
+def test_check_allowed(server):
+    directory = server['directory']
+    server['report_server']._check({
+        'input': str(directory / 'input' / 'artists.json'), 'output': str(directory / 'output' / 'artists'),
+        'progress': str(directory / 'output' / 'progress.json'), 'callback_url': 'http://localhost:9/report/done',
+        'database': 'chinook'})
+
+
+@pytest.mark.parametrize('token', [None, 'wrong', TOKEN + ' '])
+def test_unauthorized(server, token):
+    assert request(server, 'GET', '/health', token=token) == (401, {'error': 'unauthorized'})
+    assert request(server, 'POST', '/jobs', {'input': 'artists.json'}, token=token)[0] == 401
+
+
+def test_jobs(server):
+    directory = server['directory']
+    descriptor = str(directory / 'input' / 'artists.json')
+    code, queued = request(server, 'POST', '/jobs', {'id': 'artists', 'input': descriptor, 'database': 'chinook'})
+    assert code == 202 and queued == {'id': 'artists', 'input': descriptor, 'status': 'queued'}
+    status = finished(server, 'artists')
+    assert status['status'] == 'ok', status
+    assert status['file'] == str(directory / 'output' / 'artists.csv')
+    with open(status['file']) as output:
+        assert output.read().splitlines() == ['ArtistId,Name', '1.0,AC/DC', '2.0,Accept']
+    assert request(server, 'POST', '/jobs', {'input': str(directory / 'other' / 'artists.json')}) == (
+        400, {'error': 'input is out of allowed directories'})
+    assert request(server, 'GET', '/jobs/unknown') == (404, {'error': 'job not found'})
+    code, health = request(server, 'GET', '/health')
+    assert code == 200 and health['workers'] == 1 and health['jobs']['ok'] >= 1
+
+
+def test_output_confined(server):
+    directory = server['directory']
+    code, queued = request(server, 'POST', '/jobs', {'input': str(directory / 'input' / 'escape.json')})
+    assert code == 202
+    status = finished(server, queued['id'])
+    assert status['status'] == 'error' and 'out of allowed directories' in status['error']
+    assert not os.path.exists(directory / 'other' / 'artists.csv')
@@ -0,0 +1,134 @@
+import os
+import json
+import sqlite3
+import pytest
+from reportmaker.utils.watermark import Watermark
+
+DESCRIPTOR = {
+    'document': {
+        'format': 'csv',
+        'file_name': 'tracks.csv',
+        'parameters': {'watermark': {'type': 'int', 'default': 0}},
+        'incremental': {'column': 'TrackId'},
+        'layout': [
+            {'type': 'Table', 'data': {'sql': ['select TrackId, Name from Track where TrackId > {{watermark}} '
+                                               'order by TrackId']}}
+        ]
+    }
+}
+
+
+@pytest.fixture
+def tracks(database, chinook, cmd_args, monkeypatch) -> sqlite3.Connection:
+    """
+    Test database with the first 10 tracks (tracks are added by test)
+    """
+    monkeypatch.setattr(cmd_args, 'database', f'driver=sqlite3;database={chinook}')
+    connection = sqlite3.connect(chinook)
+    connection.execute('delete from Track where TrackId > 10')
+    connection.execute('attach database ? as source', (database,))
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+def add_tracks(connection: sqlite3.Connection, last: int):
+    connection.execute('insert into Track select * from source.Track where TrackId > (select max(TrackId) from Track) '
+                       'and TrackId <= ?', (last,))
+    connection.commit()
+
+
+def export(**document_options) -> str:
+    from reportmaker.utils.plan import DescriptorPlan
+    from reportmaker.formats.csv import CsvDocument
+    from reportmaker.formats.tab import TabDocument
+    descriptor = {'document': dict(DESCRIPTOR['document'], **document_options)}
+    document_class = TabDocument if descriptor['document']['format'] == 'tab' else CsvDocument
+    document = document_class(DescriptorPlan(json.dumps(descriptor)).bind({}))
+    document.generate_document()
+    return document._file_name
+
+
+def read_state(file_name: str) -> dict:
+    with open(f'{file_name}.watermark') as state_file:
+        return json.load(state_file)
+
+
+def test_round_trip(tmp_path):
+    file_name = str(tmp_path / 'tracks.csv')
+    watermark = Watermark.load(file_name, 'TrackId', 'watermark', value_type=int)
+    assert not watermark.append and watermark.value is None and not watermark.changed
+    watermark.observe(['TrackId', 'Name'], [(1.0, 'a'), (None, 'b'), (3.0, 'c')])
+    watermark.observe(['TrackId', 'Name'], [(2.0, 'd')])
+    watermark.observe(['Name'], [('e',)])
+    assert watermark.changed and watermark.last == 3 and isinstance(watermark.last, int)
+    open(file_name, 'w').close()
+    watermark.save()
+    loaded = Watermark.load(file_name, 'TrackId', 'watermark', value_type=int)
+    assert loaded.append and loaded.value == 3 and loaded.file == file_name
+    assert not loaded.changed and loaded.last == 3
+    assert not Watermark.load(file_name, 'TrackId', 'watermark', full=True).append
+    assert not Watermark.load(file_name, 'InvoiceId', 'watermark').append
+
+
+def test_large_integer(tmp_path):
+    file_name = str(tmp_path / 'tracks.csv')
+    watermark = Watermark(file_name, 'TrackId', 'watermark', int)
+    watermark.observe(['TrackId'], [(2 ** 53 + 3,)])
+    open(file_name, 'w').close()
+    watermark.save()
+    assert read_state(file_name)['value'] == 2 ** 53 + 3
+    assert Watermark.load(file_name, 'TrackId', 'watermark', value_type=int).value == 2 ** 53 + 3
+
+
+def test_missing_output(tmp_path):
+    file_name = str(tmp_path / 'tracks.csv')
+    watermark = Watermark(file_name, 'TrackId', 'watermark', int)
+    watermark.observe(['TrackId'], [(5,)])
+    watermark.save()
+    assert not Watermark.load(file_name, 'TrackId', 'watermark', value_type=int).append
+
+
+def test_append(tracks, cmd_args):
+    file_name = export()
+    with open(file_name) as output:
+        first = output.read()
+    assert first.splitlines()[0] == 'TrackId,Name'
+    assert len(first.splitlines()) == 11
+    assert read_state(file_name)['value'] == 10 and isinstance(read_state(file_name)['value'], int)
+
+    add_tracks(tracks, 15)
+    assert export() == file_name
+    with open(file_name) as output:
+        appended = output.read()
+    assert appended.startswith(first)
+    assert len(appended.splitlines()) == 16
+    assert appended.splitlines()[11] == '11.0,C.O.D.'
+    assert read_state(file_name)['value'] == 15
+
+    export()
+    with open(file_name) as output:
+        assert output.read() == appended
+    assert read_state(file_name)['value'] == 15
+
+    cmd_args.full = True
+    export()
+    with open(file_name) as output:
+        assert output.read() == appended
+
+
+def test_append_index_rebuilt(tracks):
+    options = {'format': 'tab', 'file_name': 'tracks.ndjson', 'mode': 'ndjson', 'index': True, 'page_size': 4}
+    file_name = export(**options)
+    os.remove(f'{file_name}.idx')
+    add_tracks(tracks, 15)
+    export(**options)
+    with open(f'{file_name}.idx') as index_file:
+        index = json.load(index_file)
+    with open(file_name, 'rb') as output:
+        lines = output.readlines()
+    assert index['rows'] == len(lines) == 15
+    assert index['offsets'] == [sum(len(line) for line in lines[:row]) for row in range(0, 15, 4)]
+    with open(file_name, 'rb') as output:
+        output.seek(index['offsets'][-1])
+        assert json.loads(output.readline())['TrackId'] == 13
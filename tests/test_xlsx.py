@@ -0,0 +1,41 @@
+import json
+import pytest
+
+DESCRIPTOR = {
+    'document': {
+        'format': 'xlsx',
+        'file_name': 'tracks.xlsx',
+        'sheets': ['Tracks', 'Albums'],
+        'layout': [
+            {'type': 'sheet'},
+            {'type': 'Table', 'data': {'sql': ['select TrackId, Name from Track where TrackId <= 250 '
+                                               'order by TrackId']}},
+            {'type': 'sheet'},
+            {'type': 'Table', 'data': {'sql': ['select AlbumId, Title from Album where AlbumId <= 5 order by AlbumId']}}
+        ]
+    }
+}
+
+
+@pytest.mark.parametrize('constant_memory', [False, True])
+def test_max_rows(cmd_args, monkeypatch, constant_memory):
+    openpyxl = pytest.importorskip('openpyxl')
+    from reportmaker.utils.plan import DescriptorPlan
+    from reportmaker.formats import xlsx
+    monkeypatch.setattr(xlsx, 'MAX_ROWS', 100)
+    descriptor = json.loads(json.dumps(DESCRIPTOR))
+    descriptor['document']['constant_memory'] = constant_memory
+    document = xlsx.XlsxDocument(DescriptorPlan(json.dumps(descriptor)).bind({}))
+    document.generate_document()
+
+    workbook = openpyxl.load_workbook(document._file_name, read_only=True)
+    assert workbook.sheetnames == ['Tracks', 'Tracks (2)', 'Tracks (3)', 'Albums']
+    sheets = {name: list(workbook[name].iter_rows(values_only=True)) for name in workbook.sheetnames}
+    for name in ('Tracks', 'Tracks (2)', 'Tracks (3)'):
+        assert sheets[name][0] == ('TrackId', 'Name')
+    assert [len(sheets[name]) for name in workbook.sheetnames] == [100, 100, 53, 6]
+    track_ids = [row[0] for name in ('Tracks', 'Tracks (2)', 'Tracks (3)') for row in sheets[name][1:]]
+    assert track_ids == list(range(1, 251))
+    assert sheets['Tracks (3)'][-1] == (250, 'Macô')
+    assert sheets['Albums'][1] == (1, 'For Those About To Rock We Salute You')
+    workbook.close()